@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+from timeit import default_timer
+
+from crypto_file import Reader, Writer
+
+#  Throughput and latency benchmarks for Reader and Writer
+#  - every case runs on real files, for each file size and chunk size,
+#    in a fresh process, so the peak memory reported is the case's own
+#  - the best of --repeat runs is kept for every metric
+#  - results are written as JSON; --compare reports the change against
+#    an earlier run and fails if a metric got worse than --threshold
+
+MB = 1024 * 1024
+PASSWORD = 'benchmark'
+SMALL_SIZE = 100
+SMALL_TOTAL = 4 * MB
+SEEK_FRACTIONS = (0.0, 0.25, 0.5, 0.75, 1.0)
+SEEK_COUNT = 200
+ID_FIELDS = ('case', 'size_mb', 'chunk_size')
+
+
+# One MB of text lines, repeated to make up the plaintext
+def plaintext_pattern():
+    lines = []
+    size = 0
+    i = 0
+    while size < MB:
+        line = '{:08d} {}\n'.format(i, 'lorem ipsum ' * (i % 10))
+        lines.append(line)
+        size += len(line)
+        i += 1
+    return ''.join(lines)[:MB]
+
+
+def write_plaintext(fname, size, chunk_size):
+    pattern = plaintext_pattern()
+    with Writer(fname, password=PASSWORD, chunk_size=chunk_size) as f:
+        for _ in xrange(size // MB):
+            f.write(pattern)
+
+
+def bench_write(fname, size, chunk_size):
+    start = default_timer()
+    write_plaintext(fname + '.write', size, chunk_size)
+    elapsed = default_timer() - start
+    os.remove(fname + '.write')
+    return {'mb_s': size / float(MB) / elapsed}
+
+
+def bench_read(fname, size, chunk_size):
+    start = default_timer()
+    with Reader(fname, password=PASSWORD, enableSeek=False,
+                chunk_size=chunk_size) as f:
+        while f.read(MB):
+            pass
+    return {'mb_s': size / float(MB) / (default_timer() - start)}
+
+
+def bench_small_write(fname, size, chunk_size):
+    data = 'x' * SMALL_SIZE
+    calls = min(size, SMALL_TOTAL) // SMALL_SIZE
+    start = default_timer()
+    with Writer(fname + '.write', password=PASSWORD,
+                chunk_size=chunk_size) as f:
+        for _ in xrange(calls):
+            f.write(data)
+    elapsed = default_timer() - start
+    os.remove(fname + '.write')
+    return {'calls_s': calls / elapsed}
+
+
+def bench_small_read(fname, size, chunk_size):
+    calls = min(size, SMALL_TOTAL) // SMALL_SIZE
+    with Reader(fname, password=PASSWORD, chunk_size=chunk_size) as f:
+        start = default_timer()
+        for _ in xrange(calls):
+            f.read(SMALL_SIZE)
+        elapsed = default_timer() - start
+    return {'calls_s': calls / elapsed}
+
+
+def bench_readline(fname, size, chunk_size):
+    lines = 0
+    start = default_timer()
+    with Reader(fname, password=PASSWORD, enableSeek=False,
+                chunk_size=chunk_size) as f:
+        for _ in f:
+            lines += 1
+    elapsed = default_timer() - start
+    return {'lines_s': lines / elapsed, 'mb_s': size / float(MB) / elapsed}
+
+
+# Time of a seek and a one value read at fractions of the file
+# + between measurements the reader is moved half the file away,
+#  so no seek is served from the buffered values
+def bench_seek(fname, size, chunk_size):
+    metrics = {}
+    with Reader(fname, password=PASSWORD, chunk_size=chunk_size) as f:
+        for fraction in SEEK_FRACTIONS:
+            pos = min(int(size * fraction), size - 1)
+            total = 0
+            for _ in xrange(SEEK_COUNT):
+                f.seek((pos + size // 2) % size)
+                f.read(1)
+                start = default_timer()
+                f.seek(pos)
+                f.read(1)
+                total += default_timer() - start
+            key = 'seek_{}_us'.format(int(fraction * 100))
+            metrics[key] = total / SEEK_COUNT * 1e6
+    return metrics
+
+
+CASES = {
+    'write': bench_write,
+    'read': bench_read,
+    'small_write': bench_small_write,
+    'small_read': bench_small_read,
+    'readline': bench_readline,
+    'seek': bench_seek,
+}
+
+
+# Run a case in the worker process, adding its peak memory
+def run_case(args):
+    case, fname, size, chunk_size = args
+    metrics = CASES[case](fname, size, chunk_size)
+    metrics['max_rss_kb'] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss
+    return metrics
+
+
+def run_isolated(func, args):
+    pool = Pool(1)
+    try:
+        return pool.apply(func, (args,))
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# Whether a larger value of a metric is better
+def higher_is_better(metric):
+    return metric.endswith('_s')
+
+
+# Keep the best value of every metric
+def best_of(runs):
+    best = {}
+    for metric in runs[0]:
+        values = [run[metric] for run in runs]
+        if higher_is_better(metric):
+            best[metric] = max(values)
+        else:
+            best[metric] = min(values)
+    return best
+
+
+def run_benchmarks(cases, sizes, chunk_sizes, repeat, tmpdir):
+    results = []
+    for size_mb in sizes:
+        for chunk_size in chunk_sizes:
+            fname = os.path.join(tmpdir, 'bench-{}-{}.enc'.format(
+                size_mb, chunk_size))
+            run_isolated(prepare_file, (fname, size_mb * MB, chunk_size))
+            for case in cases:
+                runs = [run_isolated(run_case,
+                                     (case, fname, size_mb * MB, chunk_size))
+                        for _ in xrange(repeat)]
+                result = {'case': case, 'size_mb': size_mb,
+                          'chunk_size': chunk_size}
+                result.update(best_of(runs))
+                results.append(result)
+                report(result)
+            os.remove(fname)
+    return results
+
+
+def prepare_file(args):
+    write_plaintext(*args)
+
+
+# Changes against an earlier run, as (result, metric, ratio, regressed)
+# + ratio is new / old, a regression is a change for the worse by more
+#  than the threshold
+def compare(results, baseline, threshold):
+    old = {}
+    for result in baseline['results']:
+        old[result_id(result)] = result
+
+    changes = []
+    for result in results:
+        before = old.get(result_id(result))
+        if before is None:
+            continue
+        for metric, value in sorted(result.iteritems()):
+            if metric in ID_FIELDS or not before.get(metric):
+                continue
+            ratio = value / float(before[metric])
+            if higher_is_better(metric):
+                regressed = ratio < 1 - threshold
+            else:
+                regressed = ratio > 1 + threshold
+            changes.append((result, metric, ratio, regressed))
+    return changes
+
+
+def result_id(result):
+    return result['case'], result['size_mb'], str(result['chunk_size'])
+
+
+def report(result):
+    metrics = ', '.join('{}={:.1f}'.format(metric, value)
+                        for metric, value in sorted(result.iteritems())
+                        if metric not in ID_FIELDS)
+    sys.stderr.write('{case} {size_mb}MB chunk={chunk_size}: {}\n'.format(
+        metrics, **result))
+
+
+def parse_chunk_size(value):
+    return value if value == 'auto' else int(value)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark Reader and Writer throughput and latency.')
+    parser.add_argument('--cases', default=','.join(sorted(CASES)),
+                        help='comma separated cases to run')
+    parser.add_argument('--sizes', default='1,16',
+                        help='comma separated file sizes in MB')
+    parser.add_argument('--chunk-sizes', default='16384,262144,auto',
+                        help="comma separated chunk sizes, or 'auto'")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of every case, the best is kept')
+    parser.add_argument('--tmpdir', help='directory for the benchmark files')
+    parser.add_argument('-o', '--output', help='write the JSON results here')
+    parser.add_argument('--compare',
+                        help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change counted as a regression')
+    args = parser.parse_args(argv)
+
+    args.cases = args.cases.split(',')
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error('unknown cases: {}'.format(', '.join(sorted(unknown))))
+    args.sizes = [int(size) for size in args.sizes.split(',')]
+    args.chunk_sizes = [parse_chunk_size(chunk_size)
+                        for chunk_size in args.chunk_sizes.split(',')]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp(dir=args.tmpdir)
+    try:
+        results = run_benchmarks(args.cases, args.sizes, args.chunk_sizes,
+                                 args.repeat, tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    output = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if args.compare is None:
+        return 0
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    regressions = 0
+    for result, metric, ratio, regressed in compare(
+            results, baseline, args.threshold):
+        sys.stderr.write('{}{} {}MB chunk={} {}: {:+.1f}%\n'.format(
+            'REGRESSION ' if regressed else '', result['case'],
+            result['size_mb'], result['chunk_size'], metric,
+            (ratio - 1) * 100))
+        regressions += regressed
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
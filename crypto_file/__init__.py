@@ -1,3 +1,9 @@
 from crypto_handler import CryptoHandler  # noqa: F401
 from reader import Reader  # noqa: F401
 from writer import Writer  # noqa: F401
+from parallel import decrypt_file  # noqa: F401
+from rotate import rekey, rekey_inplace, rekey_files  # noqa: F401
+from keys import Key, KeyRing  # noqa: F401
+from archive import ArchiveReader, ArchiveWriter  # noqa: F401
+from cache import ChunkCache  # noqa: F401
+from ranges import plan_ranges, RangeReader  # noqa: F401
@@ -0,0 +1,166 @@
+import struct
+from collections import OrderedDict
+
+from crypto_file import Reader, Writer
+
+#  Archive of many members in one encrypted file
+#  - members are written one after another into the plaintext of a single
+#    encrypted file, so adding or reading one costs no open(), key setup
+#    or cipher of its own
+#  - the plaintext ends with an index of the member names, offsets and
+#    sizes, and a trailer locating the index; both are encrypted along
+#    with the members
+#  - a member is read by seeking to its offset, which only decrypts the
+#    cipher blocks holding it
+
+ARCHIVE_MAGIC = 'CrArchiv'
+TRAILER = struct.Struct('>QQ8s')
+ENTRY = struct.Struct('>QQH')
+COPY_SIZE = 1024 * 1024
+
+
+def dump_index(members):
+    entries = []
+    for name, (offset, size) in members.iteritems():
+        entries.append(ENTRY.pack(offset, size, len(name)))
+        entries.append(name)
+    return ''.join(entries)
+
+
+def load_index(s, count):
+    members = OrderedDict()
+    pos = 0
+    for _ in xrange(count):
+        offset, size, length = ENTRY.unpack_from(s, pos)
+        pos += ENTRY.size
+        members[s[pos:pos + length]] = (offset, size)
+        pos += length
+    return members
+
+
+# Member names are stored as UTF-8
+def member_name(name):
+    if isinstance(name, unicode):  # noqa: F821
+        name = name.encode('utf-8')
+    if len(name) > 0xffff:
+        raise ValueError('Member name is too long')
+    return name
+
+
+class ArchiveWriter(object):
+
+    def __init__(self, fname, password=None, key=None, saveKey_file=None,
+                 chunk_size=None, segment_size=None, workers=None,
+                 write_behind=None):
+        self.writer = Writer(fname, password, key, saveKey_file,
+                             chunk_size=chunk_size,
+                             segment_size=segment_size, workers=workers,
+                             write_behind=write_behind)
+
+        # Name of every member with its plaintext offset and size
+        self.members = OrderedDict()
+        self.offset = 0
+
+    # Add a member from a string or a binary file object
+    def add(self, name, data):
+        name = member_name(name)
+        if name in self.members:
+            raise ValueError('Member {} already in archive'.format(name))
+
+        size = 0
+        if hasattr(data, 'read'):
+            while True:
+                chunk = data.read(COPY_SIZE)
+                if not chunk:
+                    break
+                self.writer.write(chunk)
+                size += len(chunk)
+        else:
+            self.writer.write(data)
+            size = len(data)
+
+        self.members[name] = (self.offset, size)
+        self.offset += size
+
+    # Write the index and trailer after the members
+    def close(self):
+        if self.writer.fObj.closed:
+            return
+        self.writer.write(dump_index(self.members))
+        self.writer.write(TRAILER.pack(self.offset, len(self.members),
+                                       ARCHIVE_MAGIC))
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ArchiveReader(object):
+
+    def __init__(self, fname, password=None, key=None, chunk_size=None,
+                 use_mmap=False):
+        self.reader = Reader(fname, password, key, chunk_size=chunk_size,
+                             use_mmap=use_mmap)
+        try:
+            self.members = self.read_index()
+        except Exception:
+            self.reader.close()
+            raise
+
+    # Locate the index from the trailer at the end of the plaintext
+    def read_index(self):
+        if self.reader.codec:
+            raise IOError('Archives cannot be compressed')
+
+        size = self.reader.size
+        if size >= TRAILER.size:
+            self.reader.seek(size - TRAILER.size)
+            index_offset, count, magic = TRAILER.unpack(
+                self.reader.read(TRAILER.size))
+            if magic == ARCHIVE_MAGIC and index_offset <= size:
+                self.reader.seek(index_offset)
+                index = self.reader.read(
+                    size - TRAILER.size - index_offset)
+                return load_index(index, count)
+        raise IOError('Not an archive, or wrong key')
+
+    def names(self):
+        return self.members.keys()
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, name):
+        return member_name(name) in self.members
+
+    def __iter__(self):
+        return iter(self.members)
+
+    # Plaintext size of a member
+    def getsize(self, name):
+        return self.members[member_name(name)][1]
+
+    def read(self, name):
+        offset, size = self.members[member_name(name)]
+        self.reader.seek(offset)
+        return self.reader.read(size)
+
+    # Every member with its contents, in the order they were added
+    # + members are contiguous, so this is one pass over the file
+    def iteritems(self):
+        if self.members:
+            self.reader.seek(0)
+        for name, (offset, size) in self.members.iteritems():
+            yield name, self.reader.read(size)
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,80 @@
+import os
+import threading
+from collections import OrderedDict
+
+#  Cache of decrypted chunks shared by Readers
+#  - a Reader given cache=True decrypts a file a chunk of cipher blocks at
+#    a time through the process wide CHUNK_CACHE, so reopening a hot file
+#    serves its values without running the cipher again
+#  - chunks are keyed by the key, the file's identity (path, device,
+#    inode, size and modification time) and the chunk index; a changed
+#    file has another identity, its old chunks age out of the cache
+#  - the cache holds up to max_size decrypted values, dropping the least
+#    recently used chunks
+
+
+class ChunkCache(object):
+    DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+    DEFAULT_CHUNK_BLOCKS = 4096
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE,
+                 chunk_blocks=DEFAULT_CHUNK_BLOCKS):
+        self.max_size = max_size
+        self.chunk_blocks = chunk_blocks
+        self.chunks = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Identity of an open file, None if it has no file to look at
+    @staticmethod
+    def file_id(fObj, name):
+        try:
+            stat = os.fstat(fObj.fileno())
+        except (AttributeError, TypeError, ValueError, OSError):
+            return None
+        return (name, stat.st_dev, stat.st_ino, stat.st_size,
+                stat.st_mtime)
+
+    # Decrypted chunk for a key, made by make(*args) when not cached
+    def lookup(self, ident, make, *args):
+        with self.lock:
+            chunk = self.chunks.pop(ident, None)
+            if chunk is not None:
+                self.hits += 1
+                self.chunks[ident] = chunk
+                return chunk
+            self.misses += 1
+
+        # Decrypted outside the lock, other readers are not held up
+        chunk = make(*args)
+        if len(chunk) > self.max_size:
+            return chunk
+        with self.lock:
+            old = self.chunks.pop(ident, None)
+            if old is not None:
+                self.size -= len(old)
+            self.chunks[ident] = chunk
+            self.size += len(chunk)
+            while self.size > self.max_size:
+                self.size -= len(self.chunks.popitem(last=False)[1])
+        return chunk
+
+    # Drop the chunks of a file, e.g. after it was rewritten in place
+    # within the resolution of its modification time
+    def invalidate(self, name):
+        with self.lock:
+            for ident in [ident for ident in self.chunks
+                          if ident[1][0] == name]:
+                self.size -= len(self.chunks.pop(ident))
+
+    def clear(self):
+        with self.lock:
+            self.chunks.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+
+CHUNK_CACHE = ChunkCache()
@@ -0,0 +1,287 @@
+import argparse
+import getpass
+import glob
+import os
+import sys
+from itertools import imap
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer
+
+from crypto_file import Reader, Writer
+from crypto_file.line_index import LineIndex
+from crypto_file.rotate import rekey, replace_file
+
+#  crypto-file command line tool
+#  - encrypts, decrypts or re-keys files, directory trees and glob patterns
+#  - files are handled by a pool of worker processes, each output is
+#    written to a '.part' file and renamed once complete
+#  - completed files are recorded in an optional journal, so a rerun
+#    picks up where an interrupted one stopped
+#  - existing outputs are only replaced with --force, and a wrong key
+#    fails the file before its output is replaced
+#  - '-' streams stdin to stdout
+
+COPY_SIZE = 1024 * 1024
+PASSWORD_ENV = 'CRYPTO_FILE_PASSWORD'
+NEW_PASSWORD_ENV = 'CRYPTO_FILE_NEW_PASSWORD'
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = get_options(args)
+
+    if args.paths == ['-']:
+        src = os.fdopen(sys.stdin.fileno(), 'rb')
+        dst = os.fdopen(sys.stdout.fileno(), 'wb')
+        process_stream(args.command, src, dst, options)
+        return 0
+
+    journal = load_journal(args.journal)
+    tasks = []
+    failed = 0
+    for src, root in collect_files(args.paths, args.command, args.suffix):
+        if src is None:
+            report('No such file or directory: {}'.format(root))
+            failed += 1
+        elif os.path.abspath(src) not in journal:
+            dst = target_path(args.command, src, root, args.suffix,
+                              args.output_dir)
+            tasks.append((args.command, src, dst, options))
+
+    return run_tasks(tasks, args, failed)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='crypto-file',
+        description='Encrypt, decrypt or re-key files in bulk.')
+    commands = parser.add_subparsers(dest='command')
+
+    for command, description in (
+            ('encrypt', 'encrypt files'),
+            ('decrypt', 'decrypt files'),
+            ('rekey', 'encrypt files again with a new key')):
+        sub = commands.add_parser(command, help=description)
+        sub.add_argument('paths', nargs='+',
+                         help="files, directories or glob patterns; "
+                              "'-' streams stdin to stdout")
+        sub.add_argument('-p', '--password',
+                         help='password, or ${} (prompted for '
+                              'otherwise)'.format(PASSWORD_ENV))
+        sub.add_argument('-k', '--key', help='base64 key or .key file')
+        sub.add_argument('-o', '--output-dir',
+                         help='write outputs under this directory')
+        sub.add_argument('-s', '--suffix', default='.enc',
+                         help='suffix of encrypted files (default .enc)')
+        sub.add_argument('-j', '--workers', type=int, default=cpu_count(),
+                         help='number of worker processes')
+        sub.add_argument('--journal',
+                         help='record completed files here and skip them '
+                              'when run again')
+        sub.add_argument('-q', '--quiet', action='store_true',
+                         help='only report errors')
+        sub.add_argument('-f', '--force', action='store_true',
+                         help='replace outputs that already exist')
+        if command == 'encrypt':
+            sub.add_argument('--compression',
+                             choices=['zlib', 'gzip', 'bz2', 'lzma'])
+        if command == 'rekey':
+            sub.add_argument('--new-password',
+                             help='new password, or ${}'.format(
+                                 NEW_PASSWORD_ENV))
+            sub.add_argument('--new-key', help='new base64 key or .key file')
+
+    args = parser.parse_args(argv)
+    if '-' in args.paths and len(args.paths) > 1:
+        parser.error("'-' cannot be combined with other paths")
+    return args
+
+
+# Credentials and settings handed to the workers
+def get_options(args):
+    options = {'old': get_credentials(args.password, args.key,
+                                      PASSWORD_ENV, 'Password: '),
+               'force': args.force}
+    if args.command == 'encrypt':
+        options['new'] = options.pop('old')
+        options['compression'] = args.compression
+    elif args.command == 'rekey':
+        options['new'] = get_credentials(args.new_password, args.new_key,
+                                         NEW_PASSWORD_ENV, 'New password: ')
+    return options
+
+
+def get_credentials(password, key, env, prompt):
+    if password is None and key is None:
+        password = os.environ.get(env)
+    if password is None and key is None:
+        password = getpass.getpass(prompt)
+    return {'password': password, 'key': key}
+
+
+def load_journal(path):
+    if path is None or not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return set(line.rstrip('\n') for line in f)
+
+
+# Files to process, with the directory their outputs are relative to
+# + directories are walked; encrypt skips files that already have the
+#  suffix, decrypt and rekey only take files with it
+# + (None, path) for paths that match nothing
+def collect_files(paths, command, suffix):
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.endswith(suffix) != (command == 'encrypt'):
+                        yield os.path.join(dirpath, name), path
+        elif os.path.isfile(path):
+            yield path, os.path.dirname(path)
+        else:
+            matches = sorted(glob.glob(path))
+            if not matches:
+                yield None, path
+            for match in matches:
+                if os.path.isfile(match):
+                    yield match, os.path.dirname(match)
+
+
+def target_path(command, src, root, suffix, output_dir=None):
+    dst = src
+    if command == 'encrypt':
+        dst += suffix
+    elif command == 'decrypt':
+        if dst.endswith(suffix):
+            dst = dst[:-len(suffix)]
+        else:
+            dst += '.dec'
+
+    if output_dir is not None:
+        dst = os.path.join(output_dir, os.path.relpath(dst, root or '.'))
+    return dst
+
+
+# Hand the files to the pool, recording and reporting each one done
+def run_tasks(tasks, args, failed=0):
+    journal = None
+    if args.journal is not None:
+        journal = open(args.journal, 'a')
+
+    pool = None
+    results = imap(process_file, tasks)
+    if args.workers > 1 and len(tasks) > 1:
+        pool = Pool(min(args.workers, len(tasks)))
+        results = pool.imap_unordered(process_file, tasks)
+
+    start = default_timer()
+    total = 0
+    try:
+        for done, (src, size, elapsed, error) in enumerate(results, 1):
+            if error is not None:
+                report('{}: {}'.format(src, error))
+                failed += 1
+                continue
+
+            total += size
+            if journal is not None:
+                journal.write(os.path.abspath(src) + '\n')
+                journal.flush()
+            if not args.quiet:
+                report('[{}/{}] {} {}'.format(
+                    done, len(tasks), src, throughput(size, elapsed)))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if journal is not None:
+            journal.close()
+
+    if not args.quiet:
+        report('{} files, {} failed, {}'.format(
+            len(tasks), failed, throughput(total, default_timer() - start)))
+    return 1 if failed else 0
+
+
+# Process one file in a worker, returning (src, size, elapsed, error)
+def process_file(task):
+    command, src, dst, options = task
+    start = default_timer()
+    part = dst + '.part'
+    try:
+        # Files other than the one re-keyed in place are only replaced
+        # when forced
+        if dst != src and os.path.exists(dst) and not options.get('force'):
+            raise IOError('{} exists, use --force to replace it'.format(dst))
+
+        dirname = os.path.dirname(dst)
+        if dirname and not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # Another worker created it first
+                if not os.path.isdir(dirname):
+                    raise
+
+        if command == 'rekey':
+            # By name, so a line index sidecar is carried over
+            size = rekey_stream(src, part, options)
+        else:
+            with open(src, 'rb') as src_file:
+                with open(part, 'wb') as part_file:
+                    size = process_stream(command, src_file, part_file,
+                                          options)
+        replace_file(part, dst)
+    except Exception as e:
+        for name in (part, LineIndex.sidecar_name(part)):
+            if os.path.exists(name):
+                os.remove(name)
+        return src, 0, default_timer() - start, str(e)
+
+    return src, size, default_timer() - start, None
+
+
+# Run a command from one binary file object to another,
+# returning the number of plaintext values handled
+def process_stream(command, src, dst, options):
+    if command == 'rekey':
+        return rekey_stream(src, dst, options)
+    if command != 'encrypt':
+        src = Reader(src, enableSeek=False, **options['old'])
+        src.check_key()
+    else:
+        dst = Writer(dst, compression=options.get('compression'),
+                     **options['new'])
+
+    size = 0
+    try:
+        while True:
+            chunk = src.read(COPY_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
+            size += len(chunk)
+    finally:
+        try:
+            dst.close()
+        finally:
+            src.close()
+    return size
+
+
+def rekey_stream(src, dst, options):
+    old, new = options['old'], options['new']
+    return rekey(src, dst, old['password'], old['key'], new['password'],
+                 new['key'])
+
+
+def throughput(size, elapsed):
+    mb = size / (1024.0 * 1024)
+    return '{:.1f} MB in {:.2f}s ({:.1f} MB/s)'.format(
+        mb, elapsed, mb / max(elapsed, 1e-6))
+
+
+def report(message):
+    sys.stderr.write(message + '\n')
@@ -0,0 +1,67 @@
+import bz2
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    # Python 2 only has lzma through the backports.lzma package
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+#  Compression of the plaintext before encryption
+#  - the codec is recorded by id in the header of the segmented format,
+#    so readers decompress transparently
+#  - compressors and decompressors work on a stream of chunks,
+#    nothing is held in memory beyond the codec's own state
+
+CODECS = {None: 0, 'zlib': 1, 'gzip': 2, 'bz2': 3, 'lzma': 4}
+CODEC_NAMES = dict((codec, name) for name, codec in CODECS.items())
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Compressed values fed to a bz2 or lzma decompressor at once
+# + they cannot limit their output, a slice releases at most what the
+#  codec holds back, for bz2 one block (up to about 46 MB of runs)
+DECOMPRESS_SLICE = 16
+
+
+def get_codec(name):
+    if name not in CODECS:
+        raise ValueError('Unknown compression {}'.format(name))
+    if name == 'lzma' and lzma is None:
+        raise ValueError('lzma compression needs the backports.lzma package')
+    return CODECS[name]
+
+
+def compressor(codec):
+    if codec == CODECS['zlib']:
+        return zlib.compressobj()
+    elif codec == CODECS['gzip']:
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                GZIP_WBITS)
+    elif codec == CODECS['bz2']:
+        return bz2.BZ2Compressor()
+    elif codec == CODECS['lzma'] and lzma is not None:
+        return lzma.LZMACompressor()
+    raise IOError('Compression {} not supported'.format(codec))
+
+
+def decompressor(codec):
+    if codec == CODECS['zlib']:
+        return zlib.decompressobj()
+    elif codec == CODECS['gzip']:
+        return zlib.decompressobj(GZIP_WBITS)
+    elif codec == CODECS['bz2']:
+        return bz2.BZ2Decompressor()
+    elif codec == CODECS['lzma'] and lzma is not None:
+        return lzma.LZMADecompressor()
+    raise IOError('Compression {} not supported'.format(codec))
+
+
+# Push out the values a compressor holds without ending the stream
+# + only zlib and gzip can, the others keep them until the end
+def sync_flush(codec, compressor):
+    if codec in (CODECS['zlib'], CODECS['gzip']):
+        return compressor.flush(zlib.Z_SYNC_FLUSH)
+    return ''
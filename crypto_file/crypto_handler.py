@@ -1,35 +1,67 @@
+import io
+import os
+import struct
 import hashlib
-import base64
 
 from Crypto.Cipher import AES
 
+from crypto_file.keys import KEYRING
+from crypto_file.stats import Stats, instrument
+
 #  AES encrypted file-like object
 #  - Support for Reader and Writer objects
+#  - Files start with a header block: 'Salted__' and the salt, followed by
+#    one CBC chain of cipher blocks
+#  - The segmented format starts with 'CrFileV2' and the salt, followed by
+#    a block holding the segment size; every segment of the plaintext is
+#    a CBC chain of its own, with an IV derived from the salt and the
+#    segment index, and only the last segment is padded
+#  - The second block of the segmented format also holds the id of the
+#    compression codec; a segment size of 0 means one CBC chain
+
+SALTED_MAGIC = 'Salted__'
+SEGMENTED_MAGIC = 'CrFileV2'
+SEGMENT_HEADER = struct.Struct('>IB11x')
 
 
 class CryptoHandler(object):
-    def __init__(self, fname, password=None, key=None, mode=None):
+    # Amount of cipher text handled at once
+    # + auto tuning starts from the file's block size and grows the
+    #  chunk while chunks take less than the target time to process
+    DEFAULT_CHUNK_SIZE = 1024 * AES.block_size
+    MAX_CHUNK_SIZE = 8 * 1024 * 1024
+    TUNE_TARGET_TIME = 0.01
+
+    def __init__(self, fname, password=None, key=None, mode=None,
+                 chunk_size=None, stats=False):
 
         # Create a file handler
         if isinstance(fname, str):
             self.fObj = open(fname, mode)
         elif isinstance(fname, file):  # noqa: F821
-            curr_mode = fname.mode
-            if 'b' in curr_mode:
-                self.fObj = fname
-            else:
-                curr_mode += 'b'
-                tempName = fname.name
-                fname.close()
-                self.fObj = open(tempName, curr_mode)
+            # Used as it is, even in text mode: Python 2 files pass bytes
+            # through unchanged on POSIX, and stdin, stdout or a pipe have
+            # no name to open them again by
+            self.fObj = fname
+        elif hasattr(fname, 'read') or hasattr(fname, 'write'):
+            self.fObj = open_stream(fname, mode)
         else:
             raise IOError("fname must be a string or file")
 
-        self.mode = self.fObj.mode
+        # Streams are used in the requested mode, checked by open_stream
+        self.mode = mode
+        if isinstance(fname, (str, file)):  # noqa: F821
+            self.mode = self.fObj.mode
 
         self.password = password
         self.key = key
         self.bs = AES.block_size
+        self.set_chunk_size(chunk_size)
+
+        # Optionally count bytes, chunks and time spent, see stats.py
+        self.stats = None
+        if stats:
+            instrument(self, Stats(self.name))
 
         # Generate the key
         self.gen_key()
@@ -39,27 +71,16 @@ class CryptoHandler(object):
         self.fileOpen = True
 
     # Create the hashed password and initiation vector for the cipher
+    # + keys come from the process wide KeyRing, so a password or key
+    #  (file) used before is not derived or read again
+    # + a Key object may be passed in as the key
     def gen_key(self):
-
-        # Support a pre-hashed key either saved in a file or passed as a string
-        if isinstance(self.key, str):
-            decoded_key = base64.b64decode(self.key)
-            if self.key.endswith('.key'):
-                self.key = open(self.key, 'rb').read()
-            elif len(decoded_key) == 32:
-                self.key = decoded_key
-            else:
-                msg = "Key {} not supported.".format(self.key)
-                raise NotImplementedError(msg)
-        # Also support a password hashed into a key
-        elif isinstance(self.password, str):
-            self.key = hashlib.sha256(self.password).digest()
-        else:
-            raise ValueError("Key or password is invalid.")
+        key = KEYRING.get(self.password, self.key)
+        self.key = key.key
 
         # Have to create a new password from the key to use in IV
         # - allows for message recovery using key file without password
-        self.password = base64.b64encode(self.key)
+        self.password = key.password
 
     def gen_iv(self):
         iv = ''
@@ -69,11 +90,156 @@ class CryptoHandler(object):
             iv += d_i
         self.iv = iv[:self.bs]
 
+    # Use a fixed chunk size, or 'auto' to tune it while processing
+    def set_chunk_size(self, chunk_size=None):
+        self.autoTune = chunk_size == 'auto'
+        if chunk_size is None:
+            chunk_size = self.DEFAULT_CHUNK_SIZE
+        elif self.autoTune:
+            chunk_size = 16 * self.get_blksize()
+
+        # Whole cipher blocks only
+        chunk_size = min(max(chunk_size, self.bs), self.MAX_CHUNK_SIZE)
+        self.chunk_size = chunk_size - chunk_size % self.bs
+
+    # Preferred I/O size of the underlying file
+    def get_blksize(self):
+        try:
+            blksize = os.fstat(self.fObj.fileno()).st_blksize
+        except (AttributeError, TypeError, ValueError, OSError):
+            blksize = 0
+        return max(blksize, self.DEFAULT_CHUNK_SIZE // 16)
+
+    # Double the chunk size while chunks are quick to process,
+    # so the per call overhead is spread over more data
+    def tune_chunk_size(self, elapsed):
+        if elapsed < self.TUNE_TARGET_TIME:
+            self.chunk_size = min(2 * self.chunk_size, self.MAX_CHUNK_SIZE)
+
+    # CBC cipher with the file's key, starting from an IV
+    def new_cipher(self, iv):
+        return AES.new(self.key, AES.MODE_CBC, iv)
+
+    # Length of the PKCS#7 padding ending the last plaintext block
+    # + anything else is what a wrong key or another file decrypts to
+    def padding_length(self, block):
+        padding_length = ord(block[-1:] or '\x00')
+        if not 0 < padding_length <= self.bs or not block.endswith(
+                padding_length * chr(padding_length)):
+            raise IOError('Wrong key, or not an encrypted file')
+        return padding_length
+
+    # IV of a segment in the segmented format
+    def gen_segment_iv(self, index):
+        index = struct.pack('>Q', index)
+        return hashlib.sha256(self.password + self.salt + index).digest()[
+            :self.bs]
+
+    # Read the header, leaving the file on the first cipher block
+    # + the segmented format has a second header block
+    #  holding the segment size and the compression codec
+    def read_header(self, fObj):
+        header = fObj.read(self.bs)
+        self.salt = header[len(SALTED_MAGIC):]
+        self.header_size = self.bs
+        self.segment_blocks = None
+        self.codec = 0
+
+        if header.startswith(SEGMENTED_MAGIC):
+            segment_size, self.codec = SEGMENT_HEADER.unpack(
+                fObj.read(self.bs))
+            if segment_size:
+                self.segment_blocks = segment_size // self.bs
+            self.header_size += self.bs
+
+    # IV of a cipher block starting a CBC chain, the first block of the
+    # file or of a segment; None for blocks chained to the one before
+    def chain_iv(self, block):
+        if self.segment_blocks is not None:
+            index, segment_block = divmod(block, self.segment_blocks)
+            if segment_block == 0:
+                return self.gen_segment_iv(index)
+        elif block == 0:
+            return self.iv
+        return None
+
+    # Position a file object on a cipher block, returning the block's IV
+    # + the IV is the previous cipher block, except for the first block
+    #  of the file or of a segment
+    def seek_cipher_block(self, fObj, block):
+        offset = self.header_size + block * self.bs
+        iv = self.chain_iv(block)
+        if iv is not None:
+            fObj.seek(offset)
+            return iv
+
+        fObj.seek(offset - self.bs)
+        return fObj.read(self.bs)
+
+    # Number of cipher blocks left in the segment holding a block
+    def segment_remaining(self, block):
+        if self.segment_blocks is None:
+            return None
+        return self.segment_blocks - block % self.segment_blocks
+
+    # Decrypt a run of cipher blocks read from a file object
+    # + independent of the cursor, so runs can be decrypted concurrently
+    #  as long as each uses its own file object
+    # + runs spanning segments are decrypted a segment at a time
+    def decrypt_blocks(self, fObj, block, count):
+        plain = []
+        while count > 0:
+            iv = self.seek_cipher_block(fObj, block)
+            if len(iv) < self.bs:
+                break
+
+            run = min(count, self.segment_remaining(block) or count)
+            crypted = fObj.read(run * self.bs)
+            plain.append(self.new_cipher(iv).decrypt(crypted))
+            block += run
+            count -= run
+
+        return ''.join(plain)
+
     def check_mode(self, mType):
         if not self.mode.startswith(mType):
             msg = 'Requested operation not compatible with current file mode'
             raise IOError(msg)
 
+    # Name of the underlying file, None for streams without one
+    # + files without a path are named like '<stdin>' or '<fdopen>'
+    @property
+    def name(self):
+        name = getattr(self.fObj, 'name', None)
+        if not isinstance(name, str) or (name.startswith('<') and
+                                         name.endswith('>')):
+            return None
+        return name
+
+    @property
+    def closed(self):
+        return self.fObj.closed
+
+    # The file descriptor holds the cipher text, not the values read
+    # or written through this object
+    def fileno(self):
+        raise io.UnsupportedOperation('fileno')
+
+    def isatty(self):
+        return False
+
+    # Whether the underlying file can seek
+    # + Python 2 files have no seekable(), a pipe only tells by failing
+    def file_seekable(self):
+        check = getattr(self.fObj, 'seekable', None)
+        if check is not None:
+            return check()
+        try:
+            self.fObj.tell()
+        except (IOError, OSError):
+            return False
+        return True
+
     def close(self):
         self.fObj.close()
 
@@ -87,3 +253,26 @@ class CryptoHandler(object):
     # Add a weak method to ensure open encryption streams are closed properly
     def __del__(self):
         self.close()
+
+
+# Any other binary file object, e.g. an io.BytesIO, a socket or a pipe
+# + it has to support the operations of the requested mode
+# + raw streams are buffered, so reads and writes are never short
+def open_stream(fObj, mode):
+    if isinstance(fObj, io.TextIOBase):
+        raise IOError('fname must be a binary file object')
+
+    needed = {'r': ['read'], 'w': ['write'], 'r+': ['read', 'write', 'seek']}
+    for operation in needed[mode.replace('b', '')]:
+        check = getattr(fObj, operation + 'able', None)
+        if not (check() if check is not None else hasattr(fObj, operation)):
+            msg = 'Requested operation not compatible with current file mode'
+            raise IOError(msg)
+
+    if isinstance(fObj, io.RawIOBase):
+        if mode.startswith('r+'):
+            return io.BufferedRandom(fObj)
+        elif mode.startswith('r'):
+            return io.BufferedReader(fObj)
+        return io.BufferedWriter(fObj)
+    return fObj
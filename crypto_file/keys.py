@@ -0,0 +1,108 @@
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+#  Keys derived from passwords, base64 strings or key files
+#  - a Key is derived once and can be passed to any number of handlers
+#  - a KeyRing caches derived keys, dropping the least recently used;
+#    the process wide KEYRING serves every handler given a password or
+#    key string, so opening many files with one key derives it once
+#  - key files are cached by path, size and modification time, so a
+#    replaced key file is read again
+
+
+# Derivation of a key from a password
+def derive_key(password):
+    return hashlib.sha256(password).digest()
+
+
+# A base64 encoded 32 byte key
+def decode_key(s):
+    key = base64.b64decode(s)
+    if len(key) != 32:
+        raise NotImplementedError("Key {} not supported.".format(s))
+    return key
+
+
+class Key(object):
+    def __init__(self, key):
+        self.key = key
+
+        # Have to create a new password from the key to use in IV
+        # - allows for message recovery using key file without password
+        self.password = base64.b64encode(key)
+
+    @classmethod
+    def from_password(cls, password, derive=derive_key):
+        return cls(derive(password))
+
+    @classmethod
+    def from_file(cls, fname):
+        with open(fname, 'rb') as f:
+            return cls(f.read())
+
+    @classmethod
+    def from_string(cls, s):
+        return cls(decode_key(s))
+
+
+class KeyRing(object):
+    DEFAULT_SIZE = 128
+
+    def __init__(self, size=DEFAULT_SIZE, derive=derive_key):
+        self.size = size
+        self.derive = derive
+        self.keys = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Key for a Key, a key string (base64 or '.key' file) or a password
+    def get(self, password=None, key=None):
+        if isinstance(key, Key):
+            return key
+        elif isinstance(key, str):
+            if key.endswith('.key'):
+                return self.get_file(key)
+            return self.lookup(('string', key), Key.from_string, key)
+        elif isinstance(password, str):
+            return self.lookup(('password', password), Key.from_password,
+                               password, self.derive)
+        raise ValueError("Key or password is invalid.")
+
+    # Key files that cannot be looked at are read without caching
+    def get_file(self, fname):
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            return Key.from_file(fname)
+        return self.lookup(('file', fname, stat.st_size, stat.st_mtime),
+                           Key.from_file, fname)
+
+    def lookup(self, ident, make, *args):
+        with self.lock:
+            key = self.keys.pop(ident, None)
+            if key is not None:
+                self.hits += 1
+                self.keys[ident] = key
+                return key
+            self.misses += 1
+
+        # Derived outside the lock, a slow derivation holds no one up
+        key = make(*args)
+        with self.lock:
+            self.keys[ident] = key
+            while len(self.keys) > self.size:
+                self.keys.popitem(last=False)
+        return key
+
+    def clear(self):
+        with self.lock:
+            self.keys.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+KEYRING = KeyRing()
@@ -0,0 +1,68 @@
+import struct
+
+#  Index of line offsets in the plaintext of an encrypted file
+#  - holds the offset of every stride-th line, so a line is found by
+#    seeking to the indexed line before it and reading on from there
+#  - kept in a sidecar file next to the encrypted one, itself encrypted
+#    with the same key since the offsets give away the line lengths
+#  - records the salt and plaintext size of the file it belongs to,
+#    so an index of a rewritten file is not used
+
+HEADER = struct.Struct('>8sQQQ')
+OFFSET = struct.Struct('>Q')
+
+
+class LineIndex(object):
+    DEFAULT_STRIDE = 1000
+
+    def __init__(self, stride=DEFAULT_STRIDE, salt='', size=0, lines=0,
+                 offsets=None):
+        self.stride = stride
+        self.salt = salt
+        self.size = size
+        self.lines = lines
+        self.offsets = [0] if offsets is None else offsets
+
+    @staticmethod
+    def sidecar_name(fname):
+        return fname + '.lidx'
+
+    # Account for the next run of plaintext
+    # + only the newlines completing an indexed line are looked up
+    def feed(self, data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+
+        pos = 0
+        newlines = data.count('\n')
+        needed = len(self.offsets) * self.stride - self.lines
+        while newlines >= needed:
+            for _ in xrange(needed):
+                pos = data.find('\n', pos) + 1
+            self.offsets.append(self.size + pos)
+            self.lines += needed
+            newlines -= needed
+            needed = self.stride
+
+        self.lines += newlines
+        self.size += len(data)
+
+    # Offset of the indexed line at or before line n (counted from 0)
+    # and the number of lines to read on from there
+    def locate(self, n):
+        i = min(n // self.stride, len(self.offsets) - 1)
+        return self.offsets[i], n - i * self.stride
+
+    def dumps(self):
+        header = HEADER.pack(self.salt, self.size, self.lines, self.stride)
+        offsets = struct.pack('>{}Q'.format(len(self.offsets)),
+                              *self.offsets)
+        return header + offsets
+
+    @classmethod
+    def loads(cls, s):
+        salt, size, lines, stride = HEADER.unpack_from(s)
+        count = (len(s) - HEADER.size) // OFFSET.size
+        offsets = list(struct.unpack_from('>{}Q'.format(count), s,
+                                          HEADER.size))
+        return cls(stride, salt, size, lines, offsets)
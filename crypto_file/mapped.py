@@ -0,0 +1,60 @@
+import mmap
+
+#  File-like object over a memory mapped file
+#  - reads are slices of the mapping, so there are no read calls and
+#    processes reading the same file share the page cache
+#  - copies from dup() have a position of their own over the same mapping,
+#    only the original closes the mapping
+#  - pread() slices the mapping without using the position, so threads
+#    can share one MappedFile for positional reads
+
+
+class MappedFile(object):
+    def __init__(self, mapping, owner=True):
+        self.mapping = mapping
+        self.owner = owner
+        self.pos = 0
+
+    @classmethod
+    def open(cls, fObj):
+        return cls(mmap.mmap(fObj.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def read(self, size=-1):
+        start = self.pos
+        if size < 0:
+            self.pos = len(self.mapping)
+        else:
+            self.pos = min(start + size, len(self.mapping))
+        return self.mapping[start:self.pos]
+
+    # Like a file, the position can be past the end of the mapping
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += len(self.mapping)
+        if pos < 0:
+            raise IOError('Invalid argument')
+        self.pos = pos
+
+    def tell(self):
+        return self.pos
+
+    def pread(self, offset, size):
+        return self.mapping[offset:offset + size]
+
+    def size(self):
+        return len(self.mapping)
+
+    def dup(self):
+        return MappedFile(self.mapping, owner=False)
+
+    def close(self):
+        if self.owner:
+            self.mapping.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,55 @@
+from collections import deque
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from crypto_file import Reader
+
+#  Decrypt a whole file on several cores
+#  - CBC decryption of a block only needs the cipher block before it,
+#    so ranges of the file are decrypted independently and written in order
+#  - threads are enough, the cipher releases the GIL while it runs
+
+
+def decrypt_file(src, dst, password=None, key=None, workers=None,
+                 range_size=4 * 1024 * 1024, use_mmap=False):
+    if workers is None:
+        workers = cpu_count()
+
+    with Reader(src, password, key, enableSeek=False,
+                use_mmap=use_mmap) as reader:
+        size = reader.size
+        range_blocks = max(range_size // reader.bs, 1)
+        blocks = size // reader.bs + 1
+
+        # Only a file opened here is closed here
+        opened = isinstance(dst, str)
+        if opened:
+            dst = open(dst, 'wb')
+
+        pool = ThreadPool(workers)
+        try:
+            # Keep a couple of ranges per worker in flight
+            pending = deque()
+            for block in xrange(0, blocks, range_blocks):
+                args = (reader, block, min(range_blocks, blocks - block))
+                pending.append(pool.apply_async(decrypt_range, args))
+                if len(pending) >= 2 * workers:
+                    dst.write(pending.popleft().get())
+
+            while pending:
+                dst.write(pending.popleft().get())
+        finally:
+            pool.terminate()
+            pool.join()
+            if opened:
+                dst.close()
+
+    return size
+
+
+# Decrypt a range of cipher blocks with its own file object
+# + the padding is cut off using the plaintext size
+def decrypt_range(reader, block, count):
+    with reader.open_cipher_file() as fObj:
+        plain = reader.decrypt_blocks(fObj, block, count)
+    return plain[:reader.size - block * reader.bs]
@@ -0,0 +1,111 @@
+import threading
+from Queue import Queue, Empty, Full
+
+#  Background threads overlapping file I/O with the cipher
+#  - ReadAhead reads cipher text chunks ahead of the decryptor
+#  - WriteBehind writes cipher text chunks while the encryptor carries on
+#  - both use a bounded queue, so a slow side holds the other one back,
+#    and errors in the thread are raised on the next call
+
+
+class ReadAhead(object):
+    def __init__(self, fObj, size, depth):
+        self.queue = Queue(depth)
+        self.closed = False
+        self.eof = False
+        self.chunk = ''
+        self.chunk_pos = 0
+
+        self.thread = threading.Thread(target=self.run, args=(fObj, size))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, fObj, size):
+        try:
+            while not self.closed:
+                chunk = fObj.read(size)
+                self.put((chunk, None))
+                if not chunk:
+                    return
+        except Exception as e:
+            self.put(('', e))
+
+    # Wait for room in the queue, unless the reader went away
+    def put(self, item):
+        while not self.closed:
+            try:
+                return self.queue.put(item, timeout=0.1)
+            except Full:
+                pass
+
+    # File-like read of up to size values
+    # + only returns an empty string at the end of the file
+    def read(self, size):
+        if self.chunk_pos == len(self.chunk):
+            if self.eof:
+                return ''
+            self.chunk, error = self.queue.get()
+            self.chunk_pos = 0
+            if error is not None:
+                self.eof = True
+                raise error
+            self.eof = not self.chunk
+
+        start = self.chunk_pos
+        self.chunk_pos = min(start + size, len(self.chunk))
+        if start == 0 and self.chunk_pos == len(self.chunk):
+            return self.chunk
+        return self.chunk[start:self.chunk_pos]
+
+    # Stop the thread, the file position is left wherever it got to
+    def close(self):
+        self.closed = True
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except Empty:
+                pass
+        self.thread.join()
+
+
+class WriteBehind(object):
+    def __init__(self, fObj, depth):
+        self.queue = Queue(depth)
+        self.error = None
+
+        self.thread = threading.Thread(target=self.run, args=(fObj,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Write chunks until the None sentinel,
+    # after an error the rest is only drained
+    def run(self, fObj):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            if self.error is None:
+                try:
+                    fObj.write(chunk)
+                except Exception as e:
+                    self.error = e
+            self.queue.task_done()
+
+    def write(self, chunk):
+        self.check_error()
+        self.queue.put(chunk)
+
+    # Wait for the chunks queued so far to be written
+    def flush(self):
+        self.queue.join()
+        self.check_error()
+
+    # Wait for all chunks to be written
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.check_error()
+
+    def check_error(self):
+        if self.error is not None:
+            raise self.error
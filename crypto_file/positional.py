@@ -0,0 +1,25 @@
+import os
+import threading
+
+#  Positional reads of a file shared by threads
+#  - pread(offset, size) neither depends on nor moves a cursor others use
+#  - Python 2 has no os.pread, so a file object of its own is sought and
+#    read under a lock; callers decrypt what they read outside of it
+#  - MappedFile offers the same interface without a lock
+
+
+class PositionalFile(object):
+    def __init__(self, fObj):
+        self.fObj = fObj
+        self.lock = threading.Lock()
+
+    def pread(self, offset, size):
+        with self.lock:
+            self.fObj.seek(offset)
+            return self.fObj.read(size)
+
+    def size(self):
+        return os.fstat(self.fObj.fileno()).st_size
+
+    def close(self):
+        self.fObj.close()
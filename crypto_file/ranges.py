@@ -0,0 +1,66 @@
+from crypto_file import Reader
+
+#  Line aligned ranges of an encrypted file for parallel processing
+#  - plan_ranges splits the plaintext into ranges of whole lines, only
+#    decrypting a few blocks around each cut
+#  - a worker opens a RangeReader on its range, which seeks to the start
+#    of the range, decrypting from the cipher block holding it, and stops
+#    at its end
+#  - ranges are plain (start, end) offsets, so they can be handed to the
+#    workers of a process pool
+
+
+def plan_ranges(fname, n, password=None, key=None):
+    with Reader(fname, password, key, enableSeek=False) as reader:
+        return reader.split(n)
+
+
+class RangeReader(object):
+
+    def __init__(self, fname, start, end, password=None, key=None,
+                 chunk_size=None, use_mmap=False):
+        if start < 0 or end < start:
+            raise ValueError('Invalid range {}-{}'.format(start, end))
+        self.reader = Reader(fname, password, key, chunk_size=chunk_size,
+                             use_mmap=use_mmap)
+        self.start = start
+        self.end = end
+        self.reader.seek(start)
+
+    # Values left in the range
+    @property
+    def remaining(self):
+        return max(self.end - self.reader.position, 0)
+
+    def read(self, size=None):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        return self.reader.read(size) if size else ''
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        return self.reader.readline(size) if size else ''
+
+    # Iterate over the lines of the range
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    # Position in the file, not in the range
+    def tell(self):
+        return self.reader.position
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
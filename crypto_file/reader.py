@@ -1,102 +1,779 @@
-from Crypto.Cipher import AES
+import io
+import os
+import threading
+import time
+from timeit import default_timer
 
 from crypto_file import CryptoHandler
+from crypto_file.cache import CHUNK_CACHE, ChunkCache
+from crypto_file.compression import DECOMPRESS_SLICE, decompressor
+from crypto_file.line_index import LineIndex
+from crypto_file.mapped import MappedFile
+from crypto_file.pipeline import ReadAhead
+from crypto_file.positional import PositionalFile
+from crypto_file.stats import TimedFile
+from crypto_file.writer import Writer
 
 
 class Reader(CryptoHandler):
 
-    def __init__(self, fname, password=None, key=None, enableSeek=True):
+    def __init__(self, fname, password=None, key=None, enableSeek=True,
+                 seek_window=64 * 1024, chunk_size=None, prefetch=None,
+                 use_mmap=False, follow=False, poll_interval=0.1,
+                 idle_timeout=None, stats=False, cache=None):
 
         # Check for a key or password
         if key is None and password is None:
             msg = 'Need either a password or a key (file) for decryption'
             raise ValueError(msg)
+        if follow and (prefetch or use_mmap or cache):
+            msg = 'Cannot follow a file with prefetch, use_mmap or cache'
+            raise ValueError(msg)
+        if cache and prefetch:
+            raise ValueError('Cannot prefetch chunks read from the cache')
+
+        # What close() releases, set before the file is opened so a
+        # failing constructor is still closed cleanly
+        # + positional is the file for read_at, opened on first use and
+        #  shared by threads; mapped an optional memory map of the file
+        self.read_ahead = None
+        self.positional = None
+        self.mapped = None
 
-        super(Reader, self).__init__(fname, password, key, 'rb')
+        super(Reader, self).__init__(fname, password, key, 'rb',
+                                     chunk_size, stats)
 
         # Verify the file object is in read mode
         self.check_mode('r')
 
+        self.positional_lock = threading.Lock()
+
+        # Optionally read the cipher text from a memory map of the file
+        if use_mmap:
+            self.mapped = MappedFile.open(self.fObj)
+
+        # Optionally follow a file another process is still writing
+        # + waits poll_interval seconds whenever the cipher text runs out,
+        #  the file ends once it did not grow for idle_timeout seconds
+        # + partial_block holds the part of a block written so far,
+        #  held_block the index and cipher text of the held back block
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.partial_block = ''
+        self.held_block = None
+        if follow:
+            if self.name is None:
+                raise ValueError('Cannot follow a stream without a name')
+
+            # Unbuffered, so a read never returns values cached before
+            # the writer changed them
+            # + a file object passed in is left open for its owner, only
+            #  a file opened from a path is closed here
+            if isinstance(fname, str):
+                self.fObj.close()
+            self.fObj = open(self.name, 'rb', 0)
+            if self.stats is not None:
+                self.fObj = TimedFile(self.fObj, self.stats)
+            self.wait_for_header()
+
         # Need to retrieve the salt from the file
         self.get_salt()
         self.gen_iv()
 
+        # Optionally decrypt through a cache of chunks shared by Readers
+        # + True for the process wide cache, see cache.py
+        self.cache = None
+        if cache:
+            self.cache = CHUNK_CACHE if cache is True else cache
+            self.file_id = ChunkCache.file_id(self.fObj, self.name)
+            if self.file_id is None or (self.name is None and
+                                        self.mapped is None):
+                raise ValueError('Cannot cache a stream without a file')
+
         # Initiate the decryptor
-        self.cipher = AES.new(self.key, AES.MODE_CBC, self.iv)
+        # + next_block is the index of the next cipher block read
+        self.cipher = self.new_cipher(self.iv)
+        self.next_block = 0
 
-        # Setup the object's stream [used as a read buffer or write buffer]
-        self.streamLines = 0
-        self.chunk_unprocessed = ''
+        # Setup the object's stream [used as a read buffer]
+        # + decrypted values are appended to a bytearray and read from a
+        #  cursor, so reading never copies the rest of the buffer
+        # + the last decrypted block is held back (after stream_end)
+        #  until it is known whether it carries the padding
+        self.stream = bytearray()
+        self.stream_pos = 0
+        self.stream_end = 0
         self.enableSeek = enableSeek
 
-        # Allow for seek function; need to store previous values
-        self.prev_stream = ''
+        # Allow for seek function; the values before the cursor are kept
+        # + position is the plaintext offset of the next byte returned
+        # + only a window of previous values is kept, anything further
+        #  back is decrypted again from the file
+        self.seek_window = seek_window
+        self.position = 0
+        self._size = None
+
+        # Optionally read up to prefetch chunks ahead in a background thread
+        # + the thread is stopped whenever the file is used directly
+        self.prefetch = prefetch
+        self.start_read_ahead()
+
+        # Index of line offsets, loaded or built on first use
+        self.line_index = None
+
+    # File object the cipher text is read from
+    @property
+    def cipher_file(self):
+        if self.mapped is not None:
+            return self.mapped
+        return self.fObj
+
+    # A file object of its own over the cipher text, e.g. for another thread
+    def open_cipher_file(self):
+        if self.mapped is not None:
+            return self.mapped.dup()
+        if self.name is None:
+            raise IOError('A stream without a name cannot be opened again')
+        return open(self.name, 'rb')
 
     # Retrieve or Create the salt for the cipher
     def get_salt(self):
-        self.salt = self.fObj.read(self.bs)[len('Salted__'):]
+        self.read_header(self.cipher_file)
+        self.reset_decompressor()
 
-    # Method to read the next line
-    # + decrypt enough to cover the next line
-    def readline(self):
-        while self.streamLines == 0 and self.fileOpen:
-            self.decrypt_chunk()
+    # The header of a followed file may not have been written yet
+    def wait_for_header(self):
+        start = default_timer()
+        while os.fstat(self.fObj.fileno()).st_size < 2 * self.bs:
+            if (self.idle_timeout is not None and
+                    default_timer() - start >= self.idle_timeout):
+                break
+            time.sleep(self.poll_interval)
 
-        currLine, lineSuff, self.stream = self.stream.partition('\n')
-        currChunk = currLine + lineSuff
-        self.streamLines -= 1
+    # Compressed files are decompressed after decryption
+    # + the last decrypted block is held back in compressed form
+    # + compressed values left over once a chunk worth of plaintext was
+    #  produced are kept in compressed_tail, so memory stays bounded
+    def reset_decompressor(self):
+        self.decompressor = None
+        if self.codec:
+            self.decompressor = decompressor(self.codec)
+        self.held_back = ''
+        self.compressed_tail = ''
 
-        if self.enableSeek:
-            self.prev_stream += currChunk
+    # Method to read the next line, or up to size values of it
+    # + decrypt enough to cover the next line, only scanning new values
+    def readline(self, size=-1):
+        if size is None:
+            size = -1
 
-        return currChunk
+        end = self.stream.find('\n', self.stream_pos, self.stream_end)
+        while (end < 0 and self.fileOpen and
+               (size < 0 or self.stream_end - self.stream_pos < size)):
+            scanned = self.stream_end
+            self.decrypt_chunk()
+            end = self.stream.find('\n', scanned, self.stream_end)
 
+        if end < 0:
+            end = self.stream_end - 1
+
+        count = end + 1 - self.stream_pos
+        if 0 <= size < count:
+            count = size
+        return self.consume(count)
+
+    # Read size values, or everything left when size is None or negative
     def read(self, size=None):
-        while (len(self.stream) < size or size is None) and self.fileOpen:
+        if size is not None and size < 0:
+            size = None
+        while ((size is None or self.stream_end - self.stream_pos < size) and
+               self.fileOpen):
             self.decrypt_chunk()
+
+        available = self.stream_end - self.stream_pos
         if size is None:
-            size = len(self.stream)
-            currChunk, self.stream = self.stream, ''
-        else:
-            size = min(size, len(self.stream))
-            currChunk = self.stream[:size]
-            self.stream = self.stream[size:]
+            size = available
+
+        return self.consume(min(size, available))
+
+    # Read up to size values, decrypting at most one chunk to get them
+    def read1(self, size=-1):
+        while self.stream_pos == self.stream_end and self.fileOpen:
+            self.decrypt_chunk()
+
+        available = self.stream_end - self.stream_pos
+        if size is None or size < 0:
+            size = available
+        return self.consume(min(size, available))
+
+    def readlines(self, hint=None):
+        lines = []
+        total = 0
+        for line in self:
+            lines.append(line)
+            total += len(line)
+            if hint is not None and 0 < hint <= total:
+                break
+        return lines
+
+    # Iterate over the lines of the file
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    # Move to the start of line n (counted from 0)
+    # + jumps to the indexed line before it and reads on from there
+    def seek_line(self, n):
+        offset, skip = self.get_line_index().locate(n)
+        self.seek(offset)
+        for _ in xrange(skip):
+            if not self.readline():
+                break
+
+    def getline(self, n):
+        self.seek_line(n)
+        return self.readline()
 
-        if self.enableSeek:
-            self.prev_stream += currChunk
+    def get_line_index(self):
+        if self.line_index is None:
+            self.line_index = self.load_line_index()
+        if self.line_index is None:
+            self.line_index = self.build_line_index()
+        return self.line_index
 
-        return currChunk
+    # Load the sidecar index, unless it is missing or out of date
+    def load_line_index(self):
+        if self.name is None:
+            return None
+        sidecar = LineIndex.sidecar_name(self.name)
+        if not os.path.exists(sidecar):
+            return None
+
+        with Reader(sidecar, key=self.password) as f:
+            line_index = LineIndex.loads(f.read())
+        if line_index.salt != self.salt or line_index.size != self.size:
+            return None
+        return line_index
+
+    # Index the lines with one pass over the file, leaving the cursor be
+    def build_line_index(self, stride=LineIndex.DEFAULT_STRIDE):
+        line_index = LineIndex(stride, self.salt)
+        size = self.size
+        chunk_blocks = self.chunk_size // self.bs
+        with self.open_cipher_file() as fObj:
+            for block in xrange(0, size // self.bs + 1, chunk_blocks):
+                plain = self.decrypt_blocks(fObj, block, chunk_blocks)
+                line_index.feed(plain[:size - block * self.bs])
+        return line_index
+
+    # Store the index in the sidecar file, encrypted with the same key
+    def save_line_index(self):
+        with Writer(LineIndex.sidecar_name(self.name),
+                    key=self.password) as f:
+            f.write(self.get_line_index().dumps())
+
+    # Read into a caller owned buffer, returning the number of values read
+    # + buffered values are copied over, larger runs of cipher blocks
+    #  are decrypted straight into the buffer
+    def readinto(self, b):
+        view = memoryview(b)
+        size = len(view)
+        total = 0
+
+        while True:
+            count = min(size - total, self.stream_end - self.stream_pos)
+            view[total:total + count] = memoryview(self.stream)[
+                self.stream_pos:self.stream_pos + count]
+            self.advance(count)
+            total += count
+
+            if total == size or not self.fileOpen:
+                return total
+            elif (size - total >= 2 * self.bs and
+                  self.decompressor is None and not self.follow and
+                  self.cache is None):
+                total += self.decrypt_into(view[total:])
+            else:
+                self.decrypt_chunk()
+
+    # Move the cursor forward, returning the values passed over
+    def consume(self, size):
+        chunk = memoryview(self.stream)[
+            self.stream_pos:self.stream_pos + size].tobytes()
+        self.advance(size)
+        return chunk
+
+    def advance(self, size):
+        self.stream_pos += size
+        self.position += size
+
+        # Drop values that fell out of the seek window
+        # + only once they make up half the buffer,
+        #  so the copy is spread over many reads
+        keep = self.seek_window if self.enableSeek else 0
+        drop = self.stream_pos - keep
+        if drop > len(self.stream) // 2:
+            del self.stream[:drop]
+            self.stream_pos -= drop
+            self.stream_end -= drop
 
     def seek(self, pos, mode=0):
         if not self.enableSeek:
             raise NotImplementedError('seek disabled for this object')
 
         # - Absolute position: from the start of the file
-        # + equivalent to a relative position plus the
-        #  length of the previous stream
-        if mode == 0:
-            pos -= len(self.prev_stream)
-
         # - Relative position: from the current position
-        if mode == 0 or mode == 1:
-            if pos < 0:
-                self.stream = self.prev_stream[pos:] + self.stream
-                self.prev_stream = self.prev_stream[:pos]
-            else:
-                self.read(pos)
-
+        # - End position: from the end of the plaintext
+        if mode == 1:
+            pos += self.position
         elif mode == 2:
-            raise IOError('Seek from EOF is not implemented')
-        else:
+            pos += self.size
+        elif mode != 0:
             raise IOError('Unknown mode requested for seek')
 
-    def decrypt_chunk(self):
-        self.chunk_processed = self.chunk_unprocessed
-        crypted = self.fObj.read(1024 * self.bs)
-        self.chunk_unprocessed = self.cipher.decrypt(crypted)
-        if len(self.chunk_unprocessed) == 0:
-            padding_length = ord(self.chunk_processed[-1])
-            self.chunk_processed = self.chunk_processed[:-padding_length]
+        if pos < 0:
+            raise IOError('Cannot seek before the start of the file')
+
+        # Short moves are served from the buffered stream,
+        # anything else jumps straight to the cipher block
+        # + compressed files can only be read forward
+        distance = pos - self.position
+        if -self.stream_pos <= distance <= self.stream_end - self.stream_pos:
+            self.advance(distance)
+        elif self.decompressor is not None and distance > 0:
+            self.skip(distance)
+        else:
+            self.seek_block(pos)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    # io interface, so io.BufferedReader, io.TextIOWrapper and the like
+    # can sit on top
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def seekable(self):
+        if not self.enableSeek or self.follow:
+            return False
+        return self.file_seekable()
+
+    def flush(self):
+        pass
+
+    # Read past values, without buffering more than a chunk at a time
+    # + past the end the position is kept, as seek_block does
+    def skip(self, size):
+        pos = self.position + size
+        while size > 0:
+            count = len(self.read(min(size, self.chunk_size)))
+            if not count:
+                self.stream = bytearray()
+                self.stream_pos = 0
+                self.stream_end = 0
+                self.position = pos
+                break
+            size -= count
+
+    # Length of the plaintext, without decrypting the whole file
+    # + everything but the padding in the last block is plaintext,
+    #  so only the last two cipher blocks are needed
+    @property
+    def size(self):
+        if self.decompressor is not None:
+            raise IOError('Size of a compressed file is not known')
+        if self.follow:
+            raise IOError('Size of a followed file is not known')
+        if self._size is None:
+            blocks, last_block = self.last_block()
+            self._size = 0
+            if blocks:
+                self._size = blocks * self.bs - self.padding_length(
+                    last_block)
+        return self._size
+
+    # Number of cipher blocks and the last of them decrypted,
+    # leaving the cursor be
+    def last_block(self):
+        self.stop_read_ahead()
+        cipher_file = self.cipher_file
+        curr_pos = cipher_file.tell()
+        cipher_file.seek(0, 2)
+        blocks = (cipher_file.tell() - self.header_size) // self.bs
+
+        last_block = ''
+        if blocks > 0:
+            last_block = self.decrypt_blocks(cipher_file, blocks - 1, 1)
+
+        cipher_file.seek(curr_pos)
+        self.start_read_ahead()
+        return blocks, last_block
+
+    # Check the key against the padding of the last block, before any
+    # plaintext is used; files that cannot seek are checked at their end
+    def check_key(self):
+        if self.follow or not self.file_seekable():
+            return
+        blocks, last_block = self.last_block()
+        if blocks:
+            self.padding_length(last_block)
+
+    # Read up to size values at a plaintext offset, leaving the cursor be
+    # + many threads can read ranges at once: the cipher text is read
+    #  positionally and decrypted with a cipher of its own
+    def read_at(self, offset, size):
+        if self.decompressor is not None or self.follow:
+            raise IOError('Compressed or followed files cannot be read at '
+                          'an offset')
+        if offset < 0:
+            raise IOError('Cannot read before the start of the file')
+
+        end = min(offset + size, self.size_at())
+        if end <= offset:
+            return ''
+        block = offset // self.bs
+        plain = self.decrypt_at(block, (end - 1) // self.bs + 1 - block)
+        start = offset - block * self.bs
+        return plain[start:start + end - offset]
+
+    # Plaintext size for read_at, found without the cursor's file object
+    def size_at(self):
+        if self._size is None:
+            positional = self.positional_file()
+            blocks = (positional.size() - self.header_size) // self.bs
+            size = 0
+            if blocks > 0:
+                last_block = self.decrypt_at(blocks - 1, 1)
+                size = blocks * self.bs - self.padding_length(last_block)
+            self._size = size
+        return self._size
+
+    # Decrypt a run of cipher blocks with positional reads
+    # + the IV comes with the blocks in one read, unless the run starts
+    #  a CBC chain
+    def decrypt_at(self, block, count):
+        positional = self.positional_file()
+        plain = []
+        while count > 0:
+            run = min(count, self.segment_remaining(block) or count)
+            offset = self.header_size + block * self.bs
+            iv = self.chain_iv(block)
+            if iv is None:
+                crypted = positional.pread(offset - self.bs,
+                                           (run + 1) * self.bs)
+                iv, crypted = crypted[:self.bs], crypted[self.bs:]
+            else:
+                crypted = positional.pread(offset, run * self.bs)
+
+            crypted = crypted[:len(crypted) - len(crypted) % self.bs]
+            if not crypted:
+                break
+            plain.append(self.new_cipher(iv).decrypt(crypted))
+            block += run
+            count -= run
+
+        return ''.join(plain)
+
+    def positional_file(self):
+        if self.mapped is not None:
+            return self.mapped
+        with self.positional_lock:
+            if self.positional is None:
+                self.positional = PositionalFile(self.open_cipher_file())
+            return self.positional
+
+    # Split the plaintext into n ranges of about the same size for
+    # workers to read on their own, see ranges.py
+    # + each cut is moved on to the start of the next line, which only
+    #  decrypts the few blocks after it with read_at
+    # + ranges of a file with fewer lines than n can be empty
+    def split(self, n):
+        if n < 1:
+            raise ValueError('Need at least one range')
+        if self.decompressor is not None or self.follow:
+            raise IOError('Compressed or followed files cannot be split')
+
+        size = self.size_at()
+        starts = [0]
+        for i in xrange(1, n):
+            starts.append(max(self.next_line_at(size * i // n), starts[-1]))
+        return zip(starts, starts[1:] + [size])
+
+    # Offset of the first line starting at or after a plaintext offset
+    # + reads on from the byte before it, twice as much each time the
+    #  line goes on
+    def next_line_at(self, offset):
+        if offset <= 0:
+            return 0
+
+        pos = offset - 1
+        probe = 4 * self.bs
+        while True:
+            data = self.read_at(pos, probe)
+            if not data:
+                return self.size_at()
+            end = data.find('\n')
+            if end >= 0:
+                return pos + end + 1
+            pos += len(data)
+            probe *= 2
+
+    # Restart decryption at the cipher block holding a plaintext position
+    # + in CBC mode the previous cipher block is the IV of the next one,
+    #  so only the target block has to be read and decrypted
+    # + compressed files are decompressed again from the start
+    def seek_block(self, pos):
+        if self.decompressor is not None:
+            return self.rewind(pos)
+
+        block, offset = divmod(pos, self.bs)
+        self.stop_read_ahead()
+        iv = self.seek_cipher_block(self.cipher_file, block)
+        self.next_block = block
+        self.held_block = None
+        self.start_read_ahead()
+
+        self.stream = bytearray()
+        self.stream_pos = 0
+        self.stream_end = 0
+        self.position = pos - offset
+
+        if len(iv) < self.bs:
+            # Past the end of the file, nothing left to decrypt
             self.fileOpen = False
-        self.stream += self.chunk_processed
-        self.streamLines += self.chunk_processed.count('\n')
+        else:
+            self.cipher = self.new_cipher(iv)
+            self.fileOpen = True
+            while self.stream_end <= offset and self.fileOpen:
+                self.decrypt_chunk(2 * self.bs)
+            self.advance(min(offset, self.stream_end))
+
+        # Nothing buffered lines up with the position past the end
+        if self.position != pos:
+            self.stream = bytearray()
+            self.stream_pos = 0
+            self.stream_end = 0
+            self.position = pos
+
+    def rewind(self, pos):
+        self.stop_read_ahead()
+        iv = self.seek_cipher_block(self.cipher_file, 0)
+        self.next_block = 0
+        self.held_block = None
+        self.start_read_ahead()
+
+        self.cipher = self.new_cipher(iv)
+        self.reset_decompressor()
+        self.stream = bytearray()
+        self.stream_pos = 0
+        self.stream_end = 0
+        self.position = 0
+        self.fileOpen = True
+        self.skip(pos)
+
+    # Decrypt the next chunk, or only size values of cipher text
+    # + a seek only decrypts the target block and the one held back
+    #  after it, the chunk size applies to sequential reads
+    def decrypt_chunk(self, size=None):
+        tune = self.autoTune and size is None
+        if tune:
+            start = default_timer()
+
+        if self.compressed_tail:
+            self.decompress(self.compressed_tail)
+        else:
+            if self.cache is not None:
+                plain = self.read_cached()
+            else:
+                crypted = self.read_cipher(size or self.chunk_size)
+                if self.follow and crypted:
+                    crypted = self.check_held_block(crypted)
+                plain = crypted and self.cipher.decrypt(crypted)
+
+            if not plain:
+                if not (self.follow and self.wait_for_cipher()):
+                    self.finish_stream()
+            elif self.decompressor is None:
+                # Release the held back block and hold back the new last one
+                self.stream += plain
+                self.stream_end = len(self.stream) - self.bs
+            else:
+                plain = self.held_back + plain
+                self.held_back = plain[-self.bs:]
+                self.decompress(plain[:-self.bs])
+
+        if tune:
+            self.tune_chunk_size(default_timer() - start)
+
+    # Decrypted values from the next cipher block to the end of its chunk
+    # of the cache, decrypting the chunk if it is not cached
+    def read_cached(self):
+        blocks = self.cache.chunk_blocks
+        index, first = divmod(self.next_block, blocks)
+        plain = self.cache.lookup((self.key, self.file_id, index),
+                                  self.decrypt_at, index * blocks, blocks)
+        plain = plain[first * self.bs:]
+        self.next_block += len(plain) // self.bs
+        return plain
+
+    # zlib and gzip output is limited to a chunk per call,
+    # bz2 and lzma decompressors are fed small slices until a chunk is
+    # buffered, see DECOMPRESS_SLICE
+    def decompress(self, compressed):
+        if hasattr(self.decompressor, 'unconsumed_tail'):
+            self.stream += self.decompressor.decompress(compressed,
+                                                        self.chunk_size)
+            self.compressed_tail = self.decompressor.unconsumed_tail
+        else:
+            limit = len(self.stream) + self.chunk_size
+            pos = 0
+            while pos < len(compressed) and len(self.stream) < limit:
+                self.stream += self.decompressor.decompress(
+                    compressed[pos:pos + DECOMPRESS_SLICE])
+                pos += DECOMPRESS_SLICE
+            self.compressed_tail = compressed[pos:]
+        self.stream_end = len(self.stream)
+
+    # Read cipher text at the cursor, up to the end of the segment
+    # + a new segment restarts the cipher with the segment's IV
+    def read_cipher(self, size):
+        remaining = self.segment_remaining(self.next_block)
+        if remaining is not None:
+            if remaining == self.segment_blocks:
+                iv = self.gen_segment_iv(self.next_block // remaining)
+                self.cipher = self.new_cipher(iv)
+            size = min(size, remaining * self.bs)
+
+        if not self.follow:
+            crypted = (self.read_ahead or self.cipher_file).read(size)
+        else:
+            # Only whole blocks, the rest waits for the writer
+            crypted = self.partial_block + self.cipher_file.read(
+                size - len(self.partial_block))
+            size = len(crypted) - len(crypted) % self.bs
+            crypted, self.partial_block = crypted[:size], crypted[size:]
+
+        self.next_block += len(crypted) // self.bs
+        return crypted
+
+    # Wait for the writer to add to a followed file
+    # + False once the file did not grow for idle_timeout seconds
+    # + seeking in place clears the end of file state of the file object
+    def wait_for_cipher(self):
+        start = default_timer()
+        end = (self.header_size + self.next_block * self.bs +
+               len(self.partial_block))
+        while os.fstat(self.fObj.fileno()).st_size <= end:
+            if (self.idle_timeout is not None and
+                    default_timer() - start >= self.idle_timeout):
+                return False
+            time.sleep(self.poll_interval)
+
+        self.cipher_file.seek(end)
+        return True
+
+    # Appending rewrites the last block of a followed file, so the held
+    # back block is checked once more cipher text turns up behind it
+    # + a rewritten block is dropped and read again with the rest
+    def check_held_block(self, crypted):
+        if self.held_block is not None:
+            block, held = self.held_block
+            pos = self.cipher_file.tell()
+            self.cipher_file.seek(self.header_size + block * self.bs)
+            if self.cipher_file.read(self.bs) == held:
+                self.cipher_file.seek(pos)
+            else:
+                del self.stream[self.stream_end:]
+                self.held_back = ''
+                self.partial_block = ''
+                self.next_block = block
+                iv = self.seek_cipher_block(self.cipher_file, block)
+                self.cipher = self.new_cipher(iv)
+                crypted = self.read_cipher(self.chunk_size)
+
+        self.held_block = (self.next_block - 1, crypted[-self.bs:])
+        return crypted
+
+    def start_read_ahead(self):
+        if self.prefetch:
+            self.read_ahead = ReadAhead(self.cipher_file, self.chunk_size,
+                                        self.prefetch)
+
+    # Stop reading ahead, leaving the file on the cursor's next cipher block
+    def stop_read_ahead(self):
+        if self.read_ahead is not None:
+            self.read_ahead.close()
+            self.read_ahead = None
+            self.cipher_file.seek(
+                self.header_size + self.next_block * self.bs)
+
+    # Decrypt cipher blocks straight into a caller owned buffer
+    # + the buffered stream must have been read up to the held back block
+    def decrypt_into(self, view):
+        held_back = len(self.stream) - self.stream_end
+        blocks = (len(view) - held_back) // self.bs + 1
+        crypted = self.read_cipher(blocks * self.bs)
+        if not crypted:
+            self.finish_stream()
+            return 0
+
+        # The held back block comes first, the new last block is held back
+        count = held_back + len(crypted) - self.bs
+        view[:held_back] = memoryview(self.stream)[self.stream_end:]
+        crypted = memoryview(crypted)
+        self.cipher.decrypt(crypted[:-self.bs], output=view[held_back:count])
+
+        self.stream = bytearray(self.cipher.decrypt(crypted[-self.bs:]))
+        self.stream_pos = 0
+        self.stream_end = 0
+        self.position += count
+        return count
+
+    # No cipher text left; the held back block carries the padding
+    # + nothing is held back when positioned past the end
+    def finish_stream(self):
+        if self.decompressor is not None:
+            return self.finish_decompression()
+
+        if len(self.stream) > self.stream_end:
+            padding_length = self.padding_length(bytes(self.stream[-self.bs:]))
+            del self.stream[-padding_length:]
+        self.stream_end = len(self.stream)
+        self.fileOpen = False
+
+    # The held back block of compressed values carries the padding
+    def finish_decompression(self):
+        compressed = self.held_back
+        if compressed:
+            compressed = compressed[:-self.padding_length(compressed)]
+        self.held_back = ''
+
+        if compressed:
+            self.stream += self.decompressor.decompress(compressed)
+        if hasattr(self.decompressor, 'flush'):
+            self.stream += self.decompressor.flush()
+        self.stream_end = len(self.stream)
+        self.fileOpen = False
+
+    def close(self):
+        self.stop_read_ahead()
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        if self.positional is not None:
+            self.positional.close()
+            self.positional = None
+        super(Reader, self).close()
+
+
+io.BufferedIOBase.register(Reader)
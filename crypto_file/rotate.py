@@ -0,0 +1,100 @@
+import os
+from functools import partial
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from crypto_file import Reader, Writer
+from crypto_file.compression import CODEC_NAMES
+from crypto_file.line_index import LineIndex
+
+#  Re-encrypt files with a new key
+#  - cipher text is decrypted into one fixed buffer and encrypted again
+#    straight from it, so memory use is constant and no plaintext is
+#    written anywhere
+#  - the file keeps its format: segment size, compression, and a line
+#    index sidecar (with the same stride) if it had an up to date one
+#  - files are re-keyed concurrently by threads, the cipher releases
+#    the GIL while it runs
+
+COPY_SIZE = 1024 * 1024
+
+
+def rekey(src, dst, password=None, key=None, new_password=None,
+          new_key=None, chunk_size=None):
+    if new_password is None and new_key is None:
+        raise ValueError('Need either a new password or a new key')
+
+    with Reader(src, password, key, enableSeek=False,
+                chunk_size=chunk_size) as reader:
+        # A wrong key fails before anything is written
+        reader.check_key()
+
+        segment_size = None
+        if reader.segment_blocks is not None:
+            segment_size = reader.segment_blocks * reader.bs
+
+        line_index = None
+        if not reader.codec and isinstance(src, str):
+            old_index = reader.load_line_index()
+            if old_index is not None:
+                line_index = old_index.stride
+
+        with Writer(dst, new_password, new_key, chunk_size=chunk_size,
+                    segment_size=segment_size, line_index=line_index,
+                    compression=CODEC_NAMES[reader.codec]) as writer:
+            buf = bytearray(COPY_SIZE)
+            view = memoryview(buf)
+            size = 0
+            while True:
+                count = reader.readinto(buf)
+                if not count:
+                    break
+                writer.write(view[:count])
+                size += count
+
+    return size
+
+
+# Re-key a file through a temporary file next to it,
+# only replacing it once the new one is complete
+def rekey_inplace(fname, password=None, key=None, new_password=None,
+                  new_key=None, chunk_size=None):
+    tmp = fname + '.rekey'
+    try:
+        size = rekey(fname, tmp, password, key, new_password, new_key,
+                     chunk_size)
+        replace_file(tmp, fname)
+    except Exception:
+        for name in (tmp, LineIndex.sidecar_name(tmp)):
+            if os.path.exists(name):
+                os.remove(name)
+        raise
+    return size
+
+
+# Re-key files in place with a pool of threads, returning the total size
+def rekey_files(fnames, password=None, key=None, new_password=None,
+                new_key=None, workers=None):
+    if workers is None:
+        workers = cpu_count()
+
+    pool = ThreadPool(workers)
+    try:
+        return sum(pool.imap_unordered(
+            partial(rekey_inplace, password=password, key=key,
+                    new_password=new_password, new_key=new_key),
+            fnames))
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# Move a file into place, along with its line index sidecar
+# + a sidecar left from the replaced file is under the old key
+def replace_file(src, dst):
+    os.rename(src, dst)
+    sidecar = LineIndex.sidecar_name(src)
+    if os.path.exists(sidecar):
+        os.rename(sidecar, LineIndex.sidecar_name(dst))
+    elif os.path.exists(LineIndex.sidecar_name(dst)):
+        os.remove(LineIndex.sidecar_name(dst))
@@ -0,0 +1,240 @@
+import threading
+from functools import wraps
+from timeit import default_timer
+
+#  Opt-in counters of where a handler's time goes
+#  - a handler given stats=True has its file object and ciphers wrapped
+#    in timing proxies and is switched to a subclass timing its methods;
+#    handlers without stats run the plain class methods, so disabled
+#    stats cost nothing
+#  - time is split into the cipher, file I/O, key and IV derivation, and
+#    the rest of the time spent in read/write calls (buffer management)
+#  - the stats of every closed handler are added to PROCESS_STATS and
+#    handed to the registered hooks, e.g. to export them to a metrics
+#    pipeline
+
+COUNTERS = ('cipher_bytes', 'plain_bytes', 'chunks', 'calls', 'seeks',
+            'seek_distance', 'cipher_time', 'io_time', 'key_time',
+            'buffer_time')
+
+# Methods of each handler, and what is counted for them
+KEY_METHODS = ('gen_key', 'gen_iv', 'gen_segment_iv')
+CHUNK_METHODS = ('decrypt_chunk', 'decrypt_into', 'encrypt')
+CALL_METHODS = ('read', 'read1', 'readinto', 'readline', 'write', 'flush',
+                'seek', 'close')
+
+HOOKS = []
+hooks_lock = threading.Lock()
+
+
+class Stats(object):
+    def __init__(self, name=None):
+        self.name = name
+        for counter in COUNTERS:
+            setattr(self, counter, 0)
+        self.buffer_peak = 0
+        self.lock = threading.Lock()
+
+    # Total read or write time, and the share of it spent on I/O
+    # + tells I/O bound files from CPU bound ones
+    @property
+    def total_time(self):
+        return (self.cipher_time + self.io_time + self.key_time +
+                self.buffer_time)
+
+    @property
+    def io_share(self):
+        return self.io_time / self.total_time if self.total_time else 0.0
+
+    def add(self, other):
+        with self.lock:
+            for counter in COUNTERS:
+                setattr(self, counter,
+                        getattr(self, counter) + getattr(other, counter))
+            self.buffer_peak = max(self.buffer_peak, other.buffer_peak)
+
+    def as_dict(self):
+        stats = dict((counter, getattr(self, counter))
+                     for counter in COUNTERS)
+        stats.update(name=self.name, buffer_peak=self.buffer_peak,
+                     total_time=self.total_time, io_share=self.io_share)
+        return stats
+
+    def __repr__(self):
+        return 'Stats({})'.format(', '.join(
+            '{}={!r}'.format(k, v) for k, v in sorted(self.as_dict().items())))
+
+
+PROCESS_STATS = Stats('process')
+
+
+# Call hook(stats) with the stats of every handler closed from now on
+def register_hook(hook):
+    with hooks_lock:
+        HOOKS.append(hook)
+
+
+def unregister_hook(hook):
+    with hooks_lock:
+        HOOKS.remove(hook)
+
+
+# Add a closed handler's stats to the process and hand them to the hooks
+def publish(stats):
+    PROCESS_STATS.add(stats)
+    with hooks_lock:
+        hooks = list(HOOKS)
+    for hook in hooks:
+        hook(stats)
+
+
+class TimedFile(object):
+    def __init__(self, fObj, stats):
+        self.fObj = fObj
+        self.stats = stats
+
+    def read(self, *args):
+        start = default_timer()
+        data = self.fObj.read(*args)
+        self.stats.io_time += default_timer() - start
+        self.stats.cipher_bytes += len(data)
+        return data
+
+    def write(self, data):
+        start = default_timer()
+        result = self.fObj.write(data)
+        self.stats.io_time += default_timer() - start
+        self.stats.cipher_bytes += len(data)
+        return result
+
+    def seek(self, *args):
+        start = default_timer()
+        result = self.fObj.seek(*args)
+        self.stats.io_time += default_timer() - start
+        return result
+
+    def flush(self):
+        start = default_timer()
+        self.fObj.flush()
+        self.stats.io_time += default_timer() - start
+
+    def __getattr__(self, name):
+        return getattr(self.fObj, name)
+
+
+class TimedCipher(object):
+    def __init__(self, cipher, stats):
+        self.cipher = cipher
+        self.stats = stats
+
+    def encrypt(self, *args, **kwargs):
+        start = default_timer()
+        result = self.cipher.encrypt(*args, **kwargs)
+        self.stats.cipher_time += default_timer() - start
+        return result
+
+    def decrypt(self, *args, **kwargs):
+        start = default_timer()
+        result = self.cipher.decrypt(*args, **kwargs)
+        self.stats.cipher_time += default_timer() - start
+        return result
+
+
+# Instrument a handler by switching it to a subclass timing its methods
+# + only the outermost call is timed, the cipher and I/O time spent
+#  within it is taken off, the rest is buffer management
+# + I/O of read ahead or write behind threads overlaps the calls,
+#  so their buffer time is only a lower bound
+# + nothing stored on the handler refers back to it, a handler with
+#  __del__ in a reference cycle would never be collected
+def instrument(handler, stats):
+    handler.stats = stats
+    handler.stats_depth = 0
+    handler.stats_published = False
+    handler.fObj = TimedFile(handler.fObj, stats)
+    handler.__class__ = instrumented_class(type(handler))
+
+
+# Subclasses with timed methods, one per handler class
+INSTRUMENTED = {}
+
+
+def instrumented_class(cls):
+    if cls not in INSTRUMENTED:
+        methods = {'__module__': cls.__module__,
+                   'new_cipher': timed_cipher(cls.new_cipher)}
+        for name in KEY_METHODS:
+            methods[name] = timed_key(getattr(cls, name))
+        for name in CHUNK_METHODS:
+            if hasattr(cls, name):
+                methods[name] = counted_chunk(getattr(cls, name))
+        for name in CALL_METHODS:
+            if hasattr(cls, name):
+                methods[name] = timed_call(name, getattr(cls, name))
+        INSTRUMENTED[cls] = type(cls.__name__, (cls,), methods)
+    return INSTRUMENTED[cls]
+
+
+def timed_cipher(method):
+    @wraps(method)
+    def wrapper(self, iv):
+        return TimedCipher(method(self, iv), self.stats)
+    return wrapper
+
+
+def timed_key(method):
+    @wraps(method)
+    def wrapper(self, *args):
+        start = default_timer()
+        try:
+            return method(self, *args)
+        finally:
+            self.stats.key_time += default_timer() - start
+    return wrapper
+
+
+def counted_chunk(method):
+    @wraps(method)
+    def wrapper(self, *args):
+        self.stats.chunks += 1
+        try:
+            return method(self, *args)
+        finally:
+            self.stats.buffer_peak = max(self.stats.buffer_peak,
+                                         len(self.stream))
+    return wrapper
+
+
+def timed_call(name, method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.stats_depth:
+            return method(self, *args, **kwargs)
+
+        stats = self.stats
+        self.stats_depth += 1
+        position = getattr(self, 'position', 0)
+        inner = stats.cipher_time + stats.io_time + stats.key_time
+        start = default_timer()
+        try:
+            result = method(self, *args, **kwargs)
+        finally:
+            elapsed = default_timer() - start
+            inner = (stats.cipher_time + stats.io_time + stats.key_time -
+                     inner)
+            stats.buffer_time += max(elapsed - inner, 0)
+            stats.calls += 1
+            self.stats_depth -= 1
+
+        if name == 'seek':
+            stats.seeks += 1
+            stats.seek_distance += abs(self.position - position)
+        elif name in ('write', 'readinto'):
+            stats.plain_bytes += result
+        elif name in ('read', 'read1', 'readline'):
+            stats.plain_bytes += len(result)
+        elif name == 'close' and not self.stats_published:
+            self.stats_published = True
+            publish(stats)
+        return result
+    return wrapper
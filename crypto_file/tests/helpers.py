@@ -0,0 +1,15 @@
+from crypto_file.writer import Writer
+
+#  Helpers shared by the tests
+#  - PLAINTEXT is a file of numbered lines, long enough to span many
+#    chunks and line index strides
+#  - write_file encrypts a plaintext with the password 'foo', taking the
+#    Writer's options as keyword arguments
+
+PLAINTEXT = ''.join('line {}\n'.format(i) for i in range(5000))
+
+
+def write_file(fname, plaintext=PLAINTEXT, password='foo', **kwargs):
+    with Writer(fname=fname, password=password, **kwargs) as f:
+        f.write(plaintext)
+    return fname
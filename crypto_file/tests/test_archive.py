@@ -0,0 +1,116 @@
+import io
+from collections import OrderedDict
+
+import pytest
+
+from crypto_file import archive
+from crypto_file.archive import ArchiveReader, ArchiveWriter
+from crypto_file.reader import Reader
+from crypto_file.writer import Writer
+
+
+MEMBERS = OrderedDict(('blob{}'.format(i), 'value {}\n'.format(i) * i)
+                      for i in range(200))
+
+
+@pytest.fixture()
+def fname(tmpdir):
+    yield str(tmpdir.join('foo.arc'))
+
+
+def write_archive(fname, **kwargs):
+    with ArchiveWriter(fname, password='foo', **kwargs) as f:
+        for name, data in MEMBERS.iteritems():
+            f.add(name, data)
+
+
+def test_index_round_trip():
+    members = OrderedDict([('foo', (0, 3)), ('bar/baz', (3, 0))])
+
+    assert archive.load_index(archive.dump_index(members), 2) == members
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'segment_size': 1024}])
+def test_random_access_to_members(fname, kwargs):
+    write_archive(fname, **kwargs)
+
+    with ArchiveReader(fname, password='foo') as f:
+        assert f.names() == MEMBERS.keys()
+        assert len(f) == len(MEMBERS)
+        for name in ['blob150', 'blob3', 'blob0', 'blob199', 'blob3']:
+            assert f.read(name) == MEMBERS[name]
+        assert f.getsize('blob10') == len(MEMBERS['blob10'])
+        assert list(f) == MEMBERS.keys()
+
+
+def test_iteritems_reads_members_in_order(fname):
+    write_archive(fname)
+
+    with ArchiveReader(fname, password='foo') as f:
+        f.read('blob100')
+        assert OrderedDict(f.iteritems()) == MEMBERS
+
+
+def test_add_from_file_object_and_unicode_name(fname):
+    with ArchiveWriter(fname, password='foo') as f:
+        f.add(u'caf\xe9', io.BytesIO('foo' * 1000))
+
+    with ArchiveReader(fname, password='foo') as f:
+        assert u'caf\xe9' in f
+        assert f.read('caf\xc3\xa9') == 'foo' * 1000
+
+
+def test_empty_archive(fname):
+    ArchiveWriter(fname, password='foo').close()
+
+    with ArchiveReader(fname, password='foo') as f:
+        assert f.names() == []
+        assert list(f.iteritems()) == []
+
+
+def test_duplicate_member_errors(fname):
+    with ArchiveWriter(fname, password='foo') as f:
+        f.add('foo', 'bar')
+        with pytest.raises(ValueError):
+            f.add('foo', 'baz')
+
+
+def test_too_long_member_name_errors(fname):
+    with ArchiveWriter(fname, password='foo') as f:
+        with pytest.raises(ValueError):
+            f.add('x' * 0x10000, 'bar')
+
+
+def test_close_writes_index_once(fname):
+    f = ArchiveWriter(fname, password='foo')
+    f.add('foo', 'bar')
+    f.close()
+    f.close()
+
+    with ArchiveReader(fname, password='foo') as f:
+        assert f.read('foo') == 'bar'
+
+
+def test_archive_is_one_encrypted_file(fname):
+    write_archive(fname)
+
+    plaintext = Reader(fname, password='foo').read()
+    assert plaintext.startswith(''.join(MEMBERS.values()))
+    assert plaintext.endswith(archive.ARCHIVE_MAGIC)
+
+
+@pytest.mark.parametrize('plaintext', ['', 'foo' * 10])
+def test_plain_encrypted_file_is_not_an_archive(fname, plaintext):
+    with Writer(fname, password='foo') as f:
+        f.write(plaintext)
+
+    with pytest.raises(IOError):
+        ArchiveReader(fname, password='foo')
+
+
+def test_compressed_file_is_not_an_archive(fname):
+    with Writer(fname, password='foo', compression='zlib') as f:
+        f.write('foo')
+
+    with pytest.raises(IOError):
+        ArchiveReader(fname, password='foo')
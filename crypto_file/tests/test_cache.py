@@ -0,0 +1,127 @@
+import io
+
+import mock
+import pytest
+
+from crypto_file.cache import ChunkCache
+from crypto_file.reader import Reader
+from crypto_file.tests.helpers import PLAINTEXT, write_file
+
+
+@pytest.fixture()
+def chunk_cache():
+    yield ChunkCache(chunk_blocks=64)
+
+
+def test_lookup_makes_missing_chunks_once(chunk_cache):
+    make = mock.Mock(return_value='foo')
+
+    assert chunk_cache.lookup('a', make, 1) == 'foo'
+    assert chunk_cache.lookup('a', make, 1) == 'foo'
+    make.assert_called_once_with(1)
+    assert (chunk_cache.misses, chunk_cache.hits) == (1, 1)
+    assert chunk_cache.size == 3
+
+
+def test_lookup_drops_least_recently_used_by_size():
+    chunk_cache = ChunkCache(max_size=6)
+    chunk_cache.lookup('a', str, 'foo')
+    chunk_cache.lookup('b', str, 'bar')
+    chunk_cache.lookup('a', str, 'foo')
+    chunk_cache.lookup('c', str, 'baz')
+
+    assert chunk_cache.chunks.keys() == ['a', 'c']
+    assert chunk_cache.size == 6
+    assert chunk_cache.lookup('d', str, 'too large') == 'too large'
+    assert 'd' not in chunk_cache.chunks
+
+
+def test_invalidate_and_clear(chunk_cache):
+    chunk_cache.lookup(('k', ('foo.txt', 1), 0), str, 'foo')
+    chunk_cache.lookup(('k', ('bar.txt', 1), 0), str, 'bar')
+    chunk_cache.invalidate('foo.txt')
+
+    assert chunk_cache.chunks.keys() == [('k', ('bar.txt', 1), 0)]
+    assert chunk_cache.size == 3
+    chunk_cache.clear()
+    assert not chunk_cache.chunks
+    assert (chunk_cache.size, chunk_cache.hits, chunk_cache.misses) == (
+        0, 0, 0)
+
+
+def test_file_id_of_stream_without_file():
+    assert ChunkCache.file_id(io.BytesIO(), None) is None
+
+
+@pytest.mark.parametrize('kwargs', [
+    {}, {'segment_size': 1024}, {'compression': 'zlib'}])
+def test_reader_reads_through_cache(tmpdir, chunk_cache, kwargs):
+    fname = write_file(str(tmpdir.join('foo.txt')), **kwargs)
+
+    assert Reader(fname=fname, password='foo',
+                  cache=chunk_cache).read() == PLAINTEXT
+    misses = chunk_cache.misses
+
+    assert Reader(fname=fname, password='foo',
+                  cache=chunk_cache).read() == PLAINTEXT
+    assert chunk_cache.misses == misses
+    assert chunk_cache.hits >= misses
+
+
+def test_cached_reader_seeks_and_reads_lines(tmpdir, chunk_cache):
+    fname = write_file(str(tmpdir.join('foo.txt')))
+    reader = Reader(fname=fname, password='foo', cache=chunk_cache,
+                    seek_window=0)
+
+    assert reader.getline(4000) == 'line 4000\n'
+    reader.seek(5)
+    buf = bytearray(3000)
+    assert reader.readinto(buf) == 3000
+    assert buf == PLAINTEXT[5:3005]
+    reader.seek(len(PLAINTEXT) + 10)
+    assert reader.read() == ''
+
+
+def test_changed_file_is_decrypted_again(tmpdir, chunk_cache):
+    fname = write_file(str(tmpdir.join('foo.txt')))
+    Reader(fname=fname, password='foo', cache=chunk_cache).read()
+    write_file(fname, 'bar' * 1000)
+    misses = chunk_cache.misses
+
+    reader = Reader(fname=fname, password='foo', cache=chunk_cache)
+    assert reader.read() == 'bar' * 1000
+    assert chunk_cache.misses > misses
+
+
+def test_cache_is_keyed_by_key(tmpdir, chunk_cache):
+    fname = write_file(str(tmpdir.join('foo.txt')))
+    Reader(fname=fname, password='foo', cache=chunk_cache).read()
+    misses = chunk_cache.misses
+
+    reader = Reader(fname=fname, password='bar', cache=chunk_cache)
+    with pytest.raises(IOError):
+        reader.read()
+    assert chunk_cache.misses == 2 * misses
+
+
+def test_cache_true_uses_process_cache(tmpdir, chunk_cache):
+    fname = write_file(str(tmpdir.join('foo.txt')))
+    with mock.patch('crypto_file.reader.CHUNK_CACHE', chunk_cache):
+        reader = Reader(fname=fname, password='foo', cache=True)
+
+    assert reader.cache is chunk_cache
+    assert reader.read() == PLAINTEXT
+    assert chunk_cache.misses > 0
+
+
+@pytest.mark.parametrize('kwargs', [{'follow': True}, {'prefetch': 2}])
+def test_cache_cannot_be_combined(kwargs):
+    with pytest.raises(ValueError):
+        Reader(fname='foo.txt', password='foo', cache=True, **kwargs)
+
+
+def test_cache_needs_a_file(tmpdir):
+    fname = write_file(str(tmpdir.join('foo.txt')))
+    with pytest.raises(ValueError):
+        Reader(io.BytesIO(open(fname, 'rb').read()), password='foo',
+               cache=True)
@@ -0,0 +1,197 @@
+import os
+
+import mock
+import pytest
+
+from crypto_file import cli
+from crypto_file.reader import Reader
+from crypto_file.writer import Writer
+
+
+@pytest.fixture()
+def tree(tmpdir):
+    src = tmpdir.mkdir('src')
+    src.join('foo.txt').write('foo' * 1000)
+    src.mkdir('sub').join('bar.txt').write('bar' * 1000)
+    yield src
+
+
+def run(*argv):
+    return cli.main(list(argv))
+
+
+def read_encrypted(path, password='foo'):
+    with Reader(str(path), password=password) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_encrypt_and_decrypt_tree(tmpdir, tree, workers):
+    assert run('encrypt', '-p', 'foo', '-j', workers, '-q', str(tree)) == 0
+    assert read_encrypted(tree.join('foo.txt.enc')) == 'foo' * 1000
+    assert read_encrypted(tree.join('sub', 'bar.txt.enc')) == 'bar' * 1000
+
+    out = tmpdir.join('out')
+    assert run('decrypt', '-p', 'foo', '-j', workers, '-o', str(out),
+               str(tree)) == 0
+    assert out.join('foo.txt').read() == 'foo' * 1000
+    assert out.join('sub', 'bar.txt').read() == 'bar' * 1000
+    assert not out.join('sub', 'bar.txt.enc').exists()
+
+
+def test_encrypt_with_compression(tree):
+    assert run('encrypt', '-p', 'foo', '--compression', 'zlib',
+               str(tree.join('foo.txt'))) == 0
+
+    assert tree.join('foo.txt.enc').size() < 1000
+    assert read_encrypted(tree.join('foo.txt.enc')) == 'foo' * 1000
+
+
+def test_rekey_glob_in_place(tree):
+    run('encrypt', '-p', 'foo', '-q', str(tree))
+    pattern = str(tree.join('*.enc'))
+
+    assert run('rekey', '-p', 'foo', '--new-password', 'bar', pattern) == 0
+    assert read_encrypted(tree.join('foo.txt.enc'), 'bar') == 'foo' * 1000
+    assert read_encrypted(tree.join('sub', 'bar.txt.enc')) == 'bar' * 1000
+    assert not tree.join('foo.txt.enc.part').exists()
+
+
+def test_journal_skips_completed_files(tmpdir, tree):
+    journal = str(tmpdir.join('journal'))
+    run('encrypt', '-p', 'foo', '-j', '1', '--journal', journal, str(tree))
+
+    assert sorted(open(journal).read().splitlines()) == [
+        str(tree.join('foo.txt')), str(tree.join('sub', 'bar.txt'))]
+    with mock.patch('crypto_file.cli.process_file') as process_file:
+        assert run('encrypt', '-p', 'foo', '-j', '1', '--journal', journal,
+                   str(tree)) == 0
+    process_file.assert_not_called()
+
+
+def test_failures_are_reported_and_not_journaled(tmpdir, tree, capsys):
+    journal = str(tmpdir.join('journal'))
+    tree.join('foo.txt.enc').write('Salted__' + 'x' * 20)
+
+    assert run('decrypt', '-p', 'foo', '--journal', journal,
+               str(tree.join('foo.txt.enc')), str(tmpdir.join('x*'))) == 1
+    assert not tree.join('foo.txt.enc.part').exists()
+    assert open(journal).read() == ''
+    err = capsys.readouterr()[1]
+    assert 'No such file or directory' in err
+    assert '1 files, 2 failed' in err
+
+
+def test_decrypt_with_wrong_key_fails(tmpdir, tree, capsys):
+    journal = str(tmpdir.join('journal'))
+    run('encrypt', '-p', 'foo', '-q', str(tree))
+    before = tree.join('foo.txt').read('rb')
+
+    assert run('decrypt', '-p', 'wrong', '--force', '--journal', journal,
+               str(tree.join('foo.txt.enc'))) == 1
+    assert tree.join('foo.txt').read('rb') == before
+    assert not tree.join('foo.txt.part').exists()
+    assert open(journal).read() == ''
+    assert 'Wrong key' in capsys.readouterr()[1]
+
+
+def test_existing_outputs_need_force(tree, capsys):
+    run('encrypt', '-p', 'foo', '-q', str(tree))
+    tree.join('foo.txt').write('changed')
+
+    assert run('decrypt', '-p', 'foo', str(tree.join('foo.txt.enc'))) == 1
+    assert tree.join('foo.txt').read() == 'changed'
+    assert '--force' in capsys.readouterr()[1]
+
+    assert run('decrypt', '-p', 'foo', '-f',
+               str(tree.join('foo.txt.enc'))) == 0
+    assert tree.join('foo.txt').read() == 'foo' * 1000
+
+
+def test_stdin_to_stdout(tmpdir):
+    src = tmpdir.join('in')
+    src.write('foo' * 1000)
+    dst = tmpdir.join('out')
+    files = [open(str(src), 'rb'), open(str(dst), 'wb')]
+
+    with mock.patch.object(cli, 'sys'):
+        with mock.patch('os.fdopen', side_effect=files):
+            assert run('encrypt', '-p', 'foo', '-') == 0
+    assert read_encrypted(dst) == 'foo' * 1000
+
+
+def test_dash_cannot_be_combined_with_paths():
+    with pytest.raises(SystemExit):
+        run('encrypt', '-p', 'foo', '-', 'foo.txt')
+
+
+def test_get_credentials_from_environment_or_prompt(monkeypatch):
+    monkeypatch.setenv(cli.PASSWORD_ENV, 'foo')
+    assert cli.get_credentials(None, None, cli.PASSWORD_ENV, '') == {
+        'password': 'foo', 'key': None}
+
+    monkeypatch.delenv(cli.PASSWORD_ENV)
+    with mock.patch('getpass.getpass', return_value='bar'):
+        assert cli.get_credentials(None, None, cli.PASSWORD_ENV, '') == {
+            'password': 'bar', 'key': None}
+
+
+def test_get_options_for_rekey():
+    args = cli.parse_args(['rekey', '-k', 'foo.key', '--new-password', 'bar',
+                           'foo.txt'])
+
+    assert cli.get_options(args) == {
+        'old': {'password': None, 'key': 'foo.key'},
+        'new': {'password': 'bar', 'key': None},
+        'force': False}
+
+
+@pytest.mark.parametrize('command,src,output_dir,expected', [
+    ('encrypt', 'a/b.txt', None, 'a/b.txt.enc'),
+    ('decrypt', 'a/b.txt.enc', None, 'a/b.txt'),
+    ('decrypt', 'a/b.txt', None, 'a/b.txt.dec'),
+    ('rekey', 'a/b.txt.enc', None, 'a/b.txt.enc'),
+    ('encrypt', 'a/b.txt', 'out', 'out/b.txt.enc'),
+])
+def test_target_path(command, src, output_dir, expected):
+    assert cli.target_path(command, src, 'a', '.enc', output_dir) == expected
+
+
+def test_process_file_creates_output_directories(tmpdir):
+    src = tmpdir.join('foo.txt')
+    src.write('foo')
+    dst = tmpdir.join('a', 'b', 'foo.txt.enc')
+    options = {'new': {'password': 'foo', 'key': None}}
+
+    result = cli.process_file(('encrypt', str(src), str(dst), options))
+    assert result[1] == 3 and result[3] is None
+    assert read_encrypted(dst) == 'foo'
+
+
+def test_process_file_tolerates_concurrent_makedirs(tmpdir):
+    src = tmpdir.join('foo.txt')
+    src.write('foo')
+    dst = tmpdir.join('a', 'foo.txt.enc')
+    options = {'new': {'password': 'foo', 'key': None}}
+
+    def makedirs(path):
+        os.mkdir(path)
+        raise OSError('File exists')
+
+    with mock.patch('os.makedirs', side_effect=makedirs):
+        result = cli.process_file(('encrypt', str(src), str(dst), options))
+    assert result[3] is None
+
+
+def test_process_stream_rekeys(tmpdir):
+    src = tmpdir.join('foo.enc')
+    with Writer(str(src), password='foo') as f:
+        f.write('foo' * 1000)
+    dst = tmpdir.join('bar.enc')
+    options = {'old': {'password': 'foo', 'key': None},
+               'new': {'password': 'bar', 'key': None}}
+
+    size = cli.process_stream('rekey', open(str(src), 'rb'),
+                              open(str(dst), 'wb'), options)
+    assert size == 3000
+    assert read_encrypted(dst, 'bar') == 'foo' * 1000
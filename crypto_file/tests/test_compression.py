@@ -0,0 +1,57 @@
+import mock
+import pytest
+
+from crypto_file import compression
+
+
+@pytest.mark.parametrize('name', ['zlib', 'gzip', 'bz2'])
+def test_compressor_round_trips(name):
+    codec = compression.get_codec(name)
+    c = compression.compressor(codec)
+    compressed = c.compress('foo' * 1000) + c.flush()
+
+    assert compression.decompressor(codec).decompress(compressed) == (
+        'foo' * 1000)
+
+
+@pytest.mark.parametrize('name,flushed', [
+    ('zlib', True), ('gzip', True), ('bz2', False)])
+def test_sync_flush_keeps_stream_open(name, flushed):
+    codec = compression.get_codec(name)
+    c = compression.compressor(codec)
+    compressed = c.compress('foo' * 1000)
+    compressed += compression.sync_flush(codec, c)
+
+    d = compression.decompressor(codec)
+    assert (d.decompress(compressed) == 'foo' * 1000) is flushed
+    assert c.compress('bar') is not None
+
+
+def test_get_codec_without_compression():
+    assert compression.get_codec(None) == 0
+
+
+def test_get_codec_errors_for_unknown_codec():
+    with pytest.raises(ValueError):
+        compression.get_codec('zip')
+
+
+def test_get_codec_errors_without_lzma(monkeypatch):
+    monkeypatch.setattr(compression, 'lzma', None)
+    with pytest.raises(ValueError):
+        compression.get_codec('lzma')
+
+
+def test_lzma_uses_lzma_module(monkeypatch):
+    lzma = mock.Mock()
+    monkeypatch.setattr(compression, 'lzma', lzma)
+
+    assert compression.get_codec('lzma') == 4
+    assert compression.compressor(4) is lzma.LZMACompressor.return_value
+    assert compression.decompressor(4) is lzma.LZMADecompressor.return_value
+
+
+@pytest.mark.parametrize('factory', ['compressor', 'decompressor'])
+def test_unsupported_codec_raises(factory):
+    with pytest.raises(IOError):
+        getattr(compression, factory)(9)
@@ -1,4 +1,7 @@
 import base64
+import hashlib
+import io
+import os
 
 import mock
 import pytest
@@ -6,6 +9,7 @@ import pytest
 from Crypto.Cipher import AES
 
 from crypto_file.crypto_handler import CryptoHandler
+from crypto_file.keys import KEYRING, Key
 
 
 BASE_MOCK_PATH = 'crypto_file.crypto_handler'
@@ -26,13 +30,6 @@ def handler(mock_open):
     yield handler
 
 
-@pytest.fixture()
-def mock_b64():
-    with mock.patch('{}.base64'.format(BASE_MOCK_PATH), autospec=True) as m:
-        m.b64decode.return_value = '1' * 32
-        yield m
-
-
 @pytest.fixture()
 def mock_sha256():
     path = '{}.hashlib.sha256'.format(BASE_MOCK_PATH)
@@ -71,16 +68,27 @@ def test_handler_constructor_handles_file_fname_with_b(mock_open):
     asset_good_handler(handler, mock_open, mock_file, expected_mode)
 
 
-def test_handler_constructor_handles_file_fname_without_b(mock_open):
+def test_handler_constructor_uses_file_fname_without_b(mock_open):
     mock_file = mock.Mock(spec=file)
-    mock_file.mode = 'r'
-    expected_mode = 'rb'
-    mock_open.return_value.mode = expected_mode
+    mock_file.mode = expected_mode = 'r'
     handler = CryptoHandler(fname=mock_file,
-                            mode=expected_mode,
+                            mode='rb',
                             password='foo')
 
     asset_good_handler(handler, mock_open, mock_file, expected_mode)
+    assert handler.fObj is mock_file
+    mock_file.close.assert_not_called()
+    mock_open.assert_not_called()
+
+
+@pytest.mark.parametrize('name,expected', [
+    ('foo.txt', 'foo.txt'), ('<stdin>', None), ('<fdopen>', None),
+    (3, None)])
+def test_name_of_files_without_a_path(handler, name, expected):
+    handler.fObj = mock.Mock(spec=file)
+    handler.fObj.name = name
+
+    assert handler.name == expected
 
 
 def test_raises_io_error_without_correct_fname():
@@ -88,44 +96,57 @@ def test_raises_io_error_without_correct_fname():
         CryptoHandler(fname=1)
 
 
-def test_gen_key_handles_key_as_keyfile_sets_pw(handler, mock_open, mock_b64):
-    handler.key = 'keyfile.key'
+def test_gen_key_handles_key_as_keyfile_sets_pw(handler, tmpdir):
+    keyfile = tmpdir.join('keyfile.key')
+    keyfile.write('1' * 32)
+    handler.key = str(keyfile)
     handler.gen_key()
 
-    assert handler.key == mock_open.return_value.read.return_value
-    assert handler.password == mock_b64.b64encode.return_value
-    mock_b64.b64encode.assert_called_once_with(handler.key)
-    mock_open.assert_called_once_with('keyfile.key', 'rb')
+    assert handler.key == '1' * 32
+    assert handler.password == base64.b64encode('1' * 32)
 
 
-def test_gen_key_handles_key_str(handler, mock_open, mock_b64):
-    handler.key = 'foo'
+def test_gen_key_handles_key_str(handler, mock_open):
+    handler.key = base64.b64encode('1' * 32)
     handler.gen_key()
 
-    assert handler.key == mock_b64.b64decode.return_value
-    assert handler.password == mock_b64.b64encode.return_value
-    mock_b64.b64encode.assert_called_once_with(handler.key)
+    assert handler.key == '1' * 32
+    assert handler.password == base64.b64encode('1' * 32)
     assert not mock_open.called
 
 
-def test_gen_key_errors_with_non_32_len_key(handler, mock_open, mock_b64):
-    handler.key = '1'
-    mock_b64.b64decode.return_value = 'NotLongEnough'
+def test_gen_key_errors_with_non_32_len_key(handler):
+    handler.key = base64.b64encode('NotLongEnough')
     with pytest.raises(NotImplementedError):
         handler.gen_key()
 
-    assert not mock_b64.b64encode.called
-    assert not mock_open.called
+
+def test_gen_key_generates_key_from_password(handler):
+    handler.password, handler.key = 'foo', None
+    handler.gen_key()
+
+    assert handler.key == hashlib.sha256('foo').digest()
+    assert handler.password == base64.b64encode(handler.key)
 
 
-def test_gen_key_generates_key_from_password(handler, mock_b64):
+def test_gen_key_accepts_key_object(handler):
+    handler.key = Key('2' * 32)
     handler.gen_key()
 
-    mock_b64.b64encode.assert_called_once_with(handler.key)
-    assert handler.password == mock_b64.b64encode.return_value
+    assert handler.key == '2' * 32
+    assert handler.password == base64.b64encode('2' * 32)
 
 
-def test_gen_key_errors_with_invalid_password(handler, mock_b64):
+def test_gen_key_uses_process_keyring(handler):
+    KEYRING.clear()
+    for _ in range(2):
+        handler.password, handler.key = 'foo', None
+        handler.gen_key()
+
+    assert (KEYRING.misses, KEYRING.hits) == (1, 1)
+
+
+def test_gen_key_errors_with_invalid_password(handler):
     handler.password = 1234
     handler.key = None
     with pytest.raises(ValueError):
@@ -140,6 +161,67 @@ def test_gen_iv_sets_iv(handler, mock_sha256):
     assert handler.iv == b'1' * AES.block_size
 
 
+def test_gen_segment_iv_depends_on_index(handler):
+    handler.salt = 'salty'
+    iv = handler.gen_segment_iv(0)
+
+    assert len(iv) == AES.block_size
+    assert iv == handler.gen_segment_iv(0)
+    assert iv != handler.gen_segment_iv(1)
+
+
+def test_set_chunk_size_defaults(handler):
+    handler.set_chunk_size()
+
+    assert handler.chunk_size == 1024 * AES.block_size
+    assert handler.autoTune is False
+
+
+@pytest.mark.parametrize('chunk_size,expected', [
+    (1, AES.block_size),
+    (1000, 992),
+    (1024 * 1024, 1024 * 1024),
+    (100 * 1024 * 1024, CryptoHandler.MAX_CHUNK_SIZE),
+])
+def test_set_chunk_size_uses_whole_blocks(handler, chunk_size, expected):
+    handler.set_chunk_size(chunk_size)
+
+    assert handler.chunk_size == expected
+
+
+def test_set_chunk_size_auto_uses_file_blksize(handler):
+    with mock.patch('{}.os.fstat'.format(BASE_MOCK_PATH)) as m:
+        m.return_value.st_blksize = 64 * 1024
+        handler.set_chunk_size('auto')
+
+    assert handler.chunk_size == 1024 * 1024
+    assert handler.autoTune is True
+
+
+def test_set_chunk_size_auto_without_real_file(handler):
+    handler.fObj = mock.Mock(spec=['close'])
+    handler.set_chunk_size('auto')
+
+    assert handler.chunk_size == 1024 * AES.block_size
+
+
+def test_tune_chunk_size_grows_while_fast(handler):
+    handler.set_chunk_size(4 * 1024 * 1024)
+    handler.tune_chunk_size(0)
+
+    assert handler.chunk_size == CryptoHandler.MAX_CHUNK_SIZE
+
+    handler.tune_chunk_size(0)
+    assert handler.chunk_size == CryptoHandler.MAX_CHUNK_SIZE
+
+
+def test_tune_chunk_size_keeps_size_when_slow(handler):
+    handler.set_chunk_size(1024)
+    handler.tune_chunk_size(1)
+
+    assert handler.chunk_size == 1024
+
+
 def test_check_mode_passes_if_mode_matches(handler):
     handler.mode = 'rb'
 
@@ -177,3 +259,56 @@ def test__del__closes_file(handler):
     del handler
 
     assert fObj.closed
+
+
+def test_handler_accepts_binary_streams():
+    stream = io.BytesIO()
+    handler = CryptoHandler(fname=stream, mode='wb', password='foo')
+
+    assert handler.fObj is stream
+    assert handler.mode == 'wb'
+    assert handler.name is None
+
+
+@pytest.mark.parametrize('mode,expected', [
+    ('rb', io.BufferedReader), ('wb', io.BufferedWriter),
+    ('r+b', io.BufferedRandom)])
+def test_handler_buffers_raw_streams(tmpdir, mode, expected):
+    tmpdir.join('foo').write('')
+    raw = io.FileIO(str(tmpdir.join('foo')), 'r+b')
+    handler = CryptoHandler(fname=raw, mode=mode, password='foo')
+
+    assert isinstance(handler.fObj, expected)
+    assert handler.fObj.raw is raw
+    assert handler.name == str(tmpdir.join('foo'))
+
+
+def test_handler_errors_with_text_stream():
+    with pytest.raises(IOError):
+        CryptoHandler(fname=io.StringIO(), mode='rb', password='foo')
+
+
+@pytest.mark.parametrize('mode', ['wb', 'r+b'])
+def test_handler_errors_with_stream_missing_operation(mode):
+    stream = mock.Mock(spec=['read'])
+    with pytest.raises(IOError):
+        CryptoHandler(fname=stream, mode=mode, password='foo')
+
+
+def test_handler_has_no_fileno(handler):
+    assert not handler.isatty()
+    with pytest.raises(io.UnsupportedOperation):
+        handler.fileno()
+
+
+def test_file_seekable(handler, tmpdir):
+    handler.fObj = io.BytesIO()
+    assert handler.file_seekable()
+
+    handler.fObj = open(str(tmpdir.join('foo.txt')), 'wb')
+    assert handler.file_seekable()
+
+    r, w = os.pipe()
+    os.close(w)
+    handler.fObj = os.fdopen(r, 'rb')
+    assert not handler.file_seekable()
@@ -0,0 +1,109 @@
+import base64
+import hashlib
+
+import mock
+import pytest
+
+from crypto_file import keys
+from crypto_file.keys import Key, KeyRing
+from crypto_file.reader import Reader
+from crypto_file.writer import Writer
+
+
+@pytest.fixture()
+def keyring():
+    yield KeyRing(size=2)
+
+
+def test_key_from_password():
+    key = Key.from_password('foo')
+
+    assert key.key == hashlib.sha256('foo').digest()
+    assert key.password == base64.b64encode(key.key)
+
+
+def test_key_from_string_errors_with_non_32_len_key():
+    with pytest.raises(NotImplementedError):
+        Key.from_string(base64.b64encode('NotLongEnough'))
+
+
+def test_keyring_derives_each_password_once(keyring):
+    first = keyring.get(password='foo')
+
+    assert keyring.get(password='foo') is first
+    assert (keyring.misses, keyring.hits) == (1, 1)
+
+
+def test_keyring_drops_least_recently_used(keyring):
+    foo = keyring.get(password='foo')
+    keyring.get(password='bar')
+    keyring.get(password='foo')
+    keyring.get(password='baz')
+
+    assert keyring.get(password='foo') is foo
+    assert ('password', 'bar') not in keyring.keys
+    assert len(keyring.keys) == 2
+
+
+def test_keyring_uses_its_derivation():
+    derive = mock.Mock(return_value='1' * 32)
+    keyring = KeyRing(derive=derive)
+
+    assert keyring.get(password='foo').key == '1' * 32
+    keyring.get(password='foo')
+    derive.assert_called_once_with('foo')
+
+
+def test_keyring_passes_key_objects_through(keyring):
+    key = Key('1' * 32)
+
+    assert keyring.get(password='foo', key=key) is key
+    assert not keyring.keys
+
+
+def test_keyring_caches_key_strings(keyring):
+    s = base64.b64encode('1' * 32)
+
+    assert keyring.get(key=s) is keyring.get(key=s)
+    assert keyring.get(key=s).key == '1' * 32
+
+
+def test_keyring_reads_replaced_key_file_again(keyring, tmpdir):
+    keyfile = tmpdir.join('foo.key')
+    keyfile.write('1' * 32)
+
+    assert keyring.get(key=str(keyfile)) is keyring.get(key=str(keyfile))
+    keyfile.write('2' * 31)
+    keyfile.setmtime(keyfile.mtime() + 10)
+    assert keyring.get(key=str(keyfile)).key == '2' * 31
+
+
+def test_keyring_reads_unstatable_key_file_uncached(keyring):
+    with mock.patch.object(keys.os, 'stat', side_effect=OSError):
+        with mock.patch.object(Key, 'from_file') as from_file:
+            keyring.get(key='foo.key')
+    from_file.assert_called_once_with('foo.key')
+    assert not keyring.keys
+
+
+def test_keyring_errors_without_key_or_password(keyring):
+    with pytest.raises(ValueError):
+        keyring.get()
+
+
+def test_keyring_clear(keyring):
+    keyring.get(password='foo')
+    keyring.clear()
+
+    assert not keyring.keys
+    assert (keyring.misses, keyring.hits) == (0, 0)
+
+
+def test_key_object_for_reader_and_writer(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    key = Key.from_password('foo')
+    with Writer(fname=fname, key=key) as f:
+        f.write('foo' * 100)
+
+    assert Reader(fname=fname, key=key).read() == 'foo' * 100
+    assert Reader(fname=fname, password='foo').read() == 'foo' * 100
@@ -0,0 +1,69 @@
+import pytest
+
+from crypto_file.line_index import LineIndex
+
+
+LINES = ['line {}\n'.format(i) for i in range(100)]
+
+
+def line_offset(n):
+    return len(''.join(LINES[:n]))
+
+
+def test_init_starts_with_first_line():
+    line_index = LineIndex(stride=10, salt='salty')
+
+    assert line_index.offsets == [0]
+    assert line_index.lines == 0
+    assert line_index.size == 0
+
+
+def test_sidecar_name():
+    assert LineIndex.sidecar_name('foo.txt') == 'foo.txt.lidx'
+
+
+@pytest.mark.parametrize('piece', [1, 7, 100, 10000])
+def test_feed_indexes_every_stride_line(piece):
+    line_index = LineIndex(stride=10)
+    plaintext = ''.join(LINES)
+    for i in range(0, len(plaintext), piece):
+        line_index.feed(plaintext[i:i + piece])
+
+    assert line_index.offsets == [line_offset(n) for n in range(0, 101, 10)]
+    assert line_index.lines == 100
+    assert line_index.size == len(plaintext)
+
+
+def test_feed_accepts_buffers():
+    line_index = LineIndex(stride=1)
+    line_index.feed(memoryview('Foo\nBar'))
+    line_index.feed(bytearray('\nBaz'))
+
+    assert line_index.offsets == [0, 4, 8]
+    assert line_index.lines == 2
+
+
+@pytest.mark.parametrize('n,expected', [
+    (0, (0, 0)),
+    (9, (0, 9)),
+    (10, (line_offset(10), 0)),
+    (25, (line_offset(20), 5)),
+    (1000, (line_offset(100), 900)),
+])
+def test_locate_finds_indexed_line_before(n, expected):
+    line_index = LineIndex(stride=10)
+    line_index.feed(''.join(LINES))
+
+    assert line_index.locate(n) == expected
+
+
+def test_dumps_and_loads_round_trip():
+    line_index = LineIndex(stride=10, salt='saltysal')
+    line_index.feed(''.join(LINES))
+    loaded = LineIndex.loads(line_index.dumps())
+
+    assert loaded.stride == 10
+    assert loaded.salt == 'saltysal'
+    assert loaded.size == line_index.size
+    assert loaded.lines == 100
+    assert loaded.offsets == line_index.offsets
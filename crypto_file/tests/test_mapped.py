@@ -0,0 +1,72 @@
+import mock
+import pytest
+
+from crypto_file.mapped import MappedFile
+
+
+@pytest.fixture()
+def mapped():
+    mapping = mock.MagicMock()
+    mapping.__len__.return_value = len('FooBarBaz')
+    mapping.__getitem__.side_effect = 'FooBarBaz'.__getitem__
+    yield MappedFile(mapping)
+
+
+def test_open_maps_file_read_only(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    open(fname, 'wb').write('FooBarBaz')
+    with open(fname, 'rb') as fObj:
+        with MappedFile.open(fObj) as mapped:
+            assert mapped.read() == 'FooBarBaz'
+
+    with pytest.raises(ValueError):
+        mapped.read()
+
+
+def test_read_slices_mapping():
+    mapped = MappedFile('FooBarBaz')
+
+    assert mapped.read(3) == 'Foo'
+    assert mapped.tell() == 3
+    assert mapped.read(100) == 'BarBaz'
+    assert mapped.tell() == 9
+    assert mapped.read(1) == ''
+
+
+def test_read_without_size_reads_rest():
+    mapped = MappedFile('FooBarBaz')
+    mapped.seek(3)
+
+    assert mapped.read() == 'BarBaz'
+
+
+@pytest.mark.parametrize('pos,whence,expected', [
+    (3, 0, 3),
+    (100, 0, 100),
+    (-3, 2, 6),
+    (2, 1, 7),
+])
+def test_seek_like_a_file(pos, whence, expected):
+    mapped = MappedFile('FooBarBaz')
+    mapped.seek(5)
+    mapped.seek(pos, whence)
+
+    assert mapped.tell() == expected
+
+
+def test_seek_before_start_raises_error():
+    with pytest.raises(IOError):
+        MappedFile('FooBarBaz').seek(-1)
+
+
+def test_dup_has_own_position_and_does_not_close_mapping(mapped):
+    mapped.read(3)
+    copy = mapped.dup()
+
+    assert copy.read(3) == 'Foo'
+    assert mapped.read(3) == 'Bar'
+    copy.close()
+    assert not mapped.mapping.close.called
+
+    mapped.close()
+    mapped.mapping.close.assert_called_once()
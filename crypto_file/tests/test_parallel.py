@@ -0,0 +1,55 @@
+import io
+import os
+from multiprocessing.pool import ThreadPool
+
+import mock
+import pytest
+
+from crypto_file.parallel import decrypt_file
+from crypto_file.tests.helpers import write_file
+
+
+@pytest.mark.parametrize('length', [0, 1, 15, 16, 17, 5000])
+@pytest.mark.parametrize('range_size', [1, 48, 1000, 4 * 1024 * 1024])
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_decrypt_file_round_trip(tmpdir, length, range_size, use_mmap):
+    plaintext = os.urandom(length)
+    src = write_file(str(tmpdir.join('foo.txt')), plaintext)
+    dst = str(tmpdir.join('bar.txt'))
+    size = decrypt_file(src, dst, password='foo', workers=3,
+                        range_size=range_size, use_mmap=use_mmap)
+
+    assert size == length
+    assert open(dst, 'rb').read() == plaintext
+
+
+def test_decrypt_file_writes_ranges_in_order(tmpdir):
+    plaintext = ''.join('line {}\n'.format(i) for i in range(10000))
+    src = write_file(str(tmpdir.join('foo.txt')), plaintext)
+    dst = mock.Mock(spec=file)
+    decrypt_file(src, dst, password='foo', workers=4, range_size=1024)
+
+    assert dst.write.call_count == len(plaintext) // 1024 + 1
+    assert ''.join(c[0][0] for c in dst.write.call_args_list) == plaintext
+    dst.close.assert_not_called()
+
+
+def test_decrypt_file_leaves_file_object_open(tmpdir):
+    src = write_file(str(tmpdir.join('foo.txt')), 'Foo')
+    dst = io.BytesIO()
+
+    assert decrypt_file(src, dst, password='foo') == 3
+    assert not dst.closed
+    assert dst.getvalue() == 'Foo'
+
+
+def test_decrypt_file_defaults_to_cpu_count(tmpdir):
+    fname = write_file(str(tmpdir.join('foo.txt')), 'Foo')
+    dst = str(tmpdir.join('bar.txt'))
+    with mock.patch('crypto_file.parallel.cpu_count', return_value=2), \
+            mock.patch('crypto_file.parallel.ThreadPool',
+                       wraps=ThreadPool) as m:
+        decrypt_file(fname, dst, password='foo')
+
+    m.assert_called_once_with(2)
+    assert open(dst, 'rb').read() == 'Foo'
@@ -0,0 +1,87 @@
+import io
+
+import mock
+import pytest
+
+from crypto_file.pipeline import ReadAhead, WriteBehind
+
+
+def test_read_ahead_reads_chunks_in_order():
+    read_ahead = ReadAhead(io.BytesIO('FooBarBaz'), 4, 2)
+
+    assert read_ahead.read(2) == 'Fo'
+    assert read_ahead.read(10) == 'oB'
+    assert read_ahead.read(4) == 'arBa'
+    assert read_ahead.read(4) == 'z'
+    assert read_ahead.read(4) == ''
+    assert read_ahead.read(4) == ''
+    read_ahead.close()
+
+
+def test_read_ahead_raises_read_errors():
+    fObj = mock.Mock()
+    fObj.read.side_effect = ('Foo', IOError('Bar'))
+    read_ahead = ReadAhead(fObj, 4, 2)
+
+    assert read_ahead.read(4) == 'Foo'
+    with pytest.raises(IOError):
+        read_ahead.read(4)
+    assert read_ahead.read(4) == ''
+    read_ahead.close()
+
+
+def test_read_ahead_close_before_thread_starts_reading():
+    fObj = mock.Mock()
+    read_ahead = ReadAhead.__new__(ReadAhead)
+    read_ahead.closed = True
+    read_ahead.run(fObj, 4)
+
+    assert not fObj.read.called
+
+
+def test_read_ahead_close_stops_blocked_thread():
+    fObj = mock.Mock()
+    fObj.read.return_value = 'Foo'
+    read_ahead = ReadAhead(fObj, 4, 1)
+    read_ahead.thread.join(0.25)
+    read_ahead.close()
+
+    assert not read_ahead.thread.is_alive()
+    assert fObj.read.call_count <= 3
+
+
+def test_write_behind_writes_chunks_in_order():
+    fObj = io.BytesIO()
+    write_behind = WriteBehind(fObj, 1)
+    for chunk in ('Foo', 'Bar', 'Baz'):
+        write_behind.write(chunk)
+    write_behind.close()
+
+    assert fObj.getvalue() == 'FooBarBaz'
+    assert not write_behind.thread.is_alive()
+
+
+def test_write_behind_flush_waits_for_queued_chunks():
+    fObj = io.BytesIO()
+    write_behind = WriteBehind(fObj, 2)
+    for chunk in ('Foo', 'Bar', 'Baz'):
+        write_behind.write(chunk)
+    write_behind.flush()
+
+    assert fObj.getvalue() == 'FooBarBaz'
+    assert write_behind.thread.is_alive()
+    write_behind.close()
+
+
+def test_write_behind_raises_write_errors():
+    fObj = mock.Mock()
+    fObj.write.side_effect = IOError('Foo')
+    write_behind = WriteBehind(fObj, 2)
+    write_behind.write('Foo')
+    write_behind.write('Bar')
+
+    with pytest.raises(IOError):
+        write_behind.close()
+    with pytest.raises(IOError):
+        write_behind.write('Baz')
+    fObj.write.assert_called_once_with('Foo')
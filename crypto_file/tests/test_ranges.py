@@ -0,0 +1,96 @@
+from multiprocessing import Pool
+
+import mock
+import pytest
+
+from crypto_file.ranges import plan_ranges, RangeReader
+from crypto_file.reader import Reader
+from crypto_file.tests.helpers import PLAINTEXT, write_file
+
+
+def count_lines(args):
+    with RangeReader(*args, password='foo') as f:
+        return sum(1 for _ in f)
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'segment_size': 1024}])
+@pytest.mark.parametrize('n', [1, 3, 7])
+def test_ranges_cover_whole_lines(tmpdir, kwargs, n):
+    fname = write_file(str(tmpdir.join('foo.txt')), **kwargs)
+    ranges = plan_ranges(fname, n, password='foo')
+
+    assert len(ranges) == n
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(PLAINTEXT)
+    lines = []
+    for start, end in ranges:
+        assert start == 0 or PLAINTEXT[start - 1] == '\n'
+        with RangeReader(fname, start, end, password='foo') as f:
+            lines.extend(f)
+        assert f.tell() == end
+    assert ''.join(lines) == PLAINTEXT
+
+
+def test_cuts_only_decrypt_near_the_cut(tmpdir):
+    fname = write_file(str(tmpdir.join('foo.txt')))
+    reader = Reader(fname=fname, password='foo')
+    reader.size_at()
+
+    with mock.patch.object(reader, 'decrypt_at',
+                           wraps=reader.decrypt_at) as decrypt_at:
+        reader.split(4)
+    assert sum(call[0][1] for call in decrypt_at.call_args_list) <= 3 * 5
+
+
+def test_long_lines_and_few_lines(tmpdir):
+    plaintext = 'a' * 1000 + '\n' + 'b' * 10
+    fname = write_file(str(tmpdir.join('foo.txt')), plaintext)
+
+    ranges = plan_ranges(fname, 4, password='foo')
+    assert ranges == [(0, 1001), (1001, 1001), (1001, 1001), (1001, 1011)]
+    with RangeReader(fname, 1001, 1001, password='foo') as f:
+        assert f.read() == ''
+        assert list(f) == []
+
+
+def test_cut_in_last_line(tmpdir):
+    fname = write_file(str(tmpdir.join('foo.txt')), 'a\n' + 'b' * 1000)
+    assert plan_ranges(fname, 2, password='foo') == [(0, 1002), (1002, 1002)]
+
+
+def test_empty_file(tmpdir):
+    fname = write_file(str(tmpdir.join('foo.txt')), '')
+    assert plan_ranges(fname, 2, password='foo') == [(0, 0), (0, 0)]
+
+
+def test_range_reader_reads(tmpdir):
+    fname = write_file(str(tmpdir.join('foo.txt')))
+
+    with RangeReader(fname, 7, 21, password='foo') as f:
+        assert f.readline(3) == 'lin'
+        assert f.readline() == 'e 1\n'
+        assert f.remaining == 7
+        assert f.read(100) == PLAINTEXT[14:21]
+        assert f.readline() == ''
+
+
+def test_ranges_in_process_pool(tmpdir):
+    fname = write_file(str(tmpdir.join('foo.txt')))
+    pool = Pool(2)
+    try:
+        counts = pool.map(count_lines, [
+            (fname, start, end)
+            for start, end in plan_ranges(fname, 4, password='foo')])
+    finally:
+        pool.close()
+        pool.join()
+    assert sum(counts) == 5000
+
+
+def test_split_errors(tmpdir):
+    fname = write_file(str(tmpdir.join('foo.txt')), compression='zlib')
+    with pytest.raises(IOError):
+        plan_ranges(fname, 2, password='foo')
+    with pytest.raises(ValueError):
+        plan_ranges(fname, 0, password='foo')
+    with pytest.raises(ValueError):
+        RangeReader(fname, 10, 5, password='foo')
@@ -1,7 +1,18 @@
+import csv
+import gc
+import io
+import os
+import threading
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+
 import mock
 import pytest
 
 from crypto_file.reader import Reader
+from crypto_file.tests.helpers import PLAINTEXT, write_file
+from crypto_file.writer import Writer
 
 
 @pytest.fixture()
@@ -10,6 +21,11 @@ def mock_open():
         yield m
 
 
+@pytest.fixture()
+def encrypted_file(tmpdir):
+    yield write_file(str(tmpdir.join('foo.txt')))
+
+
 @pytest.fixture()
 def reader(mock_open):
     mock_open.return_value.read.return_value = 'Salted__asdfghj\n'
@@ -24,14 +40,22 @@ def test_init_errors_without_password_or_key():
         Reader(fname='foo')
 
 
+def set_stream(reader, stream, held_back=''):
+    reader.stream = bytearray(stream + held_back)
+    reader.stream_pos = 0
+    reader.stream_end = len(stream)
+
+
 def test_init_generates_expected_attributes(reader):
     assert reader.salt is not None
     assert reader.iv is not None
     assert reader.cipher is not None
-    assert reader.streamLines == 0
-    assert reader.chunk_unprocessed == ''
+    assert reader.stream == bytearray()
+    assert reader.stream_pos == 0
+    assert reader.stream_end == 0
     assert reader.enableSeek is True
-    assert reader.prev_stream == ''
+    assert reader.seek_window == 64 * 1024
+    assert reader.position == 0
 
 
 def test_get_salt_makes_salt_from_fObj(reader):
@@ -43,88 +67,242 @@ def test_get_salt_makes_salt_from_fObj(reader):
     assert reader.salt == expected_salt
 
 
+def test_get_salt_reads_segmented_header(reader):
+    reader.fObj.read.side_effect = (
+        'CrFileV2asdfghj\n', '\x00\x00\x04\x00' + 12 * '\x00')
+    reader.get_salt()
+
+    assert reader.salt == 'asdfghj\n'
+    assert reader.segment_blocks == 64
+    assert reader.header_size == 32
+
+
+def test_get_salt_reads_compression_codec(reader):
+    reader.fObj.read.side_effect = (
+        'CrFileV2asdfghj\n', 4 * '\x00' + '\x01' + 11 * '\x00')
+    reader.get_salt()
+
+    assert reader.segment_blocks is None
+    assert reader.codec == 1
+    assert reader.decompressor is not None
+    assert reader.header_size == 32
+
+
 def test_readline_returns_chunk_when_file_is_closed(reader):
     reader.fileOpen = False
-    reader.stream = "FooBar\nBaz"
-    chunk = reader.readline() 
+    set_stream(reader, "FooBar\nBaz")
+    chunk = reader.readline()
 
     assert chunk == 'FooBar\n'
-    assert reader.streamLines == -1
-    assert reader.prev_stream == chunk
+    assert reader.stream_pos == len(chunk)
+    assert reader.position == len(chunk)
+    assert reader.readline() == 'Baz'
+    assert reader.readline() == ''
 
 
 def test_readline_decrypts_returns_chunk(reader, mock_open):
-    reader.chunk_unprocessed = 'Something'
-    reader.fObj.read.return_value = ''
-    reader.stream = "FooBar\nBaz"
+    reader.fObj.read.side_effect = ('\x00' * 16, '')
+    reader.cipher = mock.Mock()
+    reader.cipher.decrypt.return_value = 'x' * 15 + '\x01'
+    set_stream(reader, "FooBar")
     chunk = reader.readline()
 
-    assert chunk == 'FooBar\n'
-    assert reader.streamLines == -1
-    assert reader.prev_stream == chunk
+    assert chunk.startswith('FooBar')
+    assert reader.fObj.read.call_count == 2
+    assert not reader.fileOpen
 
 
-def test_readline_does_not_set_prev_stream(reader, mock_open):
-    reader.chunk_unprocessed = 'Something'
-    reader.fObj.read.return_value = ''
-    reader.stream = "FooBar\nBaz"
+def test_readline_spanning_chunks(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    expected_line = 'Foo' * 20000 + '\n'
+    write_file(fname, expected_line + 'Bar')
+
+    reader = Reader(fname=fname, password='foo')
+    assert reader.readline() == expected_line
+    assert reader.readline() == 'Bar'
+
+
+def test_readline_drops_values_when_seek_disabled(reader, mock_open):
+    reader.fileOpen = False
     reader.enableSeek = False
+    set_stream(reader, "FooBar\nBaz")
     chunk = reader.readline()
 
     assert chunk == 'FooBar\n'
-    assert reader.streamLines == -1
-    assert reader.prev_stream == ''
+    assert reader.stream == bytearray('Baz')
+    assert reader.stream_pos == 0
 
 
 def test_read_returns_chunk_when_file_is_closed(reader):
     reader.fileOpen = False
-    reader.stream = "FooBar\nBaz"
+    set_stream(reader, "FooBar\nBaz")
     chunk = reader.read(2)
 
     assert chunk == "Fo"
-    assert reader.streamLines == 0
-    assert reader.prev_stream == chunk
+    assert reader.stream_pos == 2
+    assert reader.position == 2
 
 
-def test_read_decrypts_returns_chunk(reader, mock_open):
-    reader.stream = "FooBar\nBaz"
+def test_read_returns_buffered_chunk(reader, mock_open):
+    set_stream(reader, "FooBar\nBaz")
     chunk = reader.read(2)
 
     assert chunk == 'Fo'
-    assert reader.streamLines == 0
-    assert reader.prev_stream == chunk
+    assert not reader.fObj.read.called
 
 
-def test_read_does_not_set_prev_stream(reader, mock_open):
-    reader.stream = "FooBar\nBaz"
-    reader.enableSeek = False
-    chunk = reader.read(2)
+def test_read_keeps_seek_window(reader, mock_open):
+    reader.seek_window = 2
+    set_stream(reader, "FooBar\nBaz")
+    assert reader.read(8) == 'FooBar\nB'
 
-    assert chunk == 'Fo'
-    assert reader.streamLines == 0
-    assert reader.prev_stream == ''
+    assert reader.stream == bytearray('\nBaz')
+    assert reader.stream_pos == 2
+    assert reader.stream_end == 4
 
 
 def test_read_decrypts_chunk_when_size_larger_than_stream(reader, mock_open):
-    expected_chunk = "FooBar\nBaz"
-    reader.stream = expected_chunk
-    chunk = reader.read(len(reader.stream) + 1)
+    reader.fObj.read.side_effect = ('\x00' * 16, '')
+    reader.cipher = mock.Mock()
+    reader.cipher.decrypt.return_value = 'x' * 15 + '\x01'
+    set_stream(reader, "FooBar\nBaz")
+    chunk = reader.read(len("FooBar\nBaz") + 1)
 
-    assert chunk == expected_chunk + '\x03'
-    assert reader.streamLines == 0
-    assert reader.prev_stream == expected_chunk + '\x03'
+    assert len(chunk) == len("FooBar\nBaz") + 1
+    assert chunk.startswith("FooBar\nBaz")
 
 
 def test_read_with_no_size_gets_whole_stream(reader, mock_open):
-    reader.chunk_unprocessed = ''
-    expected_chunk = 'FooBar\nBaz\x03\x85\xd3\xf4'
-    reader.fObj.read.side_effect = ('Salted__asdfghj\n', '')
-    reader.stream = "FooBar\nBaz"
+    reader.fObj.read.return_value = ''
+    set_stream(reader, "FooBar\nBaz", held_back='Foo\x02\x02')
     chunk = reader.read()
 
-    assert chunk == expected_chunk
-    assert reader.streamLines == 0
-    assert reader.prev_stream == expected_chunk
+    assert chunk == 'FooBar\nBazFoo'
+    assert not reader.fileOpen
+
+
+def test_iterates_over_lines(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+
+    assert iter(reader) is reader
+    assert list(reader) == PLAINTEXT.splitlines(True)
+    with pytest.raises(StopIteration):
+        next(reader)
+
+
+def test_readlines_reads_all_lines(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+
+    assert reader.readlines() == PLAINTEXT.splitlines(True)
+
+
+def test_readlines_stops_after_hint(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+
+    assert reader.readlines(10) == ['line 0\n', 'line 1\n']
+    assert reader.readline() == 'line 2\n'
+
+
+@pytest.mark.parametrize('n', [0, 1, 999, 1000, 1001, 4321, 4999])
+def test_getline_uses_line_index(encrypted_file, n):
+    reader = Reader(fname=encrypted_file, password='foo')
+    reader.line_index = reader.build_line_index(stride=100)
+    with mock.patch.object(reader, 'readline',
+                           wraps=reader.readline) as m:
+        line = reader.getline(n)
+
+    assert line == 'line {}\n'.format(n)
+    assert m.call_count == n % 100 + 1
+    assert reader.readline() == ''.join(
+        PLAINTEXT.splitlines(True)[n + 1:n + 2])
+
+
+def test_getline_past_last_line(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+
+    assert reader.getline(5000) == ''
+    assert reader.getline(100000) == ''
+
+
+def test_get_line_index_builds_index_without_sidecar(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+    reader.read(10)
+    line_index = reader.get_line_index()
+
+    assert line_index.lines == 5000
+    assert line_index.offsets[1] == len(''.join(
+        'line {}\n'.format(i) for i in range(1000)))
+    assert reader.get_line_index() is line_index
+    assert reader.read(10) == PLAINTEXT[10:20]
+
+
+def test_save_line_index_writes_sidecar(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+    reader.line_index = reader.build_line_index(stride=10)
+    reader.save_line_index()
+
+    reader = Reader(fname=encrypted_file, password='foo')
+    assert reader.get_line_index().stride == 10
+    assert open(encrypted_file + '.lidx', 'rb').read(8) == 'Salted__'
+
+
+def test_load_line_index_ignores_index_of_other_file(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+    reader.line_index = reader.build_line_index(stride=10)
+    reader.save_line_index()
+    write_file(encrypted_file)
+
+    reader = Reader(fname=encrypted_file, password='foo')
+    assert reader.load_line_index() is None
+    assert reader.get_line_index().stride == 1000
+
+
+def test_readinto_copies_buffered_values(reader):
+    reader.fileOpen = False
+    set_stream(reader, "FooBar\nBaz")
+    b = bytearray(4)
+
+    assert reader.readinto(b) == 4
+    assert b == bytearray('FooB')
+    assert reader.position == 4
+
+
+@pytest.mark.parametrize('size', [1, 16, 33, 4096, 100000])
+def test_readinto_reads_whole_file(encrypted_file, size):
+    reader = Reader(fname=encrypted_file, password='foo')
+    reader.read(3)
+    chunks = [PLAINTEXT[:3]]
+    b = bytearray(size)
+    count = reader.readinto(b)
+    while count:
+        chunks.append(str(b[:count]))
+        count = reader.readinto(b)
+
+    assert ''.join(chunks) == PLAINTEXT
+    assert reader.position == len(PLAINTEXT)
+
+
+def test_decrypt_into_decrypts_to_buffer(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+    b = bytearray(40)
+    count = reader.decrypt_into(memoryview(b))
+
+    assert count == 32
+    assert str(b[:count]) == PLAINTEXT[:32]
+    assert reader.stream == bytearray(PLAINTEXT[32:48])
+    assert reader.stream_end == 0
+    assert reader.position == 32
+
+
+def test_seek_window_stays_bounded(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo', seek_window=100)
+    while reader.readline():
+        assert reader.stream_pos <= 100 + reader.chunk_size
+
+    reader.seek(-150, mode=1)
+    assert reader.read(10) == PLAINTEXT[-150:-140]
+    reader.seek(-3000, mode=2)
+    assert reader.read(10) == PLAINTEXT[-3000:-2990]
 
 
 def test_seek_raises_error_when_enableSeek_False(reader):
@@ -133,9 +311,13 @@ def test_seek_raises_error_when_enableSeek_False(reader):
         reader.seek(1)
 
 
-def test_seek_eof_raises_error(reader):
-    with pytest.raises(IOError):
-        reader.seek(1, mode=2)
+def test_seek_with_mode_two_seeks_from_end(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+    reader.seek(-10, mode=2)
+
+    assert reader.tell() == len(PLAINTEXT) - 10
+    assert reader.read() == PLAINTEXT[-10:]
+    assert reader.tell() == len(PLAINTEXT)
 
 
 def test_seek_with_unknown_mode_raises_error(reader):
@@ -143,50 +325,589 @@ def test_seek_with_unknown_mode_raises_error(reader):
         reader.seek(1, mode=34)
 
 
-def test_seek_with_mode_zero_reads_position_in_stream(reader):
-    reader.prev_stream = "Foo"
+def test_seek_before_start_raises_error(reader):
+    with pytest.raises(IOError):
+        reader.seek(-1)
+
+
+def test_seek_with_mode_zero_moves_back_in_stream(reader):
+    set_stream(reader, "FooBar")
+    reader.stream_pos = reader.position = 3
     reader.seek(1)
 
-    assert reader.stream == 'oo'
-    assert reader.prev_stream == 'F'
+    assert reader.stream_pos == 1
+    assert reader.position == 1
+    assert reader.read(2) == 'oo'
 
 
 def test_seek_with_mode_one_reads_stream(reader):
-    reader.prev_stream = "Foo"
+    set_stream(reader, "FooBar")
+    reader.stream_pos = reader.position = 3
     reader.seek(1, mode=1)
 
-    assert reader.stream != ''
-    assert reader.prev_stream == 'Foo\x03'
+    assert reader.stream_pos == 4
+    assert reader.position == 4
+    assert reader.read(2) == 'ar'
+
+
+def test_seek_outside_streams_jumps_to_block(reader):
+    with mock.patch.object(reader, 'seek_block') as m:
+        reader.seek(100)
+
+    m.assert_called_once_with(100)
+
+
+@pytest.mark.parametrize('length', [0, 1, 15, 16, 17, 32, 20000])
+def test_size_reads_only_last_blocks(tmpdir, length):
+    fname = str(tmpdir.join('foo.txt'))
+    write_file(fname, PLAINTEXT[:length])
+
+    reader = Reader(fname=fname, password='foo')
+    reader.read(5)
+    reader.fObj = mock.Mock(wraps=reader.fObj)
+
+    assert reader.size == length
+    assert reader.size == length
+    assert reader.fObj.read.call_count <= 2
+    assert reader.read() == PLAINTEXT[5:length]
+
+
+def test_size_of_file_without_cipher_text(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    open(fname, 'wb').write('Salted__asdfghj\n')
+
+    assert Reader(fname=fname, password='foo').size == 0
+
+
+def test_decrypt_blocks_uses_own_file_object(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+    with open(encrypted_file, 'rb') as fObj:
+        assert reader.decrypt_blocks(fObj, 0, 2) == PLAINTEXT[:32]
+        assert reader.decrypt_blocks(fObj, 100, 3) == PLAINTEXT[1600:1648]
+        assert reader.decrypt_blocks(fObj, 100000, 1) == ''
+
+    assert reader.fObj.tell() == reader.bs
+
+
+@pytest.fixture()
+def segmented_file(tmpdir):
+    yield write_file(str(tmpdir.join('foo.txt')), segment_size=1024)
+
+
+def test_segmented_file_reads_sequentially(segmented_file):
+    reader = Reader(fname=segmented_file, password='foo', chunk_size=1000)
+
+    assert reader.segment_blocks == 64
+    assert reader.size == len(PLAINTEXT)
+    assert reader.readline() == 'line 0\n'
+    assert reader.read() == PLAINTEXT[len('line 0\n'):]
+
+
+def test_segmented_file_seeks(segmented_file):
+    reader = Reader(fname=segmented_file, password='foo')
+    for pos in (30000, 1024, 1023, 2048 + 16, 7, 0, len(PLAINTEXT) - 1):
+        reader.seek(pos)
+        assert reader.read(2000) == PLAINTEXT[pos:pos + 2000]
+
+
+def test_decrypt_blocks_spans_segments(segmented_file):
+    reader = Reader(fname=segmented_file, password='foo')
+    with open(segmented_file, 'rb') as fObj:
+        plain = reader.decrypt_blocks(fObj, 60, 70)
+
+    assert plain == PLAINTEXT[60 * 16:130 * 16]
+
+
+def test_read_cipher_stops_at_segment_end(segmented_file):
+    reader = Reader(fname=segmented_file, password='foo')
+    reader.next_block = 60
+
+    assert len(reader.read_cipher(1000)) == 4 * reader.bs
+    assert reader.next_block == 64
+
+
+@pytest.mark.parametrize('fixture', ['encrypted_file', 'segmented_file'])
+def test_prefetch_reads_and_seeks(request, fixture):
+    fname = request.getfixturevalue(fixture)
+    reader = Reader(fname=fname, password='foo', chunk_size=512, prefetch=2)
+
+    assert reader.read_ahead is not None
+    assert reader.readline() == 'line 0\n'
+    assert reader.size == len(PLAINTEXT)
+    assert reader.read(5000) == PLAINTEXT[7:5007]
+    for pos in (30000, 1000, 0, len(PLAINTEXT) - 10):
+        reader.seek(pos)
+        assert reader.read(1000) == PLAINTEXT[pos:pos + 1000]
+
+    reader.close()
+    assert reader.read_ahead is None
+    assert reader.fObj.closed
+
+
+@pytest.mark.parametrize('fixture', ['encrypted_file', 'segmented_file'])
+def test_mmap_reads_and_seeks(request, fixture):
+    fname = request.getfixturevalue(fixture)
+    reader = Reader(fname=fname, password='foo', use_mmap=True)
+
+    assert reader.cipher_file is reader.mapped
+    assert reader.readline() == 'line 0\n'
+    assert reader.size == len(PLAINTEXT)
+    for pos in (30000, 1000, 0, len(PLAINTEXT) - 10):
+        reader.seek(pos)
+        assert reader.read(1000) == PLAINTEXT[pos:pos + 1000]
+    b = bytearray(len(PLAINTEXT))
+    reader.seek(0)
+    assert reader.readinto(b) == len(PLAINTEXT)
+    assert str(b) == PLAINTEXT
+
+    reader.close()
+    assert reader.mapped is None
+    assert reader.fObj.closed
+
+
+def test_open_cipher_file_opens_file(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+    with reader.open_cipher_file() as fObj:
+        assert fObj is not reader.fObj
+        assert fObj.name == encrypted_file
+
+
+def test_open_cipher_file_shares_mapping(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo', use_mmap=True)
+    with reader.open_cipher_file() as fObj:
+        assert fObj.mapping is reader.mapped.mapping
+        assert fObj.tell() == 0
+
+    assert reader.read(10) == PLAINTEXT[:10]
+
+
+def test_seek_block_decrypts_only_target_block(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+    reader.fObj = mock.Mock(wraps=reader.fObj)
+    reader.seek(len(PLAINTEXT) - 10)
+    chunk = reader.read()
+
+    assert chunk == PLAINTEXT[-10:]
+    reader.fObj.seek.assert_called_once()
+    assert reader.fObj.read.call_count == 3
+    assert reader.position == len(PLAINTEXT)
+
+
+@pytest.mark.parametrize('chunk_size', [1024 * 1024, 'auto'])
+def test_seek_block_ignores_large_chunk_size(encrypted_file, chunk_size):
+    reader = Reader(fname=encrypted_file, password='foo',
+                    chunk_size=chunk_size)
+    reader.chunk_size = reader.MAX_CHUNK_SIZE
+    reader.fObj = mock.Mock(wraps=reader.fObj)
 
+    for pos in (12345, 20000):
+        reader.fObj.read.reset_mock()
+        reader.seek(pos)
+        assert reader.read(1) == PLAINTEXT[pos]
+        assert reader.fObj.read.call_args_list == [
+            mock.call(reader.bs), mock.call(2 * reader.bs)]
+    assert reader.chunk_size == reader.MAX_CHUNK_SIZE
 
-def test_decrypt_chunk_appends_steam_one_line(reader):
-    expected_stream = 'Bar'
-    reader.chunk_unprocessed = expected_stream
-    reader.fObj.read.return_value = '1' * 16
+
+def test_seek_block_backwards_and_forwards(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+    reader.seek(30000)
+    for pos in (7, 0, 16, 17, 12345, 20000, 33):
+        reader.seek(pos)
+        assert reader.read(40) == PLAINTEXT[pos:pos + 40]
+        assert reader.position == pos + 40
+
+
+def test_seek_block_past_end_reads_nothing(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+    reader.seek(len(PLAINTEXT) + 100)
+
+    assert reader.read() == ''
+    assert reader.position == len(PLAINTEXT) + 100
+
+
+def test_decrypt_chunk_reads_chunk_size(reader):
+    reader.chunk_size = 32
+    reader.fObj.read.return_value = '1' * 32
     reader.decrypt_chunk()
 
-    assert reader.stream == expected_stream
-    assert reader.streamLines == 0
-    assert reader.fileOpen
+    reader.fObj.read.assert_called_once_with(32)
+
 
+def test_decrypt_chunk_tunes_chunk_size(reader):
+    reader.autoTune = True
+    reader.chunk_size = 32
+    reader.fObj.read.return_value = '1' * 32
+    with mock.patch.object(reader, 'tune_chunk_size') as m:
+        reader.decrypt_chunk()
 
-def test_decrypt_chunk_appends_steam_two_line(reader):
-    expected_stream = 'Bar\nBaz'
-    reader.chunk_unprocessed = expected_stream
-    reader.fObj.read.return_value = '1' * 16
+    m.assert_called_once()
+
+
+def test_auto_chunk_size_round_trip(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo', chunk_size='auto')
+    initial_size = reader.chunk_size
+
+    assert reader.read() == PLAINTEXT
+    assert reader.chunk_size >= initial_size
+
+
+def test_decrypt_chunk_holds_back_last_block(reader):
+    reader.fObj.read.return_value = '1' * 32
+    set_stream(reader, 'Foo', held_back='1' * 16)
     reader.decrypt_chunk()
 
-    assert reader.stream == expected_stream
-    assert reader.streamLines == 1
+    assert len(reader.stream) == 3 + 16 + 32
+    assert reader.stream_end == 3 + 32
     assert reader.fileOpen
 
 
-def test_decrypt_chunk_processes_chunk_when_no_cipher_left(reader):
-    expected_stream = '1' * 128
-    reader.chunk_unprocessed = expected_stream
+def test_decrypt_chunk_removes_padding_when_no_cipher_left(reader):
     reader.fObj.read.return_value = ''
+    set_stream(reader, 'Foo', held_back='1' * 13 + '\x03' * 3)
     reader.decrypt_chunk()
 
-    assert reader.stream == expected_stream[:-49]
-    assert reader.streamLines == 0
+    assert reader.stream == bytearray('Foo' + '1' * 13)
+    assert reader.stream_end == 16
     assert not reader.fileOpen
+
+
+def test_decrypt_chunk_without_held_back_block(reader):
+    reader.fObj.read.return_value = ''
+    set_stream(reader, 'Foo')
+    reader.decrypt_chunk()
+
+    assert reader.stream == bytearray('Foo')
+    assert not reader.fileOpen
+
+
+@pytest.fixture(params=['zlib', 'bz2'])
+def compressed_file(tmpdir, request):
+    yield write_file(str(tmpdir.join('foo.txt')), PLAINTEXT + 'x' * 100000,
+                     compression=request.param)
+
+
+def test_compressed_file_reads_lines(compressed_file):
+    reader = Reader(fname=compressed_file, password='foo', chunk_size=64)
+
+    assert list(reader)[:5000] == PLAINTEXT.splitlines(True)
+    assert reader.tell() == len(PLAINTEXT) + 100000
+
+
+def test_compressed_file_limits_decompressed_chunks(compressed_file):
+    reader = Reader(fname=compressed_file, password='foo', chunk_size=64)
+    reader.seek(len(PLAINTEXT))
+    buffered = len(reader.stream)
+    reader.decrypt_chunk()
+
+    if reader.codec == 1:
+        assert len(reader.stream) - buffered <= 64
+        assert reader.compressed_tail
+    assert reader.read() == 'x' * 100000
+
+
+def test_bz2_is_fed_in_slices(reader):
+    reader.chunk_size = 64
+    reader.decompressor = mock.Mock(spec=['decompress'])
+    reader.decompressor.decompress.return_value = 'x' * 40
+    reader.decompress('y' * 1000)
+
+    assert reader.decompressor.decompress.call_args_list == [
+        mock.call('y' * 16), mock.call('y' * 16)]
+    assert reader.stream == bytearray('x' * 80)
+    assert reader.stream_end == 80
+    assert reader.compressed_tail == 'y' * (1000 - 32)
+
+
+def test_compressed_file_keeps_position_past_end(compressed_file):
+    size = len(PLAINTEXT) + 100000
+    reader = Reader(fname=compressed_file, password='foo')
+
+    assert reader.seek(size + 100) == size + 100
+    assert reader.read() == ''
+    assert reader.tell() == size + 100
+    reader.seek(5)
+    assert reader.read(3) == PLAINTEXT[5:8]
+
+
+def test_compressed_file_seeks(compressed_file):
+    plaintext = PLAINTEXT + 'x' * 100000
+    reader = Reader(fname=compressed_file, password='foo', seek_window=0)
+    for pos in (30000, 1000, 0, len(PLAINTEXT) - 10, 5):
+        reader.seek(pos)
+        assert reader.read(1000) == plaintext[pos:pos + 1000]
+
+    reader.seek(10 ** 6)
+    assert reader.read() == ''
+
+
+def test_compressed_file_readinto(compressed_file):
+    reader = Reader(fname=compressed_file, password='foo')
+    b = bytearray(len(PLAINTEXT))
+
+    assert reader.readinto(b) == len(PLAINTEXT)
+    assert str(b) == PLAINTEXT
+
+
+def test_compressed_file_has_no_size(compressed_file):
+    reader = Reader(fname=compressed_file, password='foo')
+    with pytest.raises(IOError):
+        reader.size
+
+
+def write_slowly(fname, pieces, **kwargs):
+    for piece in pieces:
+        with Writer(fname=fname, password='foo', append=True, **kwargs) as f:
+            for line in piece:
+                f.write(line)
+                f.flush()
+                time.sleep(0.001)
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'segment_size': 48}])
+def test_follow_reads_lines_while_written(tmpdir, kwargs):
+    fname = str(tmpdir.join('foo.txt'))
+    lines = PLAINTEXT.splitlines(True)[:300]
+    pieces = [lines[i:i + 100] for i in range(0, len(lines), 100)]
+    write_slowly(fname, pieces[:1], **kwargs)
+    writer = threading.Thread(target=write_slowly,
+                              args=(fname, pieces[1:]), kwargs=kwargs)
+    writer.start()
+
+    reader = Reader(fname=fname, password='foo', follow=True,
+                    poll_interval=0.001, idle_timeout=0.5)
+    assert list(reader) == lines
+    writer.join()
+
+
+def test_follow_waits_for_partial_blocks(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    write_file(fname, PLAINTEXT[:100])
+    data = tmpdir.join('foo.txt').read('rb')
+    tmpdir.join('foo.txt').write(data[:56], 'wb')
+
+    reader = Reader(fname=fname, password='foo', follow=True,
+                    poll_interval=0.001, idle_timeout=0.05)
+    assert reader.read(10) == PLAINTEXT[:10]
+    assert reader.partial_block == data[48:56]
+    tmpdir.join('foo.txt').write(data, 'wb')
+    assert reader.read() == PLAINTEXT[10:100]
+
+
+def test_follow_leaves_passed_file_open(encrypted_file):
+    passed = open(encrypted_file, 'rb')
+    reader = Reader(fname=passed, password='foo', follow=True,
+                    idle_timeout=0)
+
+    assert reader.fObj is not passed
+    assert reader.read() == PLAINTEXT
+    reader.close()
+    assert reader.closed and not passed.closed
+
+
+def test_follow_waits_for_header(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    tmpdir.join('foo.txt').write('')
+    start = time.time()
+
+    with pytest.raises(IOError):
+        Reader(fname=fname, password='foo', follow=True,
+               poll_interval=0.001, idle_timeout=0.05).size
+    assert time.time() - start >= 0.05
+
+
+@pytest.mark.parametrize('kwargs', [{'prefetch': 2}, {'use_mmap': True}])
+def test_follow_errors_with_prefetch_or_mmap(kwargs):
+    with pytest.raises(ValueError):
+        Reader(fname='foo.txt', password='foo', follow=True, **kwargs)
+
+
+# Raw stream returning at most 7 values per read, like a pipe
+class ShortReads(io.RawIOBase):
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.data.read(min(len(b), 7))
+        b[:len(data)] = data
+        return len(data)
+
+
+def test_reads_from_binary_streams(encrypted_file):
+    cipher_text = open(encrypted_file, 'rb').read()
+
+    assert Reader(io.BytesIO(cipher_text), password='foo').read() == \
+        PLAINTEXT
+    assert Reader(ShortReads(cipher_text), password='foo',
+                  enableSeek=False).read() == PLAINTEXT
+
+
+def test_stream_without_name_has_no_line_index(encrypted_file):
+    reader = Reader(io.BytesIO(open(encrypted_file, 'rb').read()),
+                    password='foo')
+
+    assert reader.load_line_index() is None
+    with pytest.raises(IOError):
+        reader.open_cipher_file()
+    with pytest.raises(ValueError):
+        Reader(io.BytesIO(), password='foo', follow=True)
+
+
+def test_read_negative_size_reads_all(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+
+    assert reader.read(5) == PLAINTEXT[:5]
+    assert reader.read(-1) == PLAINTEXT[5:]
+
+
+def test_read1_decrypts_at_most_a_chunk(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo', chunk_size=1024)
+
+    assert reader.read1(10) == PLAINTEXT[:10]
+    chunk = reader.read1()
+    assert len(chunk) < 1024
+    assert PLAINTEXT.startswith(PLAINTEXT[:10] + chunk)
+    reader.seek(-1, 2)
+    assert reader.read1(10) == PLAINTEXT[-1:]
+    assert reader.read1(10) == ''
+
+
+def test_readline_with_size(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+
+    assert reader.readline(3) == 'lin'
+    assert reader.readline(100) == 'e 0\n'
+    assert reader.readline(None) == 'line 1\n'
+
+
+def test_io_interface(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+
+    assert isinstance(reader, io.BufferedIOBase)
+    assert reader.readable() and reader.seekable()
+    assert not reader.writable()
+    assert reader.seek(10) == 10
+    reader.flush()
+    assert not reader.closed
+    reader.close()
+    assert reader.closed
+    assert not Reader(fname=encrypted_file, password='foo',
+                      enableSeek=False).seekable()
+
+
+def test_file_on_a_pipe_is_not_seekable(encrypted_file):
+    r, w = os.pipe()
+    with os.fdopen(w, 'wb') as f:
+        f.write(open(encrypted_file, 'rb').read(4096))
+
+    with Reader(fname=os.fdopen(r, 'rb'), password='foo') as reader:
+        assert not reader.seekable()
+        assert reader.read(10) == PLAINTEXT[:10]
+
+
+def test_text_and_buffered_readers_on_top(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+    text = io.TextIOWrapper(reader, encoding='ascii')
+
+    assert list(text) == PLAINTEXT.decode('ascii').splitlines(True)
+    text.seek(0)
+    assert text.readline() == u'line 0\n'
+
+    buffered = io.BufferedReader(Reader(fname=encrypted_file,
+                                        password='foo'))
+    assert buffered.read(10) == PLAINTEXT[:10]
+    assert buffered.peek(1).startswith(PLAINTEXT[10])
+    assert list(csv.reader(buffered, delimiter=' '))[0] == ['e', '1']
+
+
+@pytest.mark.parametrize('kwargs,reader_kwargs', [
+    ({}, {}), ({'segment_size': 1024}, {}), ({}, {'use_mmap': True})])
+def test_read_at_reads_ranges(tmpdir, kwargs, reader_kwargs):
+    fname = write_file(str(tmpdir.join('foo.txt')), **kwargs)
+    reader = Reader(fname=fname, password='foo', **reader_kwargs)
+
+    for offset, size in [(0, 10), (5, 3000), (1023, 2), (16, 16),
+                         (len(PLAINTEXT) - 5, 100), (len(PLAINTEXT), 1),
+                         (0, len(PLAINTEXT) + 1)]:
+        assert reader.read_at(offset, size) == \
+            PLAINTEXT[offset:offset + size]
+    assert reader.tell() == 0
+    assert reader.readline() == 'line 0\n'
+
+
+def test_read_at_from_many_threads(encrypted_file):
+    reader = Reader(fname=encrypted_file, password='foo')
+    ranges = [(i * 37 % len(PLAINTEXT), i % 500) for i in range(1000)]
+
+    def read_range(args):
+        offset, size = args
+        return reader.read_at(offset, size)
+
+    pool = ThreadPool(8)
+    try:
+        results = pool.map(read_range, ranges)
+    finally:
+        pool.terminate()
+    for (offset, size), result in zip(ranges, results):
+        assert result == PLAINTEXT[offset:offset + size]
+
+    reader.close()
+    assert reader.positional is None
+
+
+def test_read_at_empty_file(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    Writer(fname=fname, password='foo').close()
+
+    assert Reader(fname=fname, password='foo').read_at(0, 10) == ''
+
+
+def test_read_at_errors(tmpdir, compressed_file):
+    with pytest.raises(IOError):
+        Reader(fname=compressed_file, password='foo').read_at(0, 10)
+
+    fname = str(tmpdir.join('bar.txt'))
+    write_file(fname, PLAINTEXT)
+    with pytest.raises(IOError):
+        Reader(fname=fname, password='foo').read_at(-1, 10)
+    with pytest.raises(IOError):
+        Reader(io.BytesIO(open(fname, 'rb').read()),
+               password='foo').read_at(0, 10)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {}, {'segment_size': 1024}, {'compression': 'zlib'}])
+def test_wrong_key_fails_at_the_padding(tmpdir, kwargs):
+    fname = write_file(str(tmpdir.join('foo.txt')), **kwargs)
+    reader = Reader(fname=fname, password='bar')
+
+    with pytest.raises(IOError):
+        reader.check_key()
+    with pytest.raises((IOError, zlib.error)):
+        reader.read()
+    if not kwargs.get('compression'):
+        with pytest.raises(IOError):
+            Reader(fname=fname, password='bar').size
+        with pytest.raises(IOError):
+            Reader(fname=fname, password='bar').read_at(0, 10)
+
+
+def test_check_key_of_stream_that_cannot_seek(encrypted_file):
+    r, w = os.pipe()
+    os.close(w)
+    reader = Reader(fname=open(encrypted_file, 'rb'), password='bar')
+    reader.fObj = os.fdopen(r, 'rb')
+    reader.check_key()
+
+
+def test_failing_constructor_closes_cleanly(encrypted_file, capsys):
+    stream = io.BytesIO(open(encrypted_file, 'rb').read())
+    with pytest.raises(ValueError):
+        Reader(fname=stream, password='foo', follow=True)
+    gc.collect()
+
+    assert stream.closed
+    assert 'ignored' not in capsys.readouterr()[1]
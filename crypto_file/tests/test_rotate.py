@@ -0,0 +1,126 @@
+import mock
+import pytest
+
+from crypto_file import rotate
+from crypto_file.line_index import LineIndex
+from crypto_file.reader import Reader
+from crypto_file.tests.helpers import PLAINTEXT, write_file
+
+
+@pytest.mark.parametrize('kwargs', [
+    {}, {'segment_size': 1024}, {'compression': 'bz2'}])
+def test_rekey_keeps_format(tmpdir, kwargs):
+    src = str(tmpdir.join('foo.txt'))
+    dst = str(tmpdir.join('bar.txt'))
+    write_file(src, **kwargs)
+
+    with mock.patch.object(rotate, 'COPY_SIZE', 1000):
+        assert rotate.rekey(src, dst, 'foo', new_password='bar') == len(
+            PLAINTEXT)
+
+    old = Reader(fname=src, password='foo')
+    new = Reader(fname=dst, password='bar')
+    assert new.read() == PLAINTEXT
+    assert new.salt != old.salt
+    assert new.segment_blocks == old.segment_blocks
+    assert new.codec == old.codec
+
+
+def test_rekey_needs_new_password_or_key(tmpdir):
+    with pytest.raises(ValueError):
+        rotate.rekey('foo.txt', 'bar.txt', 'foo')
+
+
+def test_rekey_carries_line_index_over(tmpdir):
+    src = str(tmpdir.join('foo.txt'))
+    dst = str(tmpdir.join('bar.txt'))
+    write_file(src, line_index=10)
+
+    rotate.rekey(src, dst, 'foo', new_password='bar')
+
+    reader = Reader(fname=dst, password='bar')
+    line_index = reader.load_line_index()
+    assert line_index.stride == 10
+    assert line_index.offsets == reader.build_line_index(10).offsets
+
+
+def test_rekey_inplace_replaces_file_and_sidecar(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    write_file(fname, line_index=True)
+
+    rotate.rekey_inplace(fname, 'foo', new_password='bar')
+
+    reader = Reader(fname=fname, password='bar')
+    assert reader.read() == PLAINTEXT
+    assert reader.load_line_index() is not None
+    assert tmpdir.listdir() == [tmpdir.join('foo.txt'),
+                                tmpdir.join('foo.txt.lidx')]
+
+
+def test_rekey_inplace_drops_stale_sidecar(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    write_file(fname, line_index=True)
+    write_file(fname)
+
+    rotate.rekey_inplace(fname, 'foo', new_password='bar')
+
+    assert not tmpdir.join('foo.txt.lidx').exists()
+    assert Reader(fname=fname, password='bar').getline(10) == 'line 10\n'
+
+
+def test_rekey_inplace_leaves_file_on_error(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    write_file(fname, line_index=True)
+    before = tmpdir.join('foo.txt').read('rb')
+
+    with mock.patch.object(rotate, 'replace_file', side_effect=OSError):
+        with pytest.raises(OSError):
+            rotate.rekey_inplace(fname, 'foo', new_password='bar')
+
+    assert tmpdir.join('foo.txt').read('rb') == before
+    assert sorted(p.basename for p in tmpdir.listdir()) == [
+        'foo.txt', 'foo.txt.lidx']
+
+
+@pytest.mark.parametrize('kwargs', [
+    {}, {'segment_size': 1024}, {'compression': 'zlib'}])
+def test_rekey_inplace_with_wrong_key_leaves_file(tmpdir, kwargs):
+    fname = write_file(str(tmpdir.join('foo.txt')), password='right',
+                       **kwargs)
+    before = tmpdir.join('foo.txt').read('rb')
+
+    with mock.patch.object(rotate, 'Writer') as writer:
+        with pytest.raises(IOError):
+            rotate.rekey_inplace(fname, 'WRONG', new_password='new')
+
+    writer.assert_not_called()
+    assert tmpdir.join('foo.txt').read('rb') == before
+    assert [p.basename for p in tmpdir.listdir()] == ['foo.txt']
+
+
+def test_rekey_files_in_parallel(tmpdir):
+    fnames = [str(tmpdir.join('foo{}.txt'.format(i))) for i in range(5)]
+    for fname in fnames:
+        write_file(fname)
+
+    total = rotate.rekey_files(fnames, 'foo', new_password='bar', workers=3)
+
+    assert total == 5 * len(PLAINTEXT)
+    for fname in fnames:
+        assert Reader(fname=fname, password='bar').read() == PLAINTEXT
+
+
+def test_rekey_files_defaults_to_cpu_count(tmpdir):
+    with mock.patch.object(rotate, 'cpu_count', return_value=1) as count:
+        assert rotate.rekey_files([], 'foo', new_password='bar') == 0
+    count.assert_called_once()
+
+
+def test_replace_file_moves_sidecar(tmpdir):
+    tmpdir.join('foo.tmp').write('foo')
+    tmpdir.join(LineIndex.sidecar_name('foo.tmp')).write('index')
+
+    rotate.replace_file(str(tmpdir.join('foo.tmp')), str(tmpdir.join('foo')))
+
+    assert tmpdir.join('foo').read() == 'foo'
+    assert tmpdir.join('foo.lidx').read() == 'index'
@@ -0,0 +1,183 @@
+import gc
+import io
+import os
+import weakref
+
+import mock
+import pytest
+
+from crypto_file import stats
+from crypto_file.reader import Reader
+from crypto_file.stats import Stats, TimedCipher, TimedFile
+from crypto_file.tests.helpers import PLAINTEXT, write_file
+from crypto_file.writer import Writer
+
+
+@pytest.fixture()
+def hook():
+    hook = mock.Mock()
+    stats.register_hook(hook)
+    yield hook
+    stats.unregister_hook(hook)
+
+
+# Two writes and a close, so there are calls and chunks to count
+def write_twice(fname, **kwargs):
+    with Writer(fname=fname, password='foo', chunk_size=1024,
+                **kwargs) as f:
+        f.write(PLAINTEXT[:1000])
+        f.write(PLAINTEXT[1000:])
+    return f
+
+
+def test_disabled_stats_leave_handler_alone(tmpdir):
+    writer = write_twice(str(tmpdir.join('foo.txt')))
+    reader = Reader(fname=str(tmpdir.join('foo.txt')), password='foo')
+
+    for handler in (writer, reader):
+        assert handler.stats is None
+        assert isinstance(handler.fObj, file)  # noqa: F821
+        assert 'new_cipher' not in vars(handler)
+        assert 'close' not in vars(handler)
+
+
+def test_writer_stats(tmpdir, hook):
+    fname = str(tmpdir.join('foo.txt'))
+    writer = write_twice(fname, stats=True)
+    counted = writer.stats
+
+    assert counted.name == fname
+    assert counted.plain_bytes == len(PLAINTEXT)
+    assert counted.cipher_bytes == os.path.getsize(fname)
+    assert counted.calls == 3
+    assert counted.chunks == 2
+    assert counted.buffer_peak == len(PLAINTEXT)
+    assert counted.cipher_time > 0 and counted.io_time > 0
+    assert counted.key_time > 0
+    hook.assert_called_once_with(counted)
+
+
+def test_reader_stats(tmpdir, hook):
+    fname = str(tmpdir.join('foo.txt'))
+    write_file(fname)
+
+    with Reader(fname=fname, password='foo', stats=True,
+                chunk_size=1024) as f:
+        lines = list(f)
+        f.seek(100)
+        f.read(10)
+        f.seek(40000)
+        buf = bytearray(10)
+        f.readinto(buf)
+        f.read1(5)
+    counted = f.stats
+
+    assert len(lines) == 5000
+    assert counted.plain_bytes == len(PLAINTEXT) + 25
+    assert counted.seeks == 2
+    assert counted.seek_distance == (len(PLAINTEXT) - 100) + (40000 - 110)
+    assert counted.cipher_bytes >= os.path.getsize(fname)
+    assert counted.chunks >= len(PLAINTEXT) // 1024
+    hook.assert_called_once_with(counted)
+
+
+def test_closing_twice_publishes_once(tmpdir, hook):
+    process = Stats()
+    with mock.patch.object(stats, 'PROCESS_STATS', process):
+        writer = write_twice(str(tmpdir.join('foo.txt')), stats=True)
+        writer.close()
+
+    hook.assert_called_once_with(writer.stats)
+    assert process.plain_bytes == len(PLAINTEXT)
+
+
+def test_only_outer_calls_are_timed(tmpdir):
+    fname = write_file(str(tmpdir.join('foo.txt')), compression='zlib')
+    reader = Reader(fname=fname, password='foo', stats=True)
+
+    # Seeking forward in a compressed file reads up to the position
+    reader.seek(1000)
+    assert reader.stats.calls == 1
+    assert reader.stats.plain_bytes == 0
+
+
+def test_add_and_as_dict():
+    total = Stats('total')
+    one = Stats()
+    one.plain_bytes = 10
+    one.io_time = 1.0
+    one.cipher_time = 3.0
+    one.buffer_peak = 5
+    total.add(one)
+    total.add(one)
+
+    counted = total.as_dict()
+    assert counted['name'] == 'total'
+    assert counted['plain_bytes'] == 20
+    assert counted['buffer_peak'] == 5
+    assert counted['total_time'] == 8.0
+    assert counted['io_share'] == 0.25
+    assert Stats().io_share == 0.0
+    assert 'plain_bytes=20' in repr(total)
+
+
+def test_timed_file_counts_io():
+    counted = Stats()
+    fObj = TimedFile(io.BytesIO(), counted)
+
+    fObj.write('foo')
+    fObj.flush()
+    fObj.seek(1)
+    assert fObj.read() == 'oo'
+    assert fObj.tell() == 3
+    assert counted.cipher_bytes == 5
+    assert counted.io_time > 0
+
+
+def test_timed_cipher_counts_cipher_time():
+    counted = Stats()
+    cipher = mock.Mock()
+    timed = TimedCipher(cipher, counted)
+
+    timed.encrypt('foo')
+    timed.decrypt('bar', output='baz')
+    cipher.decrypt.assert_called_once_with('bar', output='baz')
+    assert counted.cipher_time > 0
+
+
+def test_unclosed_handlers_are_collected(tmpdir, hook):
+    fname = str(tmpdir.join('foo.txt'))
+    writer = Writer(fname=fname, password='foo', stats=True)
+    writer.write(PLAINTEXT)
+    reader = Reader(fname=write_file(str(tmpdir.join('bar.txt'))),
+                    password='foo', stats=True)
+    reader.read(10)
+    refs = weakref.ref(writer), weakref.ref(reader)
+    del writer, reader
+    gc.collect()
+
+    assert gc.garbage == []
+    assert [ref() for ref in refs] == [None, None]
+    assert hook.call_count == 2
+    assert Reader(fname=fname, password='foo').read() == PLAINTEXT
+
+
+def test_instrumented_handler_is_a_subclass(tmpdir):
+    reader = Reader(fname=write_file(str(tmpdir.join('foo.txt'))),
+                    password='foo', stats=True)
+
+    assert isinstance(reader, Reader) and type(reader) is not Reader
+    assert type(reader).__name__ == 'Reader'
+    assert isinstance(reader, io.BufferedIOBase)
+    assert 'read' not in vars(reader)
+
+
+def test_followed_file_keeps_timed_file(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    write_file(fname)
+
+    reader = Reader(fname=fname, password='foo', follow=True,
+                    idle_timeout=0, stats=True)
+    assert isinstance(reader.fObj, TimedFile)
+    assert reader.read() == PLAINTEXT
+    assert reader.stats.io_time > 0
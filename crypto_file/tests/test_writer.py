@@ -1,8 +1,16 @@
 import base64
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
 
 import mock
 import pytest
 
+import crypto_file
+from crypto_file.reader import Reader
 from crypto_file.writer import Writer
 
 
@@ -57,6 +65,46 @@ def test_get_salt_generates_salt(writer, mock_open):
     writer.get_salt()
 
     assert writer.salt is not None
+    writer.fObj.write.assert_called_once_with('Salted__' + writer.salt)
+
+
+def test_get_salt_writes_segmented_header(writer, mock_open):
+    writer.segment_size = 1024
+    writer.get_salt()
+
+    header = writer.fObj.write.call_args[0][0]
+    assert header == ('CrFileV2' + writer.salt + '\x00\x00\x04\x00' +
+                      12 * '\x00')
+
+
+def test_get_salt_writes_compression_codec(writer, mock_open):
+    writer.codec = 3
+    writer.get_salt()
+
+    header = writer.fObj.write.call_args[0][0]
+    assert header == ('CrFileV2' + writer.salt +
+                      4 * '\x00' + '\x03' + 11 * '\x00')
+
+
+def test_init_errors_for_compressed_line_index(mock_open):
+    with pytest.raises(ValueError):
+        Writer(fname='foo.txt', password='foo', compression='zlib',
+               line_index=True)
+
+
+def test_init_defaults_segment_size_with_workers(mock_open):
+    writer = Writer(fname='foo.txt', password='foo', workers=2)
+
+    assert writer.segment_size == Writer.DEFAULT_SEGMENT_SIZE
+    assert writer.pool is not None
+    writer.pool.terminate()
+
+
+def test_init_rounds_segment_size(mock_open):
+    writer = Writer(fname='foo.txt', password='foo', segment_size=1000)
+
+    assert writer.segment_size == 992
+    assert writer.pool is None
 
 
 def test_write_adds_input_to_steam_and_checks_buffer(writer):
@@ -68,15 +116,97 @@ def test_write_adds_input_to_steam_and_checks_buffer(writer):
     assert writer.stream == "Foo"
 
 
+def test_write_accepts_buffers(writer):
+    writer.write(bytearray("Foo"))
+    writer.write(memoryview("Bar")[1:])
+
+    assert writer.stream == "Fooar"
+
+
+def test_write_encrypts_large_input_without_buffering(writer):
+    writer.fObj = mock.Mock(spec=file)
+    writer.write('1' * (1024 * writer.bs + 3))
+
+    writer.fObj.write.assert_called_once()
+    assert len(writer.fObj.write.call_args[0][0]) == 1024 * writer.bs
+    assert writer.stream == '111'
+
+
 def test_check_write_buffer_with_large_enough_stream(writer):
     writer.fObj = mock.Mock(spec=file)
-    writer.stream = '1' * 1024 * writer.bs
+    writer.stream = bytearray('1' * 1024 * writer.bs)
     writer.check_write_buffer()
 
     writer.fObj.write.assert_called_once()
     assert writer.stream == ''
 
 
+def test_check_write_buffer_keeps_partial_block(writer):
+    writer.fObj = mock.Mock(spec=file)
+    writer.stream = bytearray('1' * (3000 * writer.bs + 5))
+    writer.check_write_buffer()
+
+    writer.fObj.write.assert_called_once()
+    assert len(writer.fObj.write.call_args[0][0]) == 3000 * writer.bs
+    assert writer.stream == '1' * 5
+
+
+def test_check_write_buffer_retains_small_stream(writer):
+    writer.fObj = mock.Mock(spec=file)
+    writer.stream = bytearray('1' * 100)
+    writer.check_write_buffer()
+
+    assert not writer.fObj.write.called
+    assert len(writer.stream) == 100
+
+
+def test_check_write_buffer_uses_chunk_size(writer):
+    writer.fObj = mock.Mock(spec=file)
+    writer.chunk_size = 32
+    writer.stream = bytearray('1' * 40)
+    writer.check_write_buffer()
+
+    writer.fObj.write.assert_called_once()
+    assert writer.stream == '1' * 8
+
+
+def test_check_write_buffer_tunes_chunk_size(writer):
+    writer.fObj = mock.Mock(spec=file)
+    writer.autoTune = True
+    writer.stream = bytearray('1' * 1024 * writer.bs)
+    with mock.patch.object(writer, 'tune_chunk_size') as m:
+        writer.check_write_buffer()
+
+    m.assert_called_once()
+
+
+def test_encrypt_restarts_cipher_at_segment_boundary(writer):
+    writer.fObj = mock.Mock(spec=file)
+    writer.segment_size = 32
+    writer.segment_fill = 16
+    writer.encrypt(memoryview('1' * 64))
+
+    assert [len(c[0][0]) for c in writer.fObj.write.call_args_list] == [
+        16, 32, 16]
+    assert writer.segment_index == 2
+    assert writer.segment_fill == 16
+
+
+def test_dispatch_segments_hands_segments_to_pool(writer):
+    writer.fObj = mock.Mock(spec=file)
+    writer.segment_size = 32
+    writer.workers = 1
+    writer.pool = mock.Mock()
+    writer.stream = bytearray('1' * 70)
+    writer.dispatch_segments()
+
+    assert writer.pool.apply_async.call_count == 2
+    assert writer.fObj.write.call_count == 1
+    assert len(writer.pending) == 1
+    assert writer.segment_index == 2
+    assert writer.stream == '1' * 6
+
+
 def test_close_does_nothing_when_file_already_closed(writer):
     writer.fObj = mock.Mock(spec=file)
     writer.fObj.closed = True
@@ -86,6 +216,17 @@ def test_close_does_nothing_when_file_already_closed(writer):
     assert not writer.stream
 
 
+def test_close_pads_complete_blocks(writer):
+    writer.fObj = mock.Mock(spec=file)
+    writer.fObj.closed = False
+    writer.stream = bytearray('1' * writer.bs)
+    writer.close()
+
+    writer.fObj.write.assert_called_once()
+    assert len(writer.fObj.write.call_args[0][0]) == 2 * writer.bs
+    assert writer.stream == '1' * writer.bs + writer.bs * chr(writer.bs)
+
+
 def test_close_handles_partial_stream(writer):
     writer.fObj = mock.Mock(spec=file)
     writer.fObj.closed = False
@@ -106,3 +247,291 @@ def test_close_with_no_partial_stream_writes_to_file(writer):
     writer.fObj.write.assert_called_once()
     writer.fObj.close.assert_called_once()
     assert writer.stream == writer.bs * chr(writer.bs)
+
+
+@pytest.mark.parametrize('chunk_size,segment_size,workers,write_behind', [
+    (None, None, None, None),
+    ('auto', None, None, None),
+    (64, None, None, None),
+    (None, 1000, None, None),
+    (64, 48, None, None),
+    (None, 1000, 3, None),
+    (64, 16, 2, None),
+    (64, None, None, 2),
+    (None, 1000, 3, 1),
+])
+def test_mixed_writes_round_trip(tmpdir, chunk_size, segment_size, workers,
+                                 write_behind):
+    fname = str(tmpdir.join('foo.txt'))
+    records = ['record {}\n'.format(i) for i in range(3000)]
+    records.append('1' * 40000)
+    with Writer(fname=fname, password='foo', chunk_size=chunk_size,
+                segment_size=segment_size, workers=workers,
+                write_behind=write_behind) as f:
+        for record in records:
+            f.write(record)
+        f.write(bytearray('Foo' * 10000))
+
+    with Reader(fname=fname, password='foo') as f:
+        assert f.read() == ''.join(records) + 'Foo' * 10000
+
+
+def test_close_raises_worker_errors(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    writer = Writer(fname=fname, password='foo', segment_size=16, workers=2)
+    with mock.patch('crypto_file.writer.encrypt_segment',
+                    side_effect=ValueError):
+        writer.write('1' * 32)
+        with pytest.raises(ValueError):
+            writer.close()
+
+    assert writer.pool is None
+
+
+def test_close_raises_write_behind_errors(writer):
+    writer.fObj = mock.Mock(spec=file)
+    writer.fObj.closed = False
+    writer.write_behind = mock.Mock()
+    writer.write_behind.close.side_effect = IOError
+
+    with pytest.raises(IOError):
+        writer.close()
+
+    writer.fObj.close.assert_called_once()
+    assert writer.write_behind is None
+
+
+@pytest.mark.parametrize('line_index,stride', [(True, 1000), (10, 10)])
+def test_close_saves_line_index(tmpdir, line_index, stride):
+    fname = str(tmpdir.join('foo.txt'))
+    plaintext = ''.join('line {}\n'.format(i) for i in range(3000))
+    with Writer(fname=fname, password='foo', line_index=line_index) as f:
+        f.write(plaintext[:100])
+        f.write(memoryview(plaintext)[100:])
+
+    reader = Reader(fname=fname, password='foo')
+    line_index = reader.load_line_index()
+    assert line_index.stride == stride
+    assert line_index.lines == 3000
+    assert line_index.offsets == reader.build_line_index(stride).offsets
+    assert reader.getline(2500) == 'line 2500\n'
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'gzip', 'bz2'])
+@pytest.mark.parametrize('segment_size,workers', [
+    (None, None), (1000, None), (1000, 3)])
+def test_compressed_writes_round_trip(tmpdir, compression, segment_size,
+                                      workers):
+    fname = str(tmpdir.join('foo.txt'))
+    plaintext = ''.join('record {}\n'.format(i) for i in range(20000))
+    with Writer(fname=fname, password='foo', compression=compression,
+                segment_size=segment_size, workers=workers) as f:
+        f.write(plaintext[:100])
+        f.write(bytearray(plaintext[100:50000]))
+        f.write(memoryview(plaintext)[50000:])
+
+    assert tmpdir.join('foo.txt').size() < len(plaintext) // 4
+    with Reader(fname=fname, password='foo') as f:
+        assert f.read() == plaintext
+
+
+@pytest.mark.parametrize('chunk_size,segment_size,workers', [
+    (None, None, None),
+    (16, None, None),
+    (None, 64, None),
+    (32, 1000, 2),
+])
+def test_append_continues_file(tmpdir, chunk_size, segment_size, workers):
+    fname = str(tmpdir.join('foo.txt'))
+    records = ['record {}\n'.format(i) for i in range(300)]
+    for i in range(0, len(records), 7):
+        with Writer(fname=fname, password='foo', chunk_size=chunk_size,
+                    segment_size=segment_size, workers=workers,
+                    append=True) as f:
+            f.write(''.join(records[i:i + 7]))
+
+    with Reader(fname=fname, password='foo') as f:
+        assert f.read() == ''.join(records)
+        assert f.size == len(''.join(records))
+
+
+def test_append_rewrites_only_last_block(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    with Writer(fname=fname, password='foo') as f:
+        f.write('1' * 100)
+    before = tmpdir.join('foo.txt').read('rb')
+
+    with Writer(fname=fname, password='foo', append=True) as f:
+        f.write('2' * 100)
+
+    after = tmpdir.join('foo.txt').read('rb')
+    assert after[:len(before) - 16] == before[:-16]
+    with Reader(fname=fname, password='foo') as f:
+        assert f.read() == '1' * 100 + '2' * 100
+
+
+def test_append_to_empty_file_writes_header(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    tmpdir.join('foo.txt').write('')
+    with Writer(fname=fname, password='foo', append=True) as f:
+        f.write('foo')
+
+    with Reader(fname=fname, password='foo') as f:
+        assert f.read() == 'foo'
+
+
+def test_append_with_wrong_key_leaves_file(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    with Writer(fname=fname, password='foo') as f:
+        f.write('foo')
+    before = tmpdir.join('foo.txt').read('rb')
+
+    with pytest.raises(IOError):
+        Writer(fname=fname, password='bar', append=True)
+    assert tmpdir.join('foo.txt').read('rb') == before
+
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'password': 'foo', 'compression': 'zlib'},
+    {'password': 'foo', 'line_index': True},
+])
+def test_append_errors_for_unsupported_options(kwargs):
+    with pytest.raises(ValueError):
+        Writer(fname='foo.txt', append=True, **kwargs)
+
+
+def test_append_errors_for_workers_without_segments(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    with Writer(fname=fname, password='foo') as f:
+        f.write('foo')
+
+    with pytest.raises(ValueError):
+        Writer(fname=fname, password='foo', workers=2, append=True)
+
+
+def test_append_errors_for_compressed_file(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    with Writer(fname=fname, password='foo', compression='zlib') as f:
+        f.write('foo')
+
+    with pytest.raises(IOError):
+        Writer(fname=fname, password='foo', append=True)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'segment_size': 64, 'workers': 2},
+    {'write_behind': 2},
+    {'compression': 'zlib'},
+])
+def test_flush_writes_complete_blocks(tmpdir, kwargs):
+    fname = str(tmpdir.join('foo.txt'))
+    plaintext = os.urandom(300)
+    writer = Writer(fname=fname, password='foo', **kwargs)
+    writer.write(plaintext[:230])
+    writer.flush()
+
+    assert tmpdir.join('foo.txt').size() > 200
+    assert len(writer.stream) < writer.bs
+    writer.write(plaintext[230:])
+    writer.close()
+
+    with Reader(fname=fname, password='foo') as f:
+        assert f.read() == plaintext
+
+
+def test_write_returns_size_and_tell_counts_plaintext(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    with Writer(fname=fname, password='foo', compression='zlib') as f:
+        assert f.write('foo') == 3
+        assert f.write(bytearray('barbaz')) == 6
+        assert f.tell() == 9
+
+    with Writer(fname=fname, password='foo') as f:
+        f.write('x' * 100)
+    with Writer(fname=fname, password='foo', append=True) as f:
+        assert f.tell() == 100
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_large_unaligned_write_returns_size(tmpdir, compression):
+    fname = str(tmpdir.join('foo.txt'))
+    plaintext = os.urandom(40001)
+    writer = Writer(fname=fname, password='foo', chunk_size=1024,
+                    compression=compression)
+    assert writer.write('x' * 20001) == 20001
+    writer.close()
+
+    with Writer(fname=fname, password='foo', chunk_size=1024,
+                compression=compression) as f:
+        buffered = io.BufferedWriter(f, buffer_size=8)
+        buffered.write(plaintext)
+        buffered.flush()
+
+    assert Reader(fname=fname, password='foo').read() == plaintext
+
+
+def test_round_trip_through_text_mode_pipe(tmpdir):
+    tmpdir.chdir()
+    r, w = os.pipe()
+    with Writer(fname=os.fdopen(w, 'w'), password='foo') as f:
+        f.write('foo' * 1000)
+    with Reader(fname=os.fdopen(r, 'r'), password='foo') as f:
+        assert f.read() == 'foo' * 1000
+
+    assert tmpdir.listdir() == []
+
+
+def test_writes_to_stdout(tmpdir):
+    script = ('import sys; from crypto_file import Writer\n'
+              'with Writer(sys.stdout, password="foo") as f:\n'
+              '    f.write("foo" * 1000)')
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(
+        os.path.dirname(crypto_file.__file__)))
+    process = subprocess.Popen([sys.executable, '-c', script],
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, cwd=str(tmpdir),
+                               env=env)
+    encrypted = process.communicate()[0]
+
+    assert process.returncode == 0
+    assert tmpdir.listdir() == []
+    with Reader(fname=io.BytesIO(encrypted), password='foo') as f:
+        assert f.read() == 'foo' * 1000
+
+
+def test_io_interface(writer):
+    assert isinstance(writer, io.BufferedIOBase)
+    assert writer.writable()
+    assert not writer.readable() and not writer.seekable()
+
+
+def test_writes_to_raw_stream(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    with Writer(fname=io.FileIO(fname, 'wb'), password='foo') as f:
+        shutil.copyfileobj(io.BytesIO('foo' * 10000), f)
+
+    assert Reader(fname=fname, password='foo').read() == 'foo' * 10000
+
+
+def test_init_errors_for_line_index_of_stream_without_name():
+    with pytest.raises(ValueError):
+        Writer(fname=io.BytesIO(), password='foo', line_index=True)
+
+
+def test_text_wrapper_and_tarfile_on_top(tmpdir):
+    fname = str(tmpdir.join('foo.txt'))
+    with io.TextIOWrapper(Writer(fname=fname, password='foo'),
+                          encoding='utf-8') as f:
+        f.write(u'caf\xe9\n')
+    assert Reader(fname=fname, password='foo').read() == 'caf\xc3\xa9\n'
+
+    with Writer(fname=fname, password='foo') as f:
+        with tarfile.open(fileobj=f, mode='w') as tar:
+            info = tarfile.TarInfo('foo')
+            info.size = 3
+            tar.addfile(info, io.BytesIO('bar'))
+    with Reader(fname=fname, password='foo') as f:
+        with tarfile.open(fileobj=f) as tar:
+            assert tar.extractfile('foo').read() == 'bar'
@@ -1,29 +1,128 @@
+import io
+import os
 import hashlib
 import base64
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer
 
 from Crypto.Cipher import AES
 from Crypto import Random
 
 from crypto_file import CryptoHandler
+from crypto_file.compression import compressor, get_codec, sync_flush
+from crypto_file.crypto_handler import SALTED_MAGIC, SEGMENTED_MAGIC
+from crypto_file.crypto_handler import SEGMENT_HEADER
+from crypto_file.line_index import LineIndex
+from crypto_file.pipeline import WriteBehind
 
 
 class Writer(CryptoHandler):
+    DEFAULT_SEGMENT_SIZE = 1024 * 1024
 
-    def __init__(self, fname, password=None, key=None, saveKey_file=None):
-        super(Writer, self).__init__(fname, password, key, 'wb')
+    def __init__(self, fname, password=None, key=None, saveKey_file=None,
+                 chunk_size=None, segment_size=None, workers=None,
+                 write_behind=None, line_index=None, compression=None,
+                 append=False, stats=False):
+
+        # Appending needs the existing key, a missing file is created
+        if append and key is None and password is None:
+            msg = 'Need either a password or a key (file) to append'
+            raise ValueError(msg)
+        if append and (compression or line_index):
+            msg = 'Cannot compress or index the lines when appending'
+            raise ValueError(msg)
+        if append and isinstance(fname, str) and not os.path.exists(fname):
+            append = False
+        name = getattr(fname, 'name', fname)
+        if line_index and not isinstance(name, str):
+            msg = 'Cannot index the lines of a stream without a name'
+            raise ValueError(msg)
+
+        mode = 'r+b' if append else 'wb'
+        super(Writer, self).__init__(fname, password, key, mode, chunk_size,
+                                     stats)
 
         # Write the key to the specified file
         if saveKey_file is not None:
             open(saveKey_file, 'wb').write(self.key)
 
         # Verify the file object is in write mode
-        self.check_mode('w')
+        # + an empty file is written from the start
+        if append:
+            self.check_mode('r+')
+            self.fObj.seek(0, 2)
+            append = self.fObj.tell() > 0
+            self.fObj.seek(0)
+        else:
+            self.check_mode('w')
 
-        self.get_salt()
-        self.gen_iv()
+        # Optionally compress the plaintext before encrypting it
+        # + 'zlib', 'gzip', 'bz2' or 'lzma', recorded in the header
+        # + line offsets do not survive compression
+        self.codec = get_codec(compression)
+        self.compressor = None
+        if self.codec:
+            if line_index:
+                msg = 'Cannot index the lines of a compressed file'
+                raise ValueError(msg)
+            self.compressor = compressor(self.codec)
+
+        # Use the segmented format when segments are requested
+        # + segments are encrypted independently, so a pool of workers
+        #  can encrypt complete segments concurrently
+        if workers is not None and segment_size is None:
+            segment_size = self.DEFAULT_SEGMENT_SIZE
+        if segment_size is not None:
+            segment_size = max(segment_size - segment_size % self.bs, self.bs)
+        self.segment_size = segment_size
+        self.segment_index = 0
+        self.segment_fill = 0
+
+        # Setup the object's stream [used as a write buffer]
+        # + a bytearray, so pending values are extended in place
+        # + position counts the plaintext values written
+        self.stream = bytearray()
+        self.position = 0
+
+        # + the file is left as it was if it cannot be appended to
+        if append:
+            try:
+                self.open_tail()
+                if workers is not None and self.segment_size is None:
+                    msg = 'Appending with workers needs a segmented file'
+                    raise ValueError(msg)
+            except Exception:
+                self.fObj.close()
+                raise
+        else:
+            self.get_salt()
+            self.gen_iv()
+
+            # Initiate the encryptor
+            self.cipher = self.new_cipher(self.iv)
+            if self.segment_size is not None:
+                self.cipher = self.new_cipher(self.gen_segment_iv(0))
+
+        self.workers = workers
+        self.pool = None
+        self.pending = deque()
+        if workers is not None:
+            self.pool = ThreadPool(workers)
+
+        # Optionally write up to write_behind chunks in a background thread
+        self.write_behind = None
+        if write_behind:
+            self.write_behind = WriteBehind(self.fObj, write_behind)
 
-        # Initiate the encryptor
-        self.cipher = AES.new(self.key, AES.MODE_CBC, self.iv)
+        # Optionally index every line_index-th line while writing,
+        # saved to a sidecar file on close (True for the default stride)
+        self.line_index = None
+        if line_index:
+            stride = LineIndex.DEFAULT_STRIDE
+            if line_index is not True:
+                stride = line_index
+            self.line_index = LineIndex(stride, self.salt)
 
     def gen_key(self):
         should_create_new_key = (self.key is None and
@@ -41,32 +140,209 @@ class Writer(CryptoHandler):
     def get_salt(self):
         # If it is a writable file need to
         # save the salt value to the start of the file
-        self.salt = Random.new().read(self.bs - len('Salted__'))
-        self.fObj.write('Salted__' + self.salt)
+        # + compressed files need the segmented format's header
+        self.salt = Random.new().read(self.bs - len(SALTED_MAGIC))
+        if self.segment_size is None and not self.codec:
+            self.fObj.write(SALTED_MAGIC + self.salt)
+        else:
+            self.fObj.write(SEGMENTED_MAGIC + self.salt + SEGMENT_HEADER.pack(
+                self.segment_size or 0, self.codec))
+
+    # Continue the cipher text of an existing file, in its own format
+    # + only the last cipher block is decrypted; its values without the
+    #  padding go back in the stream, to be encrypted again over the
+    #  old last block with the same IV
+    def open_tail(self):
+        self.read_header(self.fObj)
+        if self.codec:
+            raise IOError('Cannot append to a compressed file')
+        self.segment_size = None
+        if self.segment_blocks is not None:
+            self.segment_size = self.segment_blocks * self.bs
+        self.gen_iv()
 
+        self.fObj.seek(0, 2)
+        block = (self.fObj.tell() - self.header_size) // self.bs - 1
+        plain = self.decrypt_blocks(self.fObj, block, 1)
+        padding_length = self.padding_length(plain)
+
+        iv = self.seek_cipher_block(self.fObj, block)
+        self.fObj.seek(self.header_size + block * self.bs)
+        self.cipher = self.new_cipher(iv)
+        if self.segment_size is not None:
+            self.segment_index, fill = divmod(block, self.segment_blocks)
+            self.segment_fill = fill * self.bs
+        self.stream += plain[:-padding_length]
+        self.position = block * self.bs + len(self.stream)
+
+    # Write any bytes-like object (str, bytearray, memoryview),
+    # returning the number of values written
     def write(self, s):
-        self.stream += s
+        written = len(memoryview(s))
+        self.position += written
+        if self.compressor is not None:
+            s = self.compressor.compress(memoryview(s).tobytes())
+        view = memoryview(s)
+        if self.line_index is not None:
+            self.line_index.feed(s)
+
+        # Larger writes are encrypted straight from the caller's buffer
+        # when nothing is pending, only the partial block is kept
+        if (not self.stream and len(view) >= self.chunk_size and
+                self.pool is None):
+            size = len(view) - len(view) % self.bs
+            self.encrypt(view[:size])
+            view = view[size:]
+
+        self.stream += view
         self.check_write_buffer()
+        return written
 
     # Check if enough data is available to write an encrypted chunk
     def check_write_buffer(self):
-        # - retain partial chunks and only pad if the file is being closed
-        while len(self.stream) >= 1024 * self.bs:
-            chunk = self.stream[:1024*self.bs]
-            self.fObj.write(self.cipher.encrypt(chunk))
-            self.stream = self.stream[1024*self.bs:]
+        if self.pool is not None:
+            return self.dispatch_segments()
+
+        # - encrypt all complete blocks in one go
+        # - retain the partial block and only pad if the file is being closed
+        if len(self.stream) >= self.chunk_size:
+            if self.autoTune:
+                start = default_timer()
+
+            size = len(self.stream) - len(self.stream) % self.bs
+            self.encrypt(memoryview(self.stream)[:size])
+            del self.stream[:size]
+
+            if self.autoTune:
+                self.tune_chunk_size(default_timer() - start)
+
+    # Encrypt and write complete blocks
+    # + the cipher restarts with a new IV at every segment boundary
+    def encrypt(self, view):
+        if self.segment_size is None:
+            return self.write_cipher(self.cipher.encrypt(view))
+
+        while len(view):
+            size = min(len(view), self.segment_size - self.segment_fill)
+            self.write_cipher(self.cipher.encrypt(view[:size]))
+            view = view[size:]
+
+            self.segment_fill += size
+            if self.segment_fill == self.segment_size:
+                self.segment_index += 1
+                self.segment_fill = 0
+                iv = self.gen_segment_iv(self.segment_index)
+                self.cipher = self.new_cipher(iv)
+
+    def write_cipher(self, crypted):
+        (self.write_behind or self.fObj).write(crypted)
+
+    # Hand complete segments to the pool of workers
+    # + finished segments are written in order, with a couple of
+    #  segments per worker in flight
+    # + a segment partly written before appending is finished here
+    def dispatch_segments(self):
+        size = self.segment_size - self.segment_fill
+        if self.segment_fill and len(self.stream) >= size:
+            self.encrypt(memoryview(self.stream)[:size])
+            del self.stream[:size]
+
+        view = memoryview(self.stream)
+        offset = 0
+        while len(view) - offset >= self.segment_size:
+            segment = view[offset:offset + self.segment_size].tobytes()
+            offset += self.segment_size
+
+            iv = self.gen_segment_iv(self.segment_index)
+            self.segment_index += 1
+            self.pending.append(self.pool.apply_async(
+                encrypt_segment, (self.key, iv, segment)))
+            if len(self.pending) >= 2 * self.workers:
+                self.write_cipher(self.pending.popleft().get())
+
+        del view
+        del self.stream[:offset]
+
+    # Write all complete blocks out, e.g. for a Reader following the file
+    # + the partial block stays buffered until more values or close
+    def flush(self):
+        if self.compressor is not None:
+            self.stream += sync_flush(self.codec, self.compressor)
+        while self.pending:
+            self.write_cipher(self.pending.popleft().get())
+
+        size = len(self.stream) - len(self.stream) % self.bs
+        if size:
+            if self.pool is not None and not self.segment_fill:
+                iv = self.gen_segment_iv(self.segment_index)
+                self.cipher = self.new_cipher(iv)
+            self.encrypt(memoryview(self.stream)[:size])
+            del self.stream[:size]
+
+        if self.write_behind is not None:
+            self.write_behind.flush()
+        self.fObj.flush()
+
+    def tell(self):
+        return self.position
+
+    # io interface, so io.TextIOWrapper and the like can sit on top
+    def readable(self):
+        return False
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
 
     def close(self):
         if self.fObj.closed:
             return
 
-        # Check for a partial string and pad if necessary
-        if len(self.stream) == 0 or len(self.stream) % self.bs != 0:
-            padding_length = (self.bs - len(self.stream) % self.bs) or self.bs
-            self.stream += padding_length * chr(padding_length)
-        else:
-            self.fObj.write(self.cipher.encrypt(self.stream))
-            self.stream = self.bs * chr(self.bs)
+        # Finish the segments handed to the pool,
+        # the last segment is encrypted here
+        if self.pool is not None:
+            try:
+                while self.pending:
+                    self.write_cipher(self.pending.popleft().get())
+            finally:
+                self.pool.terminate()
+                self.pool = None
+            if not self.segment_fill:
+                iv = self.gen_segment_iv(self.segment_index)
+                self.cipher = self.new_cipher(iv)
+
+        # Whatever the compressor still holds goes in the last block(s)
+        if self.compressor is not None:
+            compressor, self.compressor = self.compressor, None
+            self.stream += compressor.flush()
+
+        # Pad the partial block, or add a block of padding
+        padding_length = self.bs - len(self.stream) % self.bs
+        self.stream += padding_length * chr(padding_length)
+
+        try:
+            self.encrypt(memoryview(self.stream))
+        finally:
+            # Wait for the background thread to write everything
+            try:
+                if self.write_behind is not None:
+                    write_behind, self.write_behind = self.write_behind, None
+                    write_behind.close()
+            finally:
+                super(Writer, self).close()
+
+        if self.line_index is not None:
+            line_index, self.line_index = self.line_index, None
+            with Writer(LineIndex.sidecar_name(self.name),
+                        key=self.password) as f:
+                f.write(line_index.dumps())
+
+
+io.BufferedIOBase.register(Writer)
+
 
-        self.fObj.write(self.cipher.encrypt(self.stream))
-        super(Writer, self).close()
+# Encrypt a complete segment with a cipher of its own
+def encrypt_segment(key, iv, segment):
+    return AES.new(key, AES.MODE_CBC, iv).encrypt(segment)
@@ -12,7 +12,10 @@ setup(
     url='http://github.com/efagerberg/crypto-file',
     packages=find_packages(exclude=('tests',)),
     keywords='encryption filehandling',
-    install_requires=['pycryptodome>=3.6.6'],
+    install_requires=['pycryptodome>=3.7.0'],
+    entry_points={
+        'console_scripts': ['crypto-file=crypto_file.cli:main'],
+    },
     setup_requires=['pytest-runner']
         if any(x in ('pytest', 'test') for x in sys.argv) else [],
     tests_require=['mock', 'pytest', 'pytest-cov', 'pytest-xdist'],